@@ -0,0 +1,111 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from polls.models import VoteActivity
+from collections import defaultdict
+from datetime import timedelta
+import struct
+
+# Vote activity of polls over time. New voters are counted into per-poll rollups (VoteActivity) as they are counted into the polls' totals
+# (see APPLY_COUNTER_DELTAS in POLLS app's votes module): one MINUTE row per poll and hour with 60 packed per-minute counters, so a busy
+# poll adds one small row an hour rather than one per vote. COMPACT_ACTIVITY (see the compact_vote_activity management command) later
+# folds minute rows older than POLLS_ACTIVITY_MINUTE_RETENTION_HOURS into HOUR rows holding the 24 hourly counts of a day.
+# ACTIVITY_HISTOGRAM reads a poll's rollups for a period with one query. All buckets are in UTC.
+
+SLOTS = {VoteActivity.MINUTE: 60, VoteActivity.HOUR: 24}
+STEPS = {VoteActivity.MINUTE: timedelta(minutes=1), VoteActivity.HOUR: timedelta(hours=1)}
+
+def pack(counts):
+	return struct.pack('<%dI' % len(counts), *counts)
+
+def unpack(data, resolution):
+	return list(struct.unpack('<%dI' % SLOTS[resolution], bytes(data)))
+
+def hour_of(when):
+	return when.replace(minute=0, second=0, microsecond=0)
+
+def day_of(when):
+	return when.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def bucket_start(when, resolution):
+	# Returns the start of the minute or hour (RESOLUTION) that WHEN falls in.
+	return when.replace(second=0, microsecond=0) if resolution == VoteActivity.MINUTE else hour_of(when)
+
+def rollup_slot(when, resolution):
+	# Returns the START of the rollup of RESOLUTION that counts the vote at WHEN (UTC), and the index of its counter.
+	if resolution == VoteActivity.MINUTE:
+		return hour_of(when), when.minute
+	return day_of(when), when.hour
+
+def add_activity(question_id, resolution, start, slot_counts):
+	# Adds SLOT_COUNTS ({counter index: votes}) to the rollup of RESOLUTION starting at START of the poll with QUESTION_ID, creating it if
+	# needed. Must be called inside a transaction. The rollup is written before it is read: a no-op UPDATE takes the write lock (the row's
+	# lock, and SQLite's database lock, as SQLite fails a transaction that reads and then writes with "database is locked" at once instead of
+	# waiting), and only then are its counters read and replaced. If another vote creates the rollup concurrently, the unique index rejects
+	# the second insert and the rollup is updated instead.
+	rollups = VoteActivity.objects.filter(question=question_id, resolution=resolution, start=start)
+	if not rollups.update(counts=F('counts')):
+		counts = [0] * SLOTS[resolution]
+		for slot, count in slot_counts.items():
+			counts[slot] += count
+		try:
+			with transaction.atomic():
+				VoteActivity.objects.create(question_id=question_id, resolution=resolution, start=start, counts=pack(counts))
+			return
+		except IntegrityError:
+			rollups.update(counts=F('counts'))
+	rollup_id, counts = rollups.values_list('id', 'counts').get()
+	counts = unpack(counts, resolution)
+	for slot, count in slot_counts.items():
+		counts[slot] += count
+	VoteActivity.objects.filter(pk=rollup_id).update(counts=pack(counts))
+
+def record_activity(question_counts, when=None):
+	# Counts the new voters of QUESTION_COUNTS (poll ids mapped to their numbers of new voters) into the minute rollups of their polls at
+	# WHEN (or now). Must be called inside a transaction.
+	start, slot = rollup_slot(timezone.now() if when is None else when.astimezone(timezone.utc), VoteActivity.MINUTE)
+	for question_id in sorted(question_counts):
+		if question_counts[question_id] > 0:
+			add_activity(question_id, VoteActivity.MINUTE, start, {slot: question_counts[question_id]})
+
+def activity_histogram(question_id, resolution, start, end):
+	# Returns the votes of the poll with QUESTION_ID in every bucket of RESOLUTION (a minute or an hour) from START to END (UTC), as a list
+	# of (bucket start, votes), reading its rollups with one query. Hourly counts include the minute rollups not compacted yet. Minutes
+	# that have been compacted into hours are no longer known and count 0 in a minute histogram.
+	step = STEPS[resolution]
+	start = bucket_start(start, resolution)
+	rollups = VoteActivity.objects.filter(question=question_id, start__gte=day_of(start), start__lt=end)
+	if resolution == VoteActivity.MINUTE:
+		rollups = rollups.filter(resolution=VoteActivity.MINUTE, start__gte=hour_of(start))
+	buckets = defaultdict(int)
+	for rollup_resolution, rollup_start, counts in rollups.values_list('resolution', 'start', 'counts'):
+		for slot, count in enumerate(unpack(counts, rollup_resolution)):
+			if count:
+				when = rollup_start + slot * STEPS[rollup_resolution]
+				buckets[bucket_start(when, resolution)] += count
+	histogram, when = [], start
+	while when < end:
+		histogram.append((when, buckets.get(when, 0)))
+		when += step
+	return histogram
+
+def compact_activity(older_than, batch_size=500):
+	# Folds up to BATCH_SIZE minute rollups of hours that ended before OLDER_THAN into hour rollups, in one transaction, and returns how many
+	# it folded (0 once there are none left).
+	cutoff = hour_of(older_than) - timedelta(hours=1)
+	with transaction.atomic():
+		rollups = list(VoteActivity.objects.select_for_update().filter(resolution=VoteActivity.MINUTE, start__lte=cutoff)
+			.order_by('start', 'id').values_list('id', 'question', 'start', 'counts')[:batch_size])
+		hours = defaultdict(lambda: defaultdict(int))
+		for rollup_id, question_id, start, counts in rollups:
+			day, slot = rollup_slot(start, VoteActivity.HOUR)
+			hours[(question_id, day)][slot] += sum(unpack(counts, VoteActivity.MINUTE))
+		for (question_id, day), slot_counts in sorted(hours.items()):
+			add_activity(question_id, VoteActivity.HOUR, day, slot_counts)
+		VoteActivity.objects.filter(pk__in=[rollup[0] for rollup in rollups]).delete()
+	return len(rollups)
+
+def minute_retention():
+	# Returns how long minute rollups are kept before they are compacted (POLLS_ACTIVITY_MINUTE_RETENTION_HOURS).
+	return timedelta(hours=getattr(settings, 'POLLS_ACTIVITY_MINUTE_RETENTION_HOURS', 48))
@@ -1,10 +1,22 @@
 from django.contrib import admin
-from polls.models import Question, Choice, DictforQuestion, Keyvalue
+from polls.models import Question, Choice, Vote
 
 # Register your models here.
 
 
-admin.site.register(Question)
+class VoteAdmin(admin.ModelAdmin):
+	# Ballots reference users, polls and choices by id, so the change form uses raw id fields instead of loading every user, poll and
+	# choice into select boxes.
+	list_display = ('question', 'user', 'choice')
+	raw_id_fields = ('question', 'user', 'choice')
+
+class QuestionAdmin(admin.ModelAdmin):
+	# TOTAL_VOTES misses the votes of sharded counters (see the Question model), so it is neither shown nor edited here; the
+	# reconcile_tallies command corrects drifted counters.
+	list_display = ('text', 'user', 'date_published', 'removed_at')
+	raw_id_fields = ('user',)
+	exclude = ('total_votes',)
+
+admin.site.register(Question, QuestionAdmin)
 admin.site.register(Choice)
-admin.site.register(DictforQuestion)
-admin.site.register(Keyvalue)
\ No newline at end of file
+admin.site.register(Vote, VoteAdmin)
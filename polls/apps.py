@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+
+# Application configuration for the POLLS app.
+
+class PollsConfig(AppConfig):
+	name = 'polls'
+	verbose_name = 'Polls'
+
+	def ready(self):
+		# Connects the app's signal receivers once all apps are loaded, along with the site's SQLite setup (see pollsite/db.py), which
+		# serializes the app's writes in production SQLite mode.
+		from polls import receivers
+		from pollsite import db
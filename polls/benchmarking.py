@@ -0,0 +1,47 @@
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from contextlib import contextmanager
+from timeit import default_timer
+import math
+import os
+import tempfile
+
+# Helpers shared by the POLLS app's benchmark management commands.
+
+@contextmanager
+def scratch_database(on_disk=False):
+	# Runs the enclosed benchmark against a throwaway, fully migrated test database, created the same way the test runner creates one, so
+	# benchmarks never touch the real database. SQLite test databases live in memory unless ON_DISK is set, in which case a temporary file
+	# is used (needed to measure journaling and locking behaviour).
+	setup_test_environment()
+	old_name = connection.settings_dict['NAME']
+	test_settings = connection.settings_dict.setdefault('TEST', {})
+	old_test_name = test_settings.get('NAME')
+	if on_disk and connection.vendor == 'sqlite':
+		handle, test_settings['NAME'] = tempfile.mkstemp(suffix='.sqlite3')
+		os.close(handle)
+	try:
+		connection.creation.create_test_db(verbosity=0, autoclobber=True)
+		try:
+			yield
+		finally:
+			connection.creation.destroy_test_db(old_name, verbosity=0)
+	finally:
+		test_settings['NAME'] = old_test_name
+		teardown_test_environment()
+
+class Stopwatch(object):
+	# Context manager measuring the wall-clock seconds spent in its block (available as ELAPSED afterwards).
+	def __enter__(self):
+		self.start = default_timer()
+		return self
+
+	def __exit__(self, *exc_info):
+		self.elapsed = default_timer() - self.start
+
+def percentile(values, fraction):
+	# Returns the FRACTION (0 to 1) percentile of VALUES by the nearest-rank method, or None if there are no values.
+	if not values:
+		return None
+	ordered = sorted(values)
+	return ordered[max(int(math.ceil(fraction * len(ordered))) - 1, 0)]
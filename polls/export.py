@@ -0,0 +1,51 @@
+from polls.models import Vote
+import csv
+import json
+
+# Exports of a poll's raw results: every ballot (voter, choice and when it was cast) followed by the per-choice totals, as CSV or as JSON
+# Lines. Ballots are read in chunks of CHUNK_SIZE in id order, each chunk picking up after the last id of the previous one (keyset paging,
+# so no chunk rescans what came before), and written out as they are read, so memory use does not grow with the size of the poll. The totals
+# are counted from the exported ballots themselves, so they always agree with them.
+
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson; charset=utf-8'}
+CSV_HEADER = ('record', 'user_id', 'username', 'choice_id', 'choice', 'voted_at', 'votes')
+
+def ballots(question, chunk_size=1000):
+	# Yields (user id, username, choice id, voted at) for every ballot of QUESTION, in ballot id order.
+	last_id = 0
+	while True:
+		chunk = list(Vote.objects.filter(question=question, id__gt=last_id).order_by('id')
+			.values_list('id', 'user_id', 'user__username', 'choice_id', 'voted_at')[:chunk_size])
+		for row in chunk:
+			yield row[1:]
+		if len(chunk) < chunk_size:
+			return
+		last_id = chunk[-1][0]
+
+def export_records(question, chunk_size=1000):
+	# Yields the records of the export of QUESTION as dictionaries: one 'ballot' record per ballot, then one 'total' record per choice.
+	choices = list(question.choice_set.order_by('id').values_list('id', 'choice_text'))
+	choice_texts, totals = dict(choices), dict((choice_id, 0) for choice_id, choice_text in choices)
+	for user_id, username, choice_id, voted_at in ballots(question, chunk_size):
+		totals[choice_id] = totals.get(choice_id, 0) + 1
+		yield {'record': 'ballot', 'user_id': user_id, 'username': username, 'choice_id': choice_id, 'choice': choice_texts.get(choice_id),
+			'voted_at': voted_at.isoformat()}
+	for choice_id, choice_text in choices:
+		yield {'record': 'total', 'choice_id': choice_id, 'choice': choice_text, 'votes': totals[choice_id]}
+
+class Line(object):
+	# A file-like object whose WRITE returns what it is given, so that CSV.WRITER formats one row at a time.
+	def write(self, value):
+		return value
+
+def export_lines(question, format, chunk_size=1000):
+	# Yields the export of QUESTION in FORMAT (one of FORMATS) line by line.
+	if format == 'csv':
+		writer = csv.writer(Line())
+		yield writer.writerow(CSV_HEADER)
+		for record in export_records(question, chunk_size):
+			yield writer.writerow([record.get(field, '') for field in CSV_HEADER])
+	else:
+		for record in export_records(question, chunk_size):
+			yield json.dumps(record) + '\n'
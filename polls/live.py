@@ -0,0 +1,95 @@
+from django.conf import settings
+from django.http import Http404
+from polls.results import get_poll_results
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+# Live poll results for the VOTE_POLL page, pushed to browsers as Server-Sent Events. RESULTS_FEED is an in-process publish/subscribe hub:
+# the RESULTS_CHANGED receiver (see POLLS app's receivers module) publishes the ids of polls whose counts changed, and every open stream of
+# one of those polls wakes up and sends the poll's new results. Bursts of votes are coalesced so that a stream sends at most one update per
+# POLLS_LIVE_INTERVAL_MS. The hub only sees votes recorded by the same process; streams also re-read the results on every heartbeat, which
+# picks up votes recorded elsewhere once they reach the shared results cache.
+
+HEARTBEAT_SECONDS = 15
+
+class ResultsFeed(object):
+	# Per-poll change counters guarded by one Condition. Counters are only kept for polls that have subscribers, so publishing votes on polls
+	# nobody is watching costs a dictionary lookup.
+	def __init__(self):
+		self.condition = threading.Condition()
+		self.versions = {}
+		self.subscribers = {}
+
+	@contextmanager
+	def subscription(self, question_id):
+		# Keeps the changes of the poll with QUESTION_ID counted while the block runs.
+		with self.condition:
+			self.subscribers[question_id] = self.subscribers.get(question_id, 0) + 1
+			self.versions.setdefault(question_id, 0)
+		try:
+			yield
+		finally:
+			with self.condition:
+				self.subscribers[question_id] -= 1
+				if not self.subscribers[question_id]:
+					del self.subscribers[question_id]
+					del self.versions[question_id]
+
+	def publish(self, question_ids):
+		# Counts a change of each subscribed poll in QUESTION_IDS and wakes up the waiting streams.
+		with self.condition:
+			changed = [question_id for question_id in question_ids if question_id in self.versions]
+			for question_id in changed:
+				self.versions[question_id] += 1
+			if changed:
+				self.condition.notify_all()
+
+	def version(self, question_id):
+		with self.condition:
+			return self.versions.get(question_id, 0)
+
+	def wait(self, question_id, version, timeout):
+		# Waits up to TIMEOUT seconds for the change counter of the poll with QUESTION_ID to move past VERSION and returns its value.
+		deadline = time.time() + timeout
+		with self.condition:
+			while self.versions.get(question_id, 0) == version:
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					break
+				self.condition.wait(remaining)
+			return self.versions.get(question_id, 0)
+
+results_feed = ResultsFeed()
+
+def results_events(question_id, last_event_id, render):
+	# Yields the Server-Sent Events stream of the poll with QUESTION_ID: a 'results' event with the poll's results, passed through RENDER,
+	# whenever their VERSION differs from the last one sent (or from LAST_EVENT_ID, sent by a reconnecting browser), heartbeat comments while
+	# nothing changes, and a 'removed' event if the poll is removed. The stream ends after POLLS_LIVE_STREAM_SECONDS; browsers reconnect on
+	# their own, which releases the worker serving the stream from time to time.
+	interval = getattr(settings, 'POLLS_LIVE_INTERVAL_MS', 1000) / 1000.0
+	deadline = time.time() + getattr(settings, 'POLLS_LIVE_STREAM_SECONDS', 300)
+	sent_version, sent_at = last_event_id, 0
+	with results_feed.subscription(question_id):
+		yield 'retry: %d\n\n' % max(int(interval * 1000), 1000)
+		seen = results_feed.version(question_id)
+		while True:
+			try:
+				results = get_poll_results(question_id)
+			except Http404:
+				yield 'event: removed\ndata: {}\n\n'
+				return
+			if results['version'] != sent_version:
+				sent_version, sent_at = results['version'], time.time()
+				yield 'id: %s\nevent: results\ndata: %s\n\n' % (sent_version, json.dumps(render(results)))
+			remaining = deadline - time.time()
+			if remaining <= 0:
+				return
+			version = results_feed.wait(question_id, seen, min(HEARTBEAT_SECONDS, remaining))
+			if version == seen:
+				yield ': heartbeat\n\n'
+				continue
+			# Coalesce: wait out the rest of the interval, so that every vote published meanwhile is covered by the next read.
+			time.sleep(max(sent_at + interval - time.time(), 0))
+			seen = results_feed.version(question_id)
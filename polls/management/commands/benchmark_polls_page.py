@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+from polls.models import Question
+from polls.results import results_cache
+from polls.benchmarking import scratch_database, Stopwatch
+from optparse import make_option
+
+# Benchmark of anonymous polls page views with and without the anonymous page cache (POLLS_ANONYMOUS_PAGE_CACHE).
+
+class Command(BaseCommand):
+	help = 'Measures requests/sec of anonymous polls page views with the page cache off and on.'
+	option_list = BaseCommand.option_list + (
+		make_option('--requests', type='int', default=2000, help='Number of page views per run.'),
+		make_option('--polls', type='int', default=100, help='Number of polls of the page owner.'),
+	)
+
+	def handle(self, *args, **options):
+		with scratch_database():
+			owner = User.objects.create_user('benchmark', 'benchmark@example.com', 'benchmark')
+			Question.objects.bulk_create([Question(user=owner, text='Poll %d' % i, date_published=timezone.now()) for i in range(options['polls'])])
+			url = reverse('polls:polls_page', args=(owner.id,))
+			uncached = self.run(url, options['requests'], False)
+			cached = self.run(url, options['requests'], True)
+		self.stdout.write('without page cache: %.0f requests/sec' % uncached)
+		self.stdout.write('with page cache:    %.0f requests/sec (%.1fx)' % (cached, cached / uncached))
+
+	def run(self, url, requests, page_cache):
+		# Requests the page REQUESTS times as an anonymous viewer and returns the throughput in requests/sec.
+		client = Client()
+		results_cache().clear()
+		with override_settings(POLLS_ANONYMOUS_PAGE_CACHE=page_cache):
+			with Stopwatch() as stopwatch:
+				for i in range(requests):
+					client.get(url)
+		return requests / stopwatch.elapsed
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.db.models import Sum
+from polls.models import Question, ChoiceShard
+from polls.benchmarking import scratch_database, Stopwatch
+from polls.votes import apply_counter_deltas
+from optparse import make_option
+import threading
+
+# Contention benchmark for sharded vote counters (POLLS_COUNTER_SHARDS): several threads write counter increments for the same poll at
+# once, and the write throughput is reported for each number of shards.
+
+class Command(BaseCommand):
+	help = 'Measures concurrent counter writes/sec on one hot poll for different numbers of counter shards.'
+	option_list = BaseCommand.option_list + (
+		make_option('--shards', default='1,2,4,8,16', help='Comma-separated numbers of shards to benchmark.'),
+		make_option('--threads', type='int', default=8, help='Number of concurrently writing threads.'),
+		make_option('--writes', type='int', default=500, help='Counter writes per thread.'),
+		make_option('--choices', type='int', default=2, help='Number of choices of the benchmarked poll.'),
+		make_option('--in-memory', action='store_true', default=False, help='Use an in-memory SQLite database instead of a temporary file.'),
+	)
+
+	def handle(self, *args, **options):
+		with scratch_database(on_disk=not options['in_memory']):
+			owner = User.objects.create_user('benchmark', 'benchmark@example.com', 'benchmark')
+			for shards in [int(shards) for shards in options['shards'].split(',')]:
+				writes_per_second, retries = self.run(owner, shards, options)
+				self.stdout.write('%3d shards: %8.0f writes/sec (%d lock retries)' % (shards, writes_per_second, retries))
+
+	def run(self, owner, shards, options):
+		# Has every thread write its counter increments on a fresh poll, then checks that the summed counters add up to the writes made.
+		question = owner.question_set.create(text='Benchmark', date_published=timezone.now(), total_votes=0)
+		choices = [question.choice_set.create(choice_text='Choice %d' % i, votes=0) for i in range(options['choices'])]
+		start = threading.Barrier(options['threads'])
+		retries = [0]
+		def write(offset):
+			try:
+				start.wait()
+				for i in range(options['writes']):
+					choice = choices[(offset + i) % len(choices)]
+					while True:
+						try:
+							apply_counter_deltas({question.id: 1}, {choice.id: 1})
+							break
+						except OperationalError:
+							retries[0] += 1
+			finally:
+				connection.close()
+		with override_settings(POLLS_COUNTER_SHARDS=shards):
+			workers = [threading.Thread(target=write, args=(i,)) for i in range(options['threads'])]
+			with Stopwatch() as stopwatch:
+				for worker in workers:
+					worker.start()
+				for worker in workers:
+					worker.join()
+		# Unsharded votes are counted in the poll's TOTAL_VOTES and sharded votes only in its choices' shards, so their sum is every vote.
+		counted = Question.objects.get(pk=question.id).total_votes + \
+			(ChoiceShard.objects.filter(choice__question=question).aggregate(votes=Sum('votes'))['votes'] or 0)
+		if counted != options['threads'] * options['writes']:
+			raise CommandError('%d shards: counted %d votes for %d writes.' % (shards, counted, options['threads'] * options['writes']))
+		return options['threads'] * options['writes'] / stopwatch.elapsed, retries[0]
@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from polls.models import Question
+from polls.benchmarking import scratch_database, Stopwatch
+from polls.votes import record_vote
+from pollsite.db import serialized_write, stop_serialized_writer
+from optparse import make_option
+import random
+import threading
+import time
+
+# Mixed read/write load benchmark for SQLite: reader threads read polls while writer threads vote, first on stock SQLite and then in
+# production SQLite mode (POLLSITE_SQLITE_PRODUCTION, see pollsite/db.py), each on a fresh on-disk database. Reports reads/sec, votes/sec
+# and the number of "database is locked" errors of each mode.
+
+class Command(BaseCommand):
+	help = 'Measures concurrent reads and votes and counts lock errors on stock SQLite and in production SQLite mode.'
+	option_list = BaseCommand.option_list + (
+		make_option('--readers', type='int', default=8, help='Number of reading threads.'),
+		make_option('--writers', type='int', default=8, help='Number of voting threads.'),
+		make_option('--seconds', type='float', default=5, help='Duration of each run.'),
+		make_option('--voters', type='int', default=1000, help='Number of distinct voters.'),
+		make_option('--polls', type='int', default=20, help='Number of polls voted on and read.'),
+	)
+
+	def handle(self, *args, **options):
+		for label, production in (('stock', False), ('production', True)):
+			with override_settings(POLLSITE_SQLITE_PRODUCTION=production):
+				with scratch_database(on_disk=True):
+					try:
+						reads, votes, errors, seconds = self.run(options)
+					finally:
+						stop_serialized_writer()
+			self.stdout.write('%-10s %8.0f reads/sec %7.0f votes/sec %6d lock errors' % (label, reads / seconds, votes / seconds, errors))
+
+	def run(self, options):
+		# Runs the readers and writers for the configured time on a fresh set of polls and returns the reads, votes and lock errors counted,
+		# and the seconds taken.
+		owner = User.objects.create_user('benchmark', 'benchmark@example.com', 'benchmark')
+		User.objects.bulk_create([User(username='voter%d' % i) for i in range(options['voters'])])
+		voters = list(User.objects.filter(username__startswith='voter').values_list('id', flat=True))
+		polls = []
+		for i in range(options['polls']):
+			question = owner.question_set.create(text='Benchmark %d' % i, date_published=timezone.now(), total_votes=0)
+			polls.append((question, [question.choice_set.create(choice_text='Choice %d' % c, votes=0) for c in range(4)]))
+		counts, lock = {'reads': 0, 'votes': 0, 'errors': 0}, threading.Lock()
+		start = threading.Barrier(options['readers'] + options['writers'])
+		deadline = []
+		def count(name):
+			with lock:
+				counts[name] += 1
+		def read():
+			generator = random.Random()
+			try:
+				start.wait()
+				while time.time() < deadline[0]:
+					question = generator.choice(polls)[0]
+					try:
+						Question.objects.get(pk=question.id)
+						list(question.choice_set.order_by('id'))
+						count('reads')
+					except OperationalError:
+						count('errors')
+			finally:
+				connection.close()
+		def write():
+			generator = random.Random()
+			try:
+				start.wait()
+				while time.time() < deadline[0]:
+					question, choices = generator.choice(polls)
+					try:
+						serialized_write(record_vote, question, generator.choice(voters), generator.choice(choices))
+						count('votes')
+					except OperationalError:
+						count('errors')
+			finally:
+				connection.close()
+		threads = [threading.Thread(target=read) for i in range(options['readers'])]
+		threads += [threading.Thread(target=write) for i in range(options['writers'])]
+		deadline.append(time.time() + options['seconds'])
+		with Stopwatch() as stopwatch:
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+		return counts['reads'], counts['votes'], counts['errors'], stopwatch.elapsed
@@ -0,0 +1,178 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from polls.models import Question, Choice, Vote
+from polls.benchmarking import scratch_database, Stopwatch, percentile
+from optparse import make_option
+from collections import OrderedDict, defaultdict
+from datetime import timedelta
+import django
+import json
+import random
+
+# Benchmark suite for the views of Pollsite at a configurable data scale. A scratch database is seeded with USERS members, POLLS_PER_USER
+# polls each with CHOICES choices, and BALLOTS ballots spread over the polls (with consistent vote counters); then every benchmarked view is
+# requested through the test client and its latency percentiles and query counts are reported and written to a JSON file, so that runs can
+# be compared over time.
+
+SEED_BATCH = 5000
+
+VIEWS = ('polls_page', 'polls_page (anonymous)', 'vote_poll', 'processing_vote', 'creating_poll', 'process_remove', 'processing_login',
+	'processing_signup')
+
+class Command(BaseCommand):
+	help = 'Seeds a scratch database at the given scale and measures latency percentiles and query counts of the polls and users views.'
+	option_list = BaseCommand.option_list + (
+		make_option('--users', type='int', default=1000, help='Number of members.'),
+		make_option('--polls-per-user', type='int', default=10, help='Number of polls of every member.'),
+		make_option('--choices', type='int', default=4, help='Number of choices of every poll.'),
+		make_option('--ballots', type='int', default=100000, help='Total number of ballots, spread evenly over the polls.'),
+		make_option('--requests', type='int', default=200, help='Number of requests per benchmarked view.'),
+		make_option('--views', default=','.join(VIEWS), help='Comma-separated names of the views to benchmark (process_remove removes the '
+			'polls made by creating_poll).'),
+		make_option('--seed', type='int', default=0, help='Seed of the random choices made while seeding and benchmarking.'),
+		make_option('--output', default='benchmark_views.json', help='Path of the JSON results file.'),
+		make_option('--in-memory', action='store_true', default=False, help='Use an in-memory SQLite database instead of a temporary file.'),
+	)
+
+	def handle(self, *args, **options):
+		if options['users'] < 1 or options['polls_per_user'] < 1 or options['choices'] < 1 or options['requests'] < 1:
+			raise CommandError('--users, --polls-per-user, --choices and --requests must be at least 1.')
+		options['views'] = options['views'].split(',')
+		unknown = [name for name in options['views'] if name not in VIEWS]
+		if unknown:
+			raise CommandError('Unknown views: %s (known views: %s).' % (', '.join(unknown), ', '.join(VIEWS)))
+		self.random = random.Random(options['seed'])
+		with scratch_database(on_disk=not options['in_memory']):
+			with Stopwatch() as seeding:
+				user_ids, polls = self.seed(options)
+			self.stdout.write('Seeded %d users, %d polls and %d ballots in %.1f s.' % (len(user_ids), len(polls), Vote.objects.count(),
+				seeding.elapsed))
+			# The benchmark drives the views far faster than any client may (see pollsite/ratelimit.py), so rate limits are lifted.
+			with override_settings(POLLSITE_RATE_LIMITS={}):
+				results = self.run(user_ids, polls, options)
+		for view, result in results.items():
+			if not result['requests']:
+				# Nothing was requested (e.g. no poll was left to remove), so there is nothing to measure.
+				self.stdout.write('%-28s n/a (no requests)' % view)
+				continue
+			self.stdout.write('%-28s p50 %7.2f ms  p90 %7.2f ms  p99 %7.2f ms  queries %5.1f avg %3d max%s' % (view, result['p50_ms'],
+				result['p90_ms'], result['p99_ms'], result['queries_mean'], result['queries_max'],
+				'  (%d errors)' % result['errors'] if result['errors'] else ''))
+		report = {
+			'timestamp': timezone.now().isoformat(),
+			'django': django.get_version(),
+			'database': connection.vendor,
+			'scale': dict((name, options[name]) for name in ('users', 'polls_per_user', 'choices', 'ballots', 'requests', 'seed')),
+			'seconds_seeding': seeding.elapsed,
+			'views': results,
+		}
+		with open(options['output'], 'w') as output:
+			json.dump(report, output, indent=2)
+		self.stdout.write('Wrote %s.' % options['output'])
+
+	def seed(self, options):
+		# Creates the members (all with the password 'benchmark', hashed once), their polls and the ballots, and sets the vote counters to
+		# the ballots' tallies. Returns the members' ids and a list of (question id, [choice ids]) for every poll.
+		password = make_password('benchmark')
+		for start in range(0, options['users'], SEED_BATCH):
+			User.objects.bulk_create([User(username='member%d' % i, email='member%d@example.com' % i, password=password)
+				for i in range(start, min(start + SEED_BATCH, options['users']))])
+		user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+		now, batch = timezone.now(), []
+		for i, (user_id, number) in enumerate((user_id, number) for user_id in user_ids for number in range(options['polls_per_user'])):
+			batch.append((user_id, 'Poll %d of member %d' % (number, user_id), ['Choice %d' % c for c in range(options['choices'])],
+				now - timedelta(minutes=i)))
+			if len(batch) == SEED_BATCH:
+				Question.objects.create_polls(batch)
+				batch = []
+		Question.objects.create_polls(batch)
+		choices = defaultdict(list)
+		for question_id, choice_id in Choice.objects.order_by('id').values_list('question', 'id').iterator():
+			choices[question_id].append(choice_id)
+		polls = sorted(choices.items())
+		per_poll = min(options['ballots'] // len(polls), len(user_ids))
+		tallies, ballots = defaultdict(int), []
+		with transaction.atomic():
+			for question_id, choice_ids in polls:
+				for user_id in self.random.sample(user_ids, per_poll):
+					choice_id = self.random.choice(choice_ids)
+					tallies[choice_id] += 1
+					ballots.append(Vote(question_id=question_id, user_id=user_id, choice_id=choice_id))
+					if len(ballots) == SEED_BATCH:
+						Vote.objects.bulk_create(ballots)
+						ballots = []
+			Vote.objects.bulk_create(ballots)
+			for choice_id, votes in tallies.items():
+				Choice.objects.filter(pk=choice_id).update(votes=votes)
+			Question.objects.update(total_votes=per_poll)
+		return user_ids, polls
+
+	def run(self, user_ids, polls, options):
+		# Requests every benchmarked view (of VIEWS) REQUESTS times, as a logged-in member unless noted, and returns the measurements per view.
+		member = Client()
+		member.login(username='member0', password='benchmark')
+		anonymous = Client()
+		owner_id = user_ids[0]
+		created = []
+		def random_poll():
+			return self.random.choice(polls)
+		def create_poll(i):
+			return member.post(reverse('polls:creating_poll', args=(owner_id,)), {'question': 'Benchmark poll %d' % i, 'selection': '3',
+				'choice1': 'One', 'choice2': 'Two', 'choice3': 'Three'})
+		def remove_poll(i):
+			return member.get(reverse('polls:process_remove', args=(created[i], owner_id)))
+		def vote(i):
+			question_id, choice_ids = random_poll()
+			return member.post(reverse('polls:processing_vote', args=(question_id,)), {'choice': self.random.choice(choice_ids)})
+		def log_in(i):
+			return Client().get(reverse('users:processing_login'), {'username': 'member%d' % self.random.randrange(len(user_ids)),
+				'password': 'benchmark'})
+		def sign_up(i):
+			return Client().post(reverse('users:processing_signup'), {'firstname': 'New', 'lastname': 'Member', 'username': 'new%d' % i,
+				'emailaddress': 'new%d@example.com' % i, 'password': 'benchmark'})
+		views = [
+			('polls_page', lambda i: member.get(reverse('polls:polls_page', args=(self.random.choice(user_ids),)))),
+			('polls_page (anonymous)', lambda i: anonymous.get(reverse('polls:polls_page', args=(self.random.choice(user_ids),)))),
+			('vote_poll', lambda i: member.get(reverse('polls:vote_poll', args=(random_poll()[0],)))),
+			('processing_vote', vote),
+			('creating_poll', create_poll),
+			('process_remove', remove_poll),
+			('processing_login', log_in),
+			('processing_signup', sign_up),
+		]
+		results = OrderedDict()
+		for name, request in [(name, request) for name, request in views if name in options['views']]:
+			if name == 'process_remove':
+				created = list(Question.objects.filter(user=owner_id, text__startswith='Benchmark poll').values_list('id', flat=True))
+			latencies, query_counts, errors = [], [], 0
+			for i in range(min(options['requests'], len(created)) if name == 'process_remove' else options['requests']):
+				with CaptureQueriesContext(connection) as queries:
+					with Stopwatch() as stopwatch:
+						response = request(i)
+				latencies.append(stopwatch.elapsed)
+				query_counts.append(len(queries))
+				errors += response.status_code >= 400
+			results[name] = summarize(latencies, query_counts, errors)
+		return results
+
+def summarize(latencies, query_counts, errors):
+	# Returns the measurements of one view from the LATENCIES (in seconds) and QUERY_COUNTS of its requests. A view that was not requested at
+	# all has no measurements, which are reported as None (null in the JSON results file).
+	def milliseconds(seconds):
+		return seconds * 1000 if seconds is not None else None
+	return {
+		'requests': len(latencies),
+		'errors': errors,
+		'p50_ms': milliseconds(percentile(latencies, 0.5)),
+		'p90_ms': milliseconds(percentile(latencies, 0.9)),
+		'p99_ms': milliseconds(percentile(latencies, 0.99)),
+		'max_ms': milliseconds(max(latencies) if latencies else None),
+		'queries_mean': sum(query_counts) / float(len(query_counts)) if query_counts else None,
+		'queries_max': max(query_counts) if query_counts else None,
+	}
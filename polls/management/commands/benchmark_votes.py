@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+from django.utils import timezone
+from polls.benchmarking import scratch_database, Stopwatch
+from polls.votes import record_vote, flush_vote_buffer
+from optparse import make_option
+
+# Benchmark comparing vote throughput of the per-request counter path with the write-behind VoteBuffer (POLLS_VOTE_WRITE_BEHIND).
+
+class Command(BaseCommand):
+	help = 'Measures votes/sec of RECORD_VOTE with immediate counter updates and with the write-behind vote buffer.'
+	option_list = BaseCommand.option_list + (
+		make_option('--votes', type='int', default=5000, help='Number of votes cast per run.'),
+		make_option('--voters', type='int', default=2500, help='Number of distinct voters; the rest of the votes are changes of choice.'),
+		make_option('--choices', type='int', default=4, help='Number of choices of the benchmarked poll.'),
+		make_option('--flush-max-votes', type='int', default=100, help='POLLS_VOTE_FLUSH_MAX_VOTES for the write-behind run.'),
+		make_option('--flush-interval-ms', type='int', default=500, help='POLLS_VOTE_FLUSH_INTERVAL_MS for the write-behind run.'),
+		make_option('--on-disk', action='store_true', default=False, help='Use a temporary SQLite file instead of an in-memory database.'),
+	)
+
+	def handle(self, *args, **options):
+		with scratch_database(on_disk=options['on_disk']):
+			owner = User.objects.create_user('benchmark', 'benchmark@example.com', 'benchmark')
+			User.objects.bulk_create([User(username='voter%d' % i) for i in range(options['voters'])])
+			voters = list(User.objects.filter(username__startswith='voter').values_list('id', flat=True))
+			per_request = self.run(owner, voters, options, False)
+			write_behind = self.run(owner, voters, options, True)
+		self.stdout.write('per-request:  %.0f votes/sec' % per_request)
+		self.stdout.write('write-behind: %.0f votes/sec (%.2fx)' % (write_behind, write_behind / per_request))
+
+	def run(self, owner, voters, options, write_behind):
+		# Casts the configured votes on a fresh poll and returns the throughput in votes/sec. The write-behind run includes the final flush,
+		# so both runs end with the same counters in the database.
+		question = owner.question_set.create(text='Benchmark', date_published=timezone.now(), total_votes=0)
+		choices = [question.choice_set.create(choice_text='Choice %d' % i, votes=0) for i in range(options['choices'])]
+		with override_settings(POLLS_VOTE_WRITE_BEHIND=write_behind, POLLS_VOTE_FLUSH_MAX_VOTES=options['flush_max_votes'],
+				POLLS_VOTE_FLUSH_INTERVAL_MS=options['flush_interval_ms']):
+			with Stopwatch() as stopwatch:
+				for i in range(options['votes']):
+					record_vote(question, voters[i % len(voters)], choices[(i * 7 + i // options['voters']) % len(choices)])
+				flush_vote_buffer()
+		return options['votes'] / stopwatch.elapsed
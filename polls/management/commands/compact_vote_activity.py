@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from polls.activity import compact_activity, minute_retention
+from pollsite.db import serialized_write
+from optparse import make_option
+from datetime import timedelta
+import time
+
+# Downsamples the vote activity of polls (see POLLS app's activity module): the per-minute rollups of hours older than the retention period
+# are folded into per-hour rollups, in batches, each batch in its own short write. Meant to run periodically, e.g. hourly from cron.
+
+class Command(BaseCommand):
+	help = 'Folds old per-minute vote activity of polls into per-hour activity.'
+	option_list = BaseCommand.option_list + (
+		make_option('--older-than', type='int', default=None,
+			help='Compact minutes older than this many hours (POLLS_ACTIVITY_MINUTE_RETENTION_HOURS by default).'),
+		make_option('--batch-size', type='int', default=500, help='Number of minute rollups compacted per transaction.'),
+		make_option('--pause', type='float', default=0.05, help='Seconds to sleep between batches.'),
+	)
+
+	def handle(self, *args, **options):
+		if options['batch_size'] < 1 or options['pause'] < 0 or (options['older_than'] is not None and options['older_than'] < 0):
+			raise CommandError('--batch-size must be at least 1, and --older-than and --pause must not be negative.')
+		retention = minute_retention() if options['older_than'] is None else timedelta(hours=options['older_than'])
+		older_than, compacted = timezone.now() - retention, 0
+		while True:
+			batch = serialized_write(compact_activity, older_than, options['batch_size'])
+			if not batch:
+				break
+			compacted += batch
+			time.sleep(options['pause'])
+		self.stdout.write('Compacted %d minute rollups.' % compacted)
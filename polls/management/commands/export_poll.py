@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from polls.models import Question
+from polls.export import FORMATS, export_lines
+from optparse import make_option
+import io
+
+# Exports the raw results of a poll (every ballot, then the per-choice totals) as CSV or JSON Lines, in bounded memory (see POLLS app's
+# export module). The export is written to standard output unless --output names a file.
+
+class Command(BaseCommand):
+	args = '<poll id>'
+	help = 'Streams the ballots and per-choice totals of a poll as CSV or JSONL.'
+	option_list = BaseCommand.option_list + (
+		make_option('--format', choices=list(FORMATS), default='csv', help='Output format.'),
+		make_option('--output', help='Path of the output file (standard output if not given).'),
+		make_option('--chunk-size', type='int', default=1000, help='Number of ballots read per query.'),
+	)
+
+	def handle(self, *args, **options):
+		if len(args) != 1 or not args[0].isdigit():
+			raise CommandError('Usage: export_poll <poll id> [--format csv|jsonl] [--output FILE] [--chunk-size N]')
+		if options['chunk_size'] < 1:
+			raise CommandError('--chunk-size must be at least 1.')
+		try:
+			question = Question.live.get(pk=args[0])
+		except Question.DoesNotExist:
+			raise CommandError('Poll %s does not exist.' % args[0])
+		lines = export_lines(question, options['format'], options['chunk_size'])
+		if options['output']:
+			with io.open(options['output'], 'w', encoding='utf-8', newline='') as output:
+				for line in lines:
+					output.write(line)
+		else:
+			for line in lines:
+				self.stdout.write(line, ending='')
@@ -0,0 +1,112 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.utils import six, timezone
+from django.utils.dateparse import parse_datetime
+from polls.models import Question
+from optparse import make_option
+import csv
+import io
+import json
+
+# Bulk import of polls from another system. The input is read as a stream and written in batches, each batch in one transaction (see
+# QuestionManager.create_polls), so files with hundreds of thousands of polls import in bounded memory.
+#
+# JSONL input has one poll per line: {"username": ..., "question": ..., "choices": [...], "date_published": ...}.
+# CSV input has a header row with the columns username, question, date_published and one or more columns whose names start with "choice";
+# the non-empty choice columns of a row, in header order, are the poll's choices.
+# date_published is optional (ISO 8601; naive times are in the site's time zone) and defaults to the time of the import.
+
+class Command(BaseCommand):
+	args = '<file>'
+	help = 'Imports polls from a JSONL or CSV file in streaming batches.'
+	option_list = BaseCommand.option_list + (
+		make_option('--format', choices=['jsonl', 'csv'], help='Input format; guessed from the file extension if not given.'),
+		make_option('--batch-size', type='int', default=1000, help='Number of polls written per transaction.'),
+	)
+
+	def handle(self, *args, **options):
+		if len(args) != 1:
+			raise CommandError('Usage: import_polls <file> [--format jsonl|csv] [--batch-size N]')
+		path = args[0]
+		input_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+		imported, skipped, batch = 0, 0, []
+		with io.open(path, encoding='utf-8', newline='') as source:
+			rows = self.read_csv(source) if input_format == 'csv' else self.read_jsonl(source)
+			for line, row in rows:
+				if row is None:
+					self.stderr.write('Line %d: could not be parsed, skipped.' % line)
+					skipped += 1
+					continue
+				batch.append((line, row))
+				if len(batch) >= options['batch_size']:
+					written = self.write_batch(batch)
+					imported, skipped, batch = imported + written, skipped + len(batch) - written, []
+			if batch:
+				written = self.write_batch(batch)
+				imported, skipped = imported + written, skipped + len(batch) - written
+		self.stdout.write('Imported %d polls, skipped %d.' % (imported, skipped))
+
+	def read_jsonl(self, source):
+		# Yields (line number, row) for every non-blank line of a JSONL SOURCE; the row is None if the line is not a JSON object.
+		for line, text in enumerate(source, 1):
+			if not text.strip():
+				continue
+			try:
+				row = json.loads(text)
+			except ValueError:
+				row = None
+			yield line, row if isinstance(row, dict) else None
+
+	def read_csv(self, source):
+		# Yields (line number, row) for every row of a CSV SOURCE, with the row's choice columns collected into CHOICES.
+		reader = csv.reader(source)
+		header = next(reader, [])
+		choice_columns = [i for i, name in enumerate(header) if name.startswith('choice')]
+		columns = dict((name, i) for i, name in enumerate(header))
+		for row in reader:
+			if not row:
+				continue
+			yield reader.line_num, {
+				'username': self.column(row, columns.get('username')),
+				'question': self.column(row, columns.get('question')),
+				'date_published': self.column(row, columns.get('date_published')),
+				'choices': [self.column(row, i) for i in choice_columns if self.column(row, i)],
+			}
+
+	def column(self, row, index):
+		return row[index] if index is not None and index < len(row) else ''
+
+	def write_batch(self, batch):
+		# Validates a BATCH of (line number, row) pairs, resolves all of its usernames with one query and creates the valid polls in one
+		# transaction. Returns the number of polls created.
+		usernames = set(row.get('username') for line, row in batch if isinstance(row.get('username'), six.string_types))
+		user_ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+		polls = []
+		for line, row in batch:
+			text, choice_texts = row.get('question'), row.get('choices')
+			if not isinstance(row.get('username'), six.string_types) or row['username'] not in user_ids:
+				self.stderr.write('Line %d: unknown user %r, skipped.' % (line, row.get('username')))
+			elif not isinstance(choice_texts, list) or not Question.objects.is_complete_poll(text, choice_texts):
+				self.stderr.write('Line %d: missing question or choice text, skipped.' % line)
+			else:
+				date_published = self.parse_date(row.get('date_published'))
+				if date_published is False:
+					self.stderr.write('Line %d: invalid date_published, skipped.' % line)
+				else:
+					polls.append((user_ids[row['username']], text, choice_texts, date_published))
+		Question.objects.create_polls(polls)
+		return len(polls)
+
+	def parse_date(self, value):
+		# Returns VALUE parsed as an aware datetime, None if VALUE is empty, or False if it is not a valid date.
+		if not value:
+			return None
+		try:
+			date_published = parse_datetime(value)
+		except (TypeError, ValueError):
+			date_published = None
+		if date_published is None:
+			return False
+		if timezone.is_naive(date_published):
+			date_published = timezone.make_aware(date_published, timezone.get_current_timezone())
+		return date_published
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from polls.purge import purge_removed_polls
+from optparse import make_option
+from datetime import timedelta
+
+# Deletes the rows of removed polls in small batches (see POLLS app's purge module). Meant to run periodically, e.g. from cron, next to the
+# live site.
+
+class Command(BaseCommand):
+	help = 'Deletes the ballots, choices and questions of removed polls in batches.'
+	option_list = BaseCommand.option_list + (
+		make_option('--batch-size', type='int', default=1000, help='Number of rows deleted per statement.'),
+		make_option('--pause', type='float', default=0.05, help='Seconds to sleep between batches.'),
+		make_option('--older-than', type='int', default=0, help='Only purge polls removed at least this many minutes ago.'),
+	)
+
+	def handle(self, *args, **options):
+		if options['batch_size'] < 1 or options['pause'] < 0 or options['older_than'] < 0:
+			raise CommandError('--batch-size must be at least 1, and --pause and --older-than must not be negative.')
+		removed_before = timezone.now() - timedelta(minutes=options['older_than']) if options['older_than'] else None
+		polls, rows = 0, 0
+		for question_id, deleted in purge_removed_polls(options['batch_size'], options['pause'], removed_before):
+			polls, rows = polls + 1, rows + deleted
+			self.stdout.write('Purged poll %d (%d rows).' % (question_id, deleted))
+		self.stdout.write('Purged %d polls, %d rows.' % (polls, rows))
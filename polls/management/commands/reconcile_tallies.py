@@ -0,0 +1,89 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+from polls.models import Question, Choice, ChoiceShard, Vote, ReconciliationRun
+from polls.signals import results_changed
+from pollsite.db import serialized_write
+from optparse import make_option
+
+# Reconciliation of the denormalized vote counters (Question.total_votes, Choice.votes and their ChoiceShards) with the ballots in Vote.
+# The true tallies of a chunk of polls are computed with one grouped COUNT over the (question, choice) index of Vote and compared with the
+# counters read in the same transaction; polls whose counters differ are reported and, with --fix, corrected.
+#
+# Corrections add the drift to the counters with F() expressions instead of overwriting them, so votes recorded while the command runs are
+# kept. Counter changes still waiting in a write-behind VoteBuffer (POLLS_VOTE_WRITE_BEHIND) show up as drift until they are flushed; do not
+# run --fix while other processes may hold unflushed votes. Chunks being fixed are checked and corrected on the writer thread of production
+# SQLite mode (see pollsite/db.py).
+#
+# Every run is recorded as a ReconciliationRun. An --incremental run only checks the polls with a ballot cast or changed since the start of
+# the previous run (found through the VOTED_AT index of Vote), so it can run every few minutes without a full scan.
+
+class Command(BaseCommand):
+	help = 'Recomputes vote tallies from ballots, reports polls whose counters drifted and optionally fixes them.'
+	option_list = BaseCommand.option_list + (
+		make_option('--fix', action='store_true', default=False, help='Correct the counters of drifted polls.'),
+		make_option('--incremental', action='store_true', default=False,
+			help='Only check polls voted on since the previous run (all polls if there is none).'),
+		make_option('--chunk-size', type='int', default=500, help='Number of polls checked per transaction.'),
+	)
+
+	def handle(self, *args, **options):
+		if options['chunk_size'] < 1:
+			raise CommandError('--chunk-size must be at least 1.')
+		# The start time is taken before any poll is read, so ballots written during the run are picked up by the next incremental run.
+		started_at = timezone.now()
+		previous = ReconciliationRun.objects.order_by('-started_at').first() if options['incremental'] else None
+		checked, drifted = 0, 0
+		for chunk in self.chunks(previous.started_at if previous else None, options['chunk_size']):
+			drifts = serialized_write(self.reconcile, chunk, True) if options['fix'] else self.reconcile(chunk, False)
+			checked, drifted = checked + len(chunk), drifted + len(drifts)
+			for question_id, total, expected_total, choices in drifts:
+				self.stdout.write('Poll %d: total_votes %d, expected %d%s' % (question_id, total, expected_total,
+					''.join('; choice %d: %d, expected %d' % choice for choice in choices)))
+		serialized_write(ReconciliationRun.objects.create, started_at=started_at, incremental=previous is not None, polls_checked=checked,
+			polls_drifted=drifted, fixed=options['fix'])
+		self.stdout.write('Checked %d polls, %d drifted%s.' % (checked, drifted, ', fixed' if options['fix'] and drifted else ''))
+
+	def chunks(self, since, size):
+		# Yields the ids of the polls to check, in lists of at most SIZE in id order: every poll, or only those voted on at or after SINCE.
+		if since is None:
+			last_id = 0
+			while True:
+				chunk = list(Question.live.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:size])
+				if not chunk:
+					return
+				yield chunk
+				last_id = chunk[-1]
+		question_ids = sorted(set(Vote.objects.filter(voted_at__gte=since).values_list('question', flat=True)))
+		for i in range(0, len(question_ids), size):
+			yield question_ids[i:i + size]
+
+	def reconcile(self, question_ids, fix):
+		# Compares the counters of the polls with QUESTION_IDS with their ballots and returns the drifted polls as (question id, counted total,
+		# expected total, [(choice id, counted votes, expected votes)] of the drifted choices). Counted values include the ChoiceShards. With
+		# FIX, the counters of the drifted polls are corrected in the same transaction and receivers of RESULTS_CHANGED are notified.
+		drifts = []
+		with transaction.atomic():
+			tallies = dict(((question_id, choice_id), votes) for question_id, choice_id, votes in
+				Vote.objects.filter(question_id__in=question_ids).values_list('question', 'choice').annotate(Count('id')).order_by())
+			shards = dict(ChoiceShard.objects.filter(choice__question_id__in=question_ids).values_list('choice').annotate(Sum('votes')).order_by())
+			choices = {}
+			for choice_id, question_id, votes in Choice.objects.filter(question_id__in=question_ids).values_list('id', 'question', 'votes'):
+				choices.setdefault(question_id, []).append((choice_id, votes + shards.get(choice_id, 0), tallies.get((question_id, choice_id), 0)))
+			for question_id, total in Question.live.filter(id__in=question_ids).order_by('id').values_list('id', 'total_votes'):
+				counted = choices.get(question_id, [])
+				total += sum(shards.get(choice_id, 0) for choice_id, votes, expected in counted)
+				expected_total = sum(expected for choice_id, votes, expected in counted)
+				drifted_choices = [choice for choice in counted if choice[1] != choice[2]]
+				if total != expected_total or drifted_choices:
+					drifts.append((question_id, total, expected_total, drifted_choices))
+			if fix:
+				for question_id, total, expected_total, drifted_choices in drifts:
+					if total != expected_total:
+						Question.live.filter(pk=question_id).update(total_votes=F('total_votes') + expected_total - total)
+					for choice_id, votes, expected in drifted_choices:
+						Choice.objects.filter(pk=choice_id).update(votes=F('votes') + expected - votes)
+		if fix and drifts:
+			results_changed.send(sender=Question, question_ids=[drift[0] for drift in drifts])
+		return drifts
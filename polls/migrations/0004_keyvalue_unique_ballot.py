@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def remove_duplicate_ballots(apps, schema_editor):
+    # Before (dictionary, key) can be made unique, collapse any duplicate ballots a user left on the same poll, keeping the most
+    # recent Keyvalue (highest id) and dropping the older ones.
+    Keyvalue = apps.get_model('polls', 'Keyvalue')
+    duplicates = Keyvalue.objects.values('dictionary', 'key').annotate(
+        count=models.Count('id'), latest=models.Max('id')).filter(count__gt=1)
+    for duplicate in list(duplicates):
+        Keyvalue.objects.filter(dictionary=duplicate['dictionary'], key=duplicate['key'], id__lt=duplicate['latest']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0003_dictforquestion_keyvalue'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_ballots, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='keyvalue',
+            unique_together=set([('dictionary', 'key')]),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0004_keyvalue_unique_ballot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChoiceShard',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('index', models.IntegerField()),
+                ('votes', models.IntegerField(default=0)),
+                ('choice', models.ForeignKey(to='polls.Choice')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='choiceshard',
+            unique_together=set([('choice', 'index')]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0005_choiceshard'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='question',
+            index_together=set([('user', 'date_published', 'id')]),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('polls', '0006_question_polls_page_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Vote',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('choice', models.ForeignKey(to='polls.Choice')),
+                ('question', models.ForeignKey(to='polls.Question')),
+                ('user', models.ForeignKey(to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='vote',
+            unique_together=set([('question', 'user')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='vote',
+            index_together=set([('question', 'choice'), ('question', 'user', 'choice')]),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+# Ballots are copied in chunks of this many rows, walking the source table by primary key, so that memory use stays bounded however many
+# ballots the database holds. The users and choices of a chunk are looked up with ID__IN lists of up to this many ids, which must stay below
+# SQLite's default limit of 999 variables per query.
+CHUNK_SIZE = 900
+
+
+def copy_keyvalues_to_votes(apps, schema_editor):
+    # Copies every Keyvalue ballot (DICTIONARY = the poll's Question, KEY = user id, VALUE = choice id) into a Vote. Ballots whose user or
+    # choice no longer exists, or whose choice belongs to another poll, cannot be expressed as a Vote and are left behind.
+    Keyvalue = apps.get_model('polls', 'Keyvalue')
+    Vote = apps.get_model('polls', 'Vote')
+    Choice = apps.get_model('polls', 'Choice')
+    User = apps.get_model('auth', 'User')
+    last_id = 0
+    while True:
+        chunk = list(Keyvalue.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'dictionary_id', 'key', 'value')[:CHUNK_SIZE])
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+        user_ids = set(User.objects.filter(id__in=set(row[2] for row in chunk)).values_list('id', flat=True))
+        choice_questions = dict(Choice.objects.filter(id__in=set(row[3] for row in chunk)).values_list('id', 'question_id'))
+        Vote.objects.bulk_create([Vote(question_id=question_id, user_id=user_id, choice_id=choice_id)
+            for keyvalue_id, question_id, user_id, choice_id in chunk
+            if user_id in user_ids and choice_questions.get(choice_id) == question_id])
+
+
+def copy_votes_to_keyvalues(apps, schema_editor):
+    # Reverse of COPY_KEYVALUES_TO_VOTES: recreates a DictforQuestion for every Question and a Keyvalue for every Vote, in chunks.
+    Question = apps.get_model('polls', 'Question')
+    DictforQuestion = apps.get_model('polls', 'DictforQuestion')
+    Keyvalue = apps.get_model('polls', 'Keyvalue')
+    Vote = apps.get_model('polls', 'Vote')
+    last_id = 0
+    while True:
+        question_ids = list(Question.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:CHUNK_SIZE])
+        if not question_ids:
+            break
+        last_id = question_ids[-1]
+        DictforQuestion.objects.bulk_create([DictforQuestion(question_id=question_id) for question_id in question_ids])
+    last_id = 0
+    while True:
+        chunk = list(Vote.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'question_id', 'user_id', 'choice_id')[:CHUNK_SIZE])
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+        Keyvalue.objects.bulk_create([Keyvalue(dictionary_id=question_id, key=user_id, value=choice_id)
+            for vote_id, question_id, user_id, choice_id in chunk])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0001_initial'),
+        ('polls', '0007_vote'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_keyvalues_to_votes, copy_votes_to_keyvalues),
+    ]
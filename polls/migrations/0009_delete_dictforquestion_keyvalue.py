@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_copy_keyvalue_ballots'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='KeyValue',
+        ),
+        migrations.DeleteModel(
+            name='DictforQuestion',
+        ),
+    ]
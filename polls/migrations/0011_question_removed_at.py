@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0010_vote_voted_at_reconciliationrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='removed_at',
+            field=models.DateTimeField(blank=True, null=True, db_index=True),
+        ),
+    ]
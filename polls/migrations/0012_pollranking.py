@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import Count, Max
+from django.conf import settings
+from django.utils import timezone
+from datetime import datetime
+import math
+
+# Trending scores are logarithms of vote weights relative to this epoch (see POLLS app's ranking module).
+EPOCH = datetime(2015, 1, 1, tzinfo=timezone.utc)
+
+
+def rank_existing_polls(apps, schema_editor):
+    # Creates the rankings of the polls voted on so far, with one grouped query over their ballots. Ballots only record when they were last
+    # cast or changed, so every ballot of a poll is weighted as if it had been cast at the poll's latest VOTED_AT.
+    Vote = apps.get_model('polls', 'Vote')
+    PollRanking = apps.get_model('polls', 'PollRanking')
+    rate = math.log(2) / (getattr(settings, 'POLLS_TRENDING_HALF_LIFE_HOURS', 6) * 3600.0)
+    rankings = []
+    for question_id, voters, voted_at in Vote.objects.values_list('question').annotate(Count('id'), Max('voted_at')).order_by():
+        rankings.append(PollRanking(question_id=question_id, total_votes=voters,
+            trending=math.log(voters) + rate * (voted_at - EPOCH).total_seconds()))
+    PollRanking.objects.bulk_create(rankings, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0011_question_removed_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollRanking',
+            fields=[
+                ('question', models.OneToOneField(primary_key=True, serialize=False, to='polls.Question')),
+                ('total_votes', models.IntegerField(default=0, db_index=True)),
+                ('trending', models.FloatField(db_index=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.RunPython(rank_existing_polls, migrations.RunPython.noop),
+    ]
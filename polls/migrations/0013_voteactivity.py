@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0012_pollranking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteActivity',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('resolution', models.SmallIntegerField(choices=[(0, 'minute'), (1, 'hour')])),
+                ('start', models.DateTimeField()),
+                ('counts', models.BinaryField()),
+                ('question', models.ForeignKey(to='polls.Question')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='voteactivity',
+            unique_together=set([('question', 'resolution', 'start')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='voteactivity',
+            index_together=set([('resolution', 'start')]),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def unrank_removed_polls(apps, schema_editor):
+    # Removed polls no longer have a ranking (see POLLS app's receivers module): deletes the rankings of the polls removed so far.
+    PollRanking = apps.get_model('polls', 'PollRanking')
+    PollRanking.objects.filter(question__removed_at__isnull=False).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0013_voteactivity'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='pollranking',
+            index_together=set([('total_votes', 'trending')]),
+        ),
+        migrations.RunPython(unrank_removed_polls, migrations.RunPython.noop),
+    ]
@@ -1,30 +1,125 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
+from polls.signals import polls_removed
 
 # Create your models here.
-# Models for the POLLS app: a Question with a corresponding set of Choices and a dictionary, or DictforQuestion, that has a set of Keyvalue objects.
-# Each Keyvalue will have a KEY corresponding to the id of a user who has voted for the corresponding Question and a VALUE corresponding to the id
-# of the Choice for which the KEY most recently voted.
+# Models for the POLLS app: a Question with a corresponding set of Choices and a set of Votes. Each Vote is the ballot of one user in one
+# Question and points to the Choice for which that user most recently voted.
+class QuestionManager(models.Manager):
+	def is_complete_poll(self, text, choice_texts):
+		# Returns whether a poll with question TEXT and CHOICE_TEXTS has every field filled in and at least one choice.
+		return bool(text) and bool(choice_texts) and all(choice_texts)
+
+	def create_poll(self, user, text, choice_texts, date_published=None):
+		# Creates and returns a Question by USER with TEXT and one Choice per text in CHOICE_TEXTS (see CREATE_POLLS).
+		return self.create_polls([(user.id, text, choice_texts, date_published)])[0]
+
+	def create_polls(self, polls):
+		# Creates a batch of polls, each given as a (user id, question text, list of choice texts, publication date or None for now) tuple,
+		# and returns their Questions. Everything is written in one transaction: the Questions one by one (so that their ids are known),
+		# then the Choices of the whole batch with one bulk insert. The polls must have been validated beforehand.
+		with transaction.atomic():
+			questions, choices = [], []
+			for user_id, text, choice_texts, date_published in polls:
+				question = self.create(user_id=user_id, text=text, date_published=date_published or timezone.now(), total_votes=0)
+				questions.append(question)
+				choices.extend(Choice(question=question, choice_text=choice_text, votes=0) for choice_text in choice_texts)
+			Choice.objects.bulk_create(choices)
+		return questions
+
+	def remove_poll(self, question_id, user):
+		# Removes the poll with QUESTION_ID if it belongs to USER and returns whether it did. Removal only sets the poll's REMOVED_AT, one
+		# UPDATE however many ballots the poll has, and deletes its one ranking row (see POLLS app's receivers module); its ballots, counter
+		# shards and choices are deleted later in small batches by the purge_removed_polls management command (see POLLS app's purge module).
+		if not self.filter(pk=question_id, user=user, removed_at__isnull=True).update(removed_at=timezone.now()):
+			return False
+		polls_removed.send(sender=Question, question_ids=[int(question_id)], user_ids=[user.id])
+		return True
+
+class LiveQuestionManager(QuestionManager):
+	def get_queryset(self):
+		# Leaves out removed polls (see REMOVE_POLL).
+		return super(LiveQuestionManager, self).get_queryset().filter(removed_at__isnull=True)
+
 class Question(models.Model):
+	# Removed polls stay in the table until they are purged. OBJECTS, the default manager (used by the admin, dumpdata and related managers
+	# such as USER.QUESTION_SET), lists every poll; LIVE lists the polls that have not been removed, and is what the site shows. TOTAL_VOTES
+	# is only the poll's full total while counters are not sharded (POLLS_COUNTER_SHARDS = 1): sharded votes are counted in ChoiceShards
+	# alone, so the site shows the totals of the poll's results (see POLLS app's results module) and never reads this column directly.
 	user = models.ForeignKey(User)
 	text = models.CharField(max_length=200)
 	date_published = models.DateTimeField()
 	total_votes = models.IntegerField(default=0)
+	removed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+	objects = QuestionManager()
+	live = LiveQuestionManager()
+	class Meta:
+		# Supports the keyset pagination of a user's polls page, which walks a user's polls in (date_published, id) order.
+		index_together = [('user', 'date_published', 'id')]
 	def __str__(self):
 		return self.text
 
-class DictforQuestion(models.Model):
-	question = models.OneToOneField(Question, primary_key=True)
-
-class Keyvalue(models.Model):
-	dictionary = models.ForeignKey(DictforQuestion)
-	key = models.IntegerField()
-	value = models.IntegerField()
-
-
 class Choice(models.Model):
 	question = models.ForeignKey(Question)
 	choice_text = models.CharField(max_length=200)
 	votes = models.IntegerField(default=0)
 	def __str__(self):
-		return self.choice_text
\ No newline at end of file
+		return self.choice_text
+
+class ChoiceShard(models.Model):
+	# One of up to POLLS_COUNTER_SHARDS partial vote counters of a Choice. Spreading the counter writes of a hot poll over several rows keeps
+	# concurrent votes from all contending on the same Choice row; the effective count of a Choice is its VOTES plus the VOTES of its shards,
+	# and the effective total of a Question is its TOTAL_VOTES plus the VOTES of all shards of its Choices.
+	choice = models.ForeignKey(Choice)
+	index = models.IntegerField()
+	votes = models.IntegerField(default=0)
+	class Meta:
+		unique_together = ('choice', 'index')
+
+class Vote(models.Model):
+	# The ballot of USER in QUESTION, pointing to the CHOICE the user most recently voted for at VOTED_AT. A user holds at most one ballot per
+	# poll, so (question, user) is unique; its index answers "has this user voted". The (question, user, choice) index covers "and for what"
+	# without reading the table, and the (question, choice) index serves per-choice tallies of a poll. VOTED_AT is indexed so that the polls
+	# voted on since a given time can be found without a full scan.
+	question = models.ForeignKey(Question)
+	user = models.ForeignKey(User)
+	choice = models.ForeignKey(Choice)
+	voted_at = models.DateTimeField(default=timezone.now, db_index=True)
+	class Meta:
+		unique_together = ('question', 'user')
+		index_together = [('question', 'user', 'choice'), ('question', 'choice')]
+
+class PollRanking(models.Model):
+	# The leaderboard entry of a poll that has been voted on, kept up to date as votes are counted (see POLLS app's ranking module).
+	# TOTAL_VOTES is the poll's number of voters and TRENDING the logarithm of its time-decayed vote count, which only changes when the poll
+	# gets votes yet orders polls correctly at any time. Each leaderboard is one read in index order: (total_votes, trending) for the top polls
+	# and trending for the polls trending now. Removed polls lose their ranking (see POLLS app's receivers module), so that the leaderboards
+	# need not look at the polls to leave them out.
+	question = models.OneToOneField(Question, primary_key=True)
+	total_votes = models.IntegerField(default=0, db_index=True)
+	trending = models.FloatField(db_index=True)
+	class Meta:
+		index_together = [('total_votes', 'trending')]
+
+class VoteActivity(models.Model):
+	# A rollup of the votes a poll got over time (see POLLS app's activity module): COUNTS is an array of vote counts packed into bytes, one
+	# per minute of the hour starting at START (MINUTE resolution) or one per hour of the day starting at START (HOUR resolution). The unique
+	# index answers the reads of one poll's activity over a period; the (resolution, start) index finds old minute rollups to compact.
+	MINUTE, HOUR = 0, 1
+	question = models.ForeignKey(Question)
+	resolution = models.SmallIntegerField(choices=((MINUTE, 'minute'), (HOUR, 'hour')))
+	start = models.DateTimeField()
+	counts = models.BinaryField()
+	class Meta:
+		unique_together = ('question', 'resolution', 'start')
+		index_together = [('resolution', 'start')]
+
+class ReconciliationRun(models.Model):
+	# A run of the reconcile_tallies management command, which checks the vote counters of polls against their Votes. STARTED_AT of the
+	# latest run is where the next incremental run picks up.
+	started_at = models.DateTimeField(db_index=True)
+	incremental = models.BooleanField(default=False)
+	polls_checked = models.IntegerField(default=0)
+	polls_drifted = models.IntegerField(default=0)
+	fixed = models.BooleanField(default=False)
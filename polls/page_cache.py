@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.contrib import messages
+from django.db import DEFAULT_DB_ALIAS
+from polls.models import Question
+from polls.results import results_cache
+import uuid
+
+# Full-page cache of the POLLS_PAGE view for anonymous viewers. Logged-out visitors all see the same page for a given owner and pagination
+# position, so the rendered page is cached under the owner's id, the decoded cursor (see POLLS app's pagination module) and a per-owner
+# generation token. Creating, removing or voting on one of the owner's polls replaces the generation token, which invalidates every cached
+# page of that owner at once. Cursors come from the query string, so the POLLS_PAGE view only caches the first page and pages following one
+# of the owner's polls; any other cursor would let a client fill the cache (shared with the poll results) with pages nobody links to.
+
+def page_cache_enabled(request):
+	# Returns whether the POLLS_PAGE view may serve REQUEST from the page cache: only anonymous viewers without pending messages (which are
+	# shown on the page) are served cached pages, and only if POLLS_ANONYMOUS_PAGE_CACHE is on.
+	return getattr(settings, 'POLLS_ANONYMOUS_PAGE_CACHE', True) and not request.user.is_authenticated() \
+		and not len(messages.get_messages(request))
+
+def generation_key(owner_id):
+	return 'polls:page_generation:%s' % owner_id
+
+def page_key(owner_id, position):
+	# Returns the cache key of OWNER_ID's page at POSITION (a decoded cursor, or None for the first page) under the owner's current
+	# generation, starting a new generation if there is none.
+	cache = results_cache()
+	generation = cache.get(generation_key(owner_id))
+	if generation is None:
+		cache.add(generation_key(owner_id), uuid.uuid4().hex, None)
+		generation = cache.get(generation_key(owner_id))
+	return 'polls:page:%s:%s:%s' % (owner_id, generation, '%s_%d' % (position[0].isoformat(), position[1]) if position else '')
+
+def get_cached_page(owner_id, position):
+	# Returns the cached content of OWNER_ID's polls page at POSITION, or None.
+	return results_cache().get(page_key(owner_id, position))
+
+def cache_page(owner_id, position, content):
+	results_cache().set(page_key(owner_id, position), content, getattr(settings, 'POLLS_PAGE_CACHE_TIMEOUT', 300))
+
+def invalidate_pages(owner_ids):
+	# Invalidates all cached polls pages of the users with OWNER_IDS by giving each of them a new generation. Pages of the old generation are
+	# never read again and age out of the cache.
+	results_cache().set_many(dict((generation_key(owner_id), uuid.uuid4().hex) for owner_id in owner_ids), None)
+
+def invalidate_pages_of_polls(question_ids):
+	# Invalidates the cached polls pages of the owners of the polls with QUESTION_IDS.
+	invalidate_pages(set(Question.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=question_ids).values_list('user_id', flat=True)))
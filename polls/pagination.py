@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from datetime import datetime, timedelta
+
+# Keyset (cursor) pagination of a user's polls for the POLLS_PAGE view. Polls are listed newest first in (date_published, id) order, and a
+# page is fetched by seeking past the last poll of the previous page instead of with an OFFSET, so every page costs the same single
+# indexed query (see the Question model's index_together) no matter how many polls the user has.
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def encode_cursor(question):
+	# Returns the cursor for the page following QUESTION: its publication time in microseconds since the epoch and its id, joined by '_'.
+	elapsed = question.date_published - EPOCH
+	microseconds = (elapsed.days * 86400 + elapsed.seconds) * 1000000 + elapsed.microseconds
+	return '%d_%d' % (microseconds, question.id)
+
+def decode_cursor(cursor):
+	# Returns the (date_published, id) pair encoded in CURSOR, or None if CURSOR is missing or malformed.
+	try:
+		microseconds, question_id = [int(part) for part in cursor.split('_')]
+		return EPOCH + timedelta(microseconds=microseconds), question_id
+	except (AttributeError, ValueError, OverflowError):
+		return None
+
+def polls_page_size():
+	# Returns the number of polls shown per polls page (POLLS_PAGE_SIZE).
+	return max(getattr(settings, 'POLLS_PAGE_SIZE', 25), 1)
+
+def page_of_polls(user, cursor):
+	# Returns the page of USER's polls that follows CURSOR (the first page if CURSOR is None or malformed) as a list, together with the cursor
+	# of the next page, or None if this is the last page, and whether CURSOR is missing or follows one of USER's live polls (that is, whether
+	# it is a cursor this site hands out rather than a position a client made up). One extra poll is fetched to find out whether there is a
+	# next page, and the poll CURSOR follows is fetched in the same query.
+	size = polls_page_size()
+	questions = user.question_set.filter(removed_at__isnull=True).order_by('-date_published', '-id')
+	position = decode_cursor(cursor)
+	follows_poll = position is None
+	if position is not None:
+		date_published, question_id = position
+		questions = questions.filter(Q(date_published__lt=date_published) | Q(date_published=date_published, id__lte=question_id))
+		questions = list(questions[:size + 2])
+		follows_poll = bool(questions) and (questions[0].date_published, questions[0].id) == position
+		if follows_poll:
+			questions = questions[1:]
+	questions = list(questions[:size + 1])
+	if len(questions) > size:
+		return questions[:size], encode_cursor(questions[size - 1]), follows_poll
+	return questions, None, follows_poll
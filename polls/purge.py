@@ -0,0 +1,36 @@
+from polls.models import Question, Choice, ChoiceShard, Vote, VoteActivity
+from pollsite.db import serialized_write
+import time
+
+# Purging of removed polls. Removing a poll only sets its REMOVED_AT (see the Question model's manager); PURGE_REMOVED_POLLS later deletes
+# the rows of removed polls: their ballots, vote activity, counter shards and then their choices, BATCH_SIZE rows per statement and each
+# batch in its own short write (through the site's serialized writer in production SQLite mode, see pollsite/db.py), sleeping PAUSE seconds
+# between batches so that votes on other polls keep getting the database. Only the last, now empty Question is deleted through Django's
+# collector, along with its leaderboard ranking.
+
+def purge_removed_polls(batch_size=1000, pause=0.05, removed_before=None):
+	# Purges every poll removed before REMOVED_BEFORE (or every removed poll) and yields (question id, rows deleted) as each is done.
+	removed = Question.objects.filter(removed_at__isnull=False)
+	if removed_before is not None:
+		removed = removed.filter(removed_at__lt=removed_before)
+	for question_id in list(removed.order_by('id').values_list('id', flat=True)):
+		yield question_id, purge_poll(question_id, batch_size, pause)
+
+def purge_poll(question_id, batch_size, pause):
+	# Deletes the removed poll with QUESTION_ID in batches and returns the number of rows deleted.
+	deleted = 0
+	for rows in (Vote.objects.filter(question=question_id), VoteActivity.objects.filter(question=question_id),
+			ChoiceShard.objects.filter(choice__question=question_id), Choice.objects.filter(question=question_id)):
+		while True:
+			ids = list(rows.order_by('id').values_list('id', flat=True)[:batch_size])
+			if not ids:
+				break
+			# The batch is given as an id range of the poll's rows rather than a list of ids, which keeps the statement's parameters few.
+			serialized_write(delete_rows, rows.filter(id__lte=ids[-1]))
+			deleted += len(ids)
+			time.sleep(pause)
+	serialized_write(delete_rows, Question.objects.filter(pk=question_id, removed_at__isnull=False))
+	return deleted + 1
+
+def delete_rows(rows):
+	rows.delete()
@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from polls.models import Question, PollRanking
+from datetime import datetime
+import math
+
+# Site-wide leaderboards of polls: the top polls by number of voters and the polls trending now. Both are read from PollRanking, which
+# APPLY_COUNTER_DELTAS (see POLLS app's votes module) updates with RANK_VOTES whenever new voters are counted, so serving a leaderboard is
+# one read in index order however many polls there are. Removed polls are unranked with UNRANK_POLLS as they are removed, so the reads
+# never filter on the polls themselves.
+#
+# A vote's weight in the trending score halves every POLLS_TRENDING_HALF_LIFE_HOURS. Instead of decaying every poll's score as time passes,
+# each vote is weighted by exp(RATE * (time of the vote - EPOCH)), which grows as time passes, and a poll's TRENDING is the logarithm of the
+# sum of its votes' weights. Dividing every score by the same exp(RATE * (now - EPOCH)) would give the decayed counts, so the order of the
+# stored scores is already the order of the decayed counts, and keeping them as logarithms keeps the numbers small.
+
+EPOCH = datetime(2015, 1, 1, tzinfo=timezone.utc)
+
+def decay_rate():
+	# Returns the decay rate of vote weights per second.
+	return math.log(2) / (getattr(settings, 'POLLS_TRENDING_HALF_LIFE_HOURS', 6) * 3600.0)
+
+def vote_score(when):
+	# Returns the logarithm of the weight of a vote cast at WHEN.
+	return decay_rate() * (when - EPOCH).total_seconds()
+
+def log_add(a, b):
+	# Returns log(exp(A) + exp(B)) without overflowing.
+	high, low = max(a, b), min(a, b)
+	return high + math.log1p(math.exp(low - high))
+
+def recent_votes(trending, now=None):
+	# Returns the time-decayed vote count of a poll with the TRENDING score at NOW (or now).
+	return math.exp(trending - vote_score(now or timezone.now()))
+
+def rank_votes(question_counts, when=None):
+	# Adds the new voters counted at WHEN (or now) to the rankings of their polls; QUESTION_COUNTS maps poll ids to their numbers of new
+	# voters, leaving out or giving 0 for polls that had none. Must be called inside a transaction. Rankings are updated in poll id order,
+	# and each one is written before it is read: the F() UPDATE of TOTAL_VOTES takes the write lock (SQLite fails a transaction that reads
+	# and then writes with "database is locked" at once instead of waiting), and only then is TRENDING read and replaced. The first votes of
+	# a poll create its ranking, unless the poll has been removed meanwhile; if another vote creates it concurrently, the unique key rejects
+	# the second insert and the ranking is updated instead.
+	when = when or timezone.now()
+	for question_id in sorted(question_counts):
+		count = question_counts[question_id]
+		if count <= 0:
+			continue
+		score = math.log(count) + vote_score(when)
+		rankings = PollRanking.objects.filter(pk=question_id)
+		if not rankings.update(total_votes=F('total_votes') + count):
+			if not Question.live.filter(pk=question_id).exists():
+				continue
+			try:
+				with transaction.atomic():
+					PollRanking.objects.create(question_id=question_id, total_votes=count, trending=score)
+				continue
+			except IntegrityError:
+				rankings.update(total_votes=F('total_votes') + count)
+		trending = rankings.values_list('trending', flat=True).get()
+		rankings.update(trending=log_add(trending, score))
+
+def unrank_polls(question_ids):
+	# Deletes the rankings of the polls with QUESTION_IDS, which have been removed.
+	PollRanking.objects.filter(pk__in=question_ids).delete()
+
+def leaderboard_size():
+	return getattr(settings, 'POLLS_LEADERBOARD_SIZE', 20)
+
+def top_polls(limit=None):
+	# Returns the rankings of the LIMIT (or POLLS_LEADERBOARD_SIZE) polls with the most voters, with their questions and owners.
+	return list(PollRanking.objects.select_related('question__user')
+		.order_by('-total_votes', '-trending')[:limit or leaderboard_size()])
+
+def trending_polls(limit=None):
+	# Returns the rankings of the LIMIT (or POLLS_LEADERBOARD_SIZE) polls trending now, with their questions and owners, each with its
+	# RECENT_VOTES (the decayed vote count).
+	now = timezone.now()
+	rankings = list(PollRanking.objects.select_related('question__user')
+		.order_by('-trending')[:limit or leaderboard_size()])
+	for ranking in rankings:
+		ranking.recent_votes = recent_votes(ranking.trending, now)
+	return rankings
@@ -0,0 +1,40 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from polls.models import Question
+from polls.results import invalidate_poll_results
+from polls.page_cache import invalidate_pages, invalidate_pages_of_polls
+from polls.signals import results_changed, polls_removed
+from polls.live import results_feed
+from polls.ranking import unrank_polls
+
+# Signal receivers of the POLLS app, connected by PollsConfig.ready (see POLLS app's apps module).
+
+@receiver(results_changed)
+def refresh_poll_results(sender, question_ids, **kwargs):
+	# Drops the cached results and the owners' cached polls pages of polls whose vote counts have changed, then wakes up the live results
+	# streams of those polls (see POLLS app's live module), which read the rebuilt results.
+	invalidate_poll_results(question_ids)
+	invalidate_pages_of_polls(question_ids)
+	results_feed.publish(question_ids)
+
+@receiver(post_save, sender=Question)
+def refresh_polls_pages(sender, instance, created, **kwargs):
+	# Invalidates the owner's cached polls pages when a poll is created.
+	if created:
+		invalidate_pages([instance.user_id])
+
+@receiver(post_delete, sender=Question)
+def forget_poll_results(sender, instance, **kwargs):
+	# Drops the cached results of a deleted poll, invalidates its owner's cached polls pages and ends the poll's live results streams.
+	invalidate_poll_results([instance.id])
+	invalidate_pages([instance.user_id])
+	results_feed.publish([instance.id])
+
+@receiver(polls_removed)
+def forget_removed_polls(sender, question_ids, user_ids, **kwargs):
+	# Same as FORGET_POLL_RESULTS for removed polls, whose rows are only deleted later, when they are purged, and takes them off the
+	# leaderboards.
+	unrank_polls(question_ids)
+	invalidate_poll_results(question_ids)
+	invalidate_pages(user_ids)
+	results_feed.publish(question_ids)
@@ -0,0 +1,95 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.core.cache import caches
+from django.http import Http404
+from django.db.models import Sum
+from polls.models import Question, Choice, ChoiceShard
+from polls.votes import counter_shards
+import hashlib
+import json
+import uuid
+
+# Cached poll results for the POLLS app. The results of a poll (its question text, choices and vote counts) are kept in Django's cache
+# framework under one key per poll, so that showing a poll takes no queries once its results are cached. Writes that change a poll's
+# results call INVALIDATE_POLL_RESULTS, and the next read rebuilds them.
+#
+# A read that misses builds the results from the database while a vote may be committing and invalidating them, and caching what it built
+# afterwards would keep the stale results. Invalidation therefore also gives each poll a new generation token, and rebuilt results are only
+# cached if their poll's token is still the one seen before they were read. Results also expire after POLLS_RESULTS_TIMEOUT seconds, which
+# bounds how long anything stale that slips through (between that check and the write to the cache) can be served.
+
+def results_cache():
+	# Returns the cache holding poll results (the POLLS_CACHE alias of settings.CACHES).
+	return caches[getattr(settings, 'POLLS_CACHE', 'default')]
+
+def results_key(question_id):
+	return 'polls:results:%s' % question_id
+
+def generation_key(question_id):
+	return 'polls:results_generation:%s' % question_id
+
+def get_poll_results(question_id):
+	# Returns the results of the poll with QUESTION_ID as a dictionary with the question's ID, TEXT, USER_ID (its owner) and TOTAL_VOTES, a
+	# list of CHOICES, each a dictionary with the choice's ID, CHOICE_TEXT and VOTES, in the order the choices were created, and a VERSION
+	# that changes whenever any of these change. Templates can read these like the attributes of a Question and its Choices. Raises Http404
+	# if there is no such poll.
+	results = get_many_poll_results([question_id]).get(int(question_id))
+	if results is None:
+		raise Http404('No Question matches the given query.')
+	return results
+
+def get_many_poll_results(question_ids):
+	# Returns the results (see GET_POLL_RESULTS) of the polls with QUESTION_IDS as a dictionary keyed by poll id, leaving out polls that do not
+	# exist. Cached results are read with one GET_MANY, together with the generations of the polls, and the missing ones are built together
+	# and cached unless they have been invalidated meanwhile.
+	cache = results_cache()
+	question_ids = set(int(question_id) for question_id in question_ids)
+	cached = cache.get_many([results_key(question_id) for question_id in question_ids] +
+		[generation_key(question_id) for question_id in question_ids])
+	results = dict((question_id, cached[results_key(question_id)]) for question_id in question_ids if results_key(question_id) in cached)
+	built = build_poll_results(question_ids - set(results))
+	if built:
+		generations = cache.get_many([generation_key(question_id) for question_id in built])
+		cache.set_many(dict((results_key(question_id), built[question_id]) for question_id in built
+			if generations.get(generation_key(question_id)) == cached.get(generation_key(question_id))),
+			getattr(settings, 'POLLS_RESULTS_TIMEOUT', 300))
+		results.update(built)
+	return results
+
+def add_results_totals(questions):
+	# Sets the TOTAL_VOTES of each of QUESTIONS, in place, to the total of the poll's results. The TOTAL_VOTES column of a Question leaves out
+	# the votes held by sharded counters (see POLLS app's votes module), so pages show the totals of the results instead.
+	results = get_many_poll_results([question.id for question in questions])
+	for question in questions:
+		if question.id in results:
+			question.total_votes = results[question.id]['total_votes']
+
+def build_poll_results(question_ids):
+	# Reads the results of the polls with QUESTION_IDS from the database, including any sharded vote counters (see POLLS app's votes
+	# module), with one query each for the questions, their choices and their shards. The VERSION of a poll's results is a digest of the
+	# rest of them, so it is the same in every process that builds them and only changes when the results do. The results are cached, so
+	# they are read from the primary database rather than from a replica that may not have the latest votes yet (see pollsite/routers.py).
+	if not question_ids:
+		return {}
+	results = {}
+	for question in Question.live.using(DEFAULT_DB_ALIAS).filter(pk__in=question_ids):
+		results[question.id] = {'id': question.id, 'text': question.text, 'user_id': question.user_id, 'total_votes': question.total_votes,
+			'choices': []}
+	shards = {}
+	if counter_shards() > 1:
+		shards = dict(ChoiceShard.objects.using(DEFAULT_DB_ALIAS).filter(choice__question_id__in=results).values_list('choice') \
+			.annotate(Sum('votes')).order_by())
+	for choice in Choice.objects.using(DEFAULT_DB_ALIAS).filter(question_id__in=results).order_by('id'):
+		votes = choice.votes + shards.get(choice.id, 0)
+		results[choice.question_id]['choices'].append({'id': choice.id, 'choice_text': choice.choice_text, 'votes': votes})
+		results[choice.question_id]['total_votes'] += shards.get(choice.id, 0)
+	for poll in results.values():
+		poll['version'] = hashlib.sha1(json.dumps(poll, sort_keys=True).encode('utf-8')).hexdigest()
+	return results
+
+def invalidate_poll_results(question_ids):
+	# Drops the cached results of the polls with QUESTION_IDS, so that they are rebuilt from the database the next time they are read, and
+	# gives the polls new generations, so that results being rebuilt meanwhile are not cached.
+	cache = results_cache()
+	cache.set_many(dict((generation_key(question_id), uuid.uuid4().hex) for question_id in question_ids), None)
+	cache.delete_many([results_key(question_id) for question_id in question_ids])
@@ -0,0 +1,10 @@
+from django.dispatch import Signal
+
+# Signals of the POLLS app.
+
+# Sent once changed vote counts of the polls with QUESTION_IDS have been written to the database (after a vote, or after a flush of the
+# write-behind vote buffer), so that anything derived from those counts can be refreshed.
+results_changed = Signal(providing_args=['question_ids'])
+
+# Sent once the polls with QUESTION_IDS, owned by the users with USER_IDS, have been removed (see the Question model's manager).
+polls_removed = Signal(providing_args=['question_ids', 'user_ids'])
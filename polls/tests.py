@@ -1,9 +1,38 @@
-from django.test import TestCase, RequestFactory
+from django.test import TestCase, TransactionTestCase, RequestFactory
 from users.tests import username, email, password, firstname, lastname, make_user, signup_creds, login_creds, attempt_signup, attempt_login
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User, AnonymousUser
 from django.contrib.auth import authenticate, login, logout
-from polls.models import Question, Choice, DictforQuestion
+from polls.models import Question, Choice, ChoiceShard, Vote, ReconciliationRun, PollRanking, VoteActivity
+from django.db import IntegrityError, OperationalError, connection, transaction
+from polls.votes import record_vote, flush_vote_buffer
+from polls.signals import results_changed
+from polls.results import get_poll_results, results_cache, results_key, invalidate_poll_results
+from polls.pagination import page_of_polls, decode_cursor
+from polls.page_cache import get_cached_page
+import polls.results
+from polls.ranking import vote_score, rank_votes, recent_votes, top_polls, trending_polls
+from polls.activity import activity_histogram, record_activity, hour_of, bucket_start
+from users.user_cache import get_cached_user
+from pollsite.db import serialized_write, stop_serialized_writer
+from pollsite.ratelimit import reset_rate_limits
+from django.test.utils import override_settings, CaptureQueriesContext
+from django.db.models import Sum
+from django.db.migrations.executor import MigrationExecutor
+from django.core.management import call_command, CommandError
+from django.utils.six import StringIO
+from contextlib import contextmanager
+from unittest import mock
+from datetime import timedelta
+import csv
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
 from django.utils import timezone
 
 # Create your tests here.
@@ -36,15 +65,24 @@ def create_poll(testcase, question):
 	# Helper function for creating a poll with QUESTION credentials.
 	return testcase.client.post(reverse('polls:creating_poll', args=(testcase.user.id,)), question, follow=True)
 
-def create_poll_and_return_question(testcase, question):
-	# Helper function for creating a poll with QUESTION credentials and returning that poll so that tests can use its id.
-	result = testcase.user.question_set.create(text=question['question'], date_published=timezone.now(), total_votes=0)
+def create_poll_and_return_question(testcase, question, owner=None):
+	# Helper function for creating a poll with QUESTION credentials and returning that poll so that tests can use its id. The poll belongs
+	# to OWNER, or to the test case's user if no OWNER is given.
+	result = (owner or testcase.user).question_set.create(text=question['question'], date_published=timezone.now(), total_votes=0)
 	for i in range(int(question['selection'])):
 			result.choice_set.create(choice_text=sample_question_1['choice'+str(i+1)], votes=0)
-	dictionary = DictforQuestion(question=result)
-	dictionary.save()
 	return result
 
+def make_voters(count):
+	# Helper function for creating COUNT Pollsite members to vote in tests, returning their ids.
+	User.objects.bulk_create([User(username='voter%d' % i, email='voter%d@gmail.com' % i) for i in range(count)])
+	return list(User.objects.filter(username__startswith='voter').order_by('id').values_list('id', flat=True))
+
+def first_statement(queries):
+	# Helper function returning the kind ('SELECT', 'UPDATE', ...) of the first statement captured in QUERIES, savepoints aside.
+	statements = [re.match(r"(QUERY = ')?(\w+)", query['sql']).group(2) for query in queries]
+	return [statement for statement in statements if statement not in ('SAVEPOINT', 'RELEASE')][0]
+
 def vote(testcase, question_id, choice_id):
 	return testcase.client.post(reverse('polls:processing_vote', args=(question_id,)), {'choice': choice_id}, follow=True)
 
@@ -53,6 +91,8 @@ class PollsTests(TestCase):
 		# Set up a request factory for the following tests. Note that setUp is called before EVERY test.
 		self.factory = RequestFactory()
 		self.user = make_user(True)
+		results_cache().clear()
+		reset_rate_limits()
 
 	def test_polls_page_as_page_owner(self):
 		# Check that visiting your own polls page gives you the option to create and remove your own polls and log out.
@@ -215,6 +255,591 @@ class PollsTests(TestCase):
 		response = self.client.get(reverse('polls:polls_page', args=(self.user.id,)), follow=True)
 		self.assertContains(response, '<td>0</td>', html=True) # Poll still has 0 total votes
 
+	def test_one_ballot_per_voter(self):
+		# Check that revoting updates the voter's single Vote in place and that a second ballot for the same (poll, user) is rejected
+		# by the database.
+		question = create_poll_and_return_question(self, sample_question_1)
+		attempt_login(self, login_creds)
+		vote(self, question.id, question.choice_set.get(choice_text=sample_question_1['choice1']).id)
+		vote(self, question.id, question.choice_set.get(choice_text=sample_question_1['choice2']).id)
+		self.assertEqual(Vote.objects.filter(question=question, user=self.user).count(), 1)
+		with self.assertRaises(IntegrityError):
+			with transaction.atomic():
+				Vote.objects.create(question=question, user=self.user, choice=question.choice_set.all()[0])
+
+	@override_settings(POLLS_VOTE_WRITE_BEHIND=True, POLLS_VOTE_FLUSH_MAX_VOTES=3, POLLS_VOTE_FLUSH_INTERVAL_MS=60000)
+	def test_write_behind_vote_counters(self):
+		# Check that in write-behind mode ballots are recorded immediately while counter changes wait in the buffer until
+		# POLLS_VOTE_FLUSH_MAX_VOTES votes are pending or the buffer is flushed.
+		question = create_poll_and_return_question(self, sample_question_1)
+		choice1, choice2 = question.choice_set.get(choice_text='Good'), question.choice_set.get(choice_text='Okay')
+		voters = make_voters(3)
+		record_vote(question, voters[0], choice1)
+		record_vote(question, voters[1], choice1)
+		self.assertEqual(Vote.objects.filter(question=question).count(), 2)
+		self.assertEqual(Question.objects.get(pk=question.id).total_votes, 0)
+		record_vote(question, voters[0], choice2) # third pending vote triggers a flush
+		self.assertEqual(Question.objects.get(pk=question.id).total_votes, 2)
+		self.assertEqual([choice.votes for choice in question.choice_set.order_by('id')], [1, 1, 0])
+		record_vote(question, voters[2], choice2)
+		flush_vote_buffer()
+		self.assertEqual(Question.objects.get(pk=question.id).total_votes, 3)
+		self.assertEqual(Choice.objects.get(pk=choice2.id).votes, 2)
+
+	@override_settings(POLLS_COUNTER_SHARDS=4)
+	def test_sharded_vote_counters(self):
+		# Check that with sharded counters votes are written to ChoiceShard rows instead of the Choice and Question rows, and that the
+		# vote and polls pages still show the summed counts.
+		question = create_poll_and_return_question(self, sample_question_1)
+		choice1, choice2 = question.choice_set.get(choice_text='Good'), question.choice_set.get(choice_text='Okay')
+		voters = make_voters(10)
+		for user_id in voters:
+			record_vote(question, user_id, choice1)
+		record_vote(question, voters[0], choice2)
+		self.assertEqual(Question.objects.get(pk=question.id).total_votes, 0)
+		self.assertEqual(Choice.objects.get(pk=choice1.id).votes, 0)
+		self.assertEqual(ChoiceShard.objects.filter(choice=choice1).aggregate(total=Sum('votes'))['total'], 9)
+		self.assertEqual(ChoiceShard.objects.filter(choice=choice2).aggregate(total=Sum('votes'))['total'], 1)
+		attempt_login(self, login_creds)
+		response = self.client.get(reverse('polls:vote_poll', args=(question.id,)))
+		self.assertContains(response, \
+			'<div class="progress-bar progress-bar-striped active" role="progressbar" aria-valuenow="9" aria-valuemin="0" aria-valuemax="10" \
+				style="width: 90%" id="'+str(choice1.id)+'">9</div>', \
+			status_code=200, html=True
+			)
+		response = self.client.get(reverse('polls:polls_page', args=(self.user.id,)))
+		self.assertContains(response, '<td>10</td>', html=True)
+
+	def test_cached_poll_results(self):
+		# Check that a poll's results are read from the cache without any queries once cached, and that a vote and a removal of the poll
+		# invalidate them.
+		question = create_poll_and_return_question(self, sample_question_1)
+		choice = question.choice_set.get(choice_text='Good')
+		self.assertEqual(get_poll_results(question.id)['total_votes'], 0)
+		with self.assertNumQueries(0):
+			results = get_poll_results(question.id)
+		self.assertEqual([c['choice_text'] for c in results['choices']], ['Good', 'Okay', 'Bad'])
+		attempt_login(self, login_creds)
+		vote(self, question.id, choice.id)
+		results = get_poll_results(question.id)
+		self.assertEqual(results['total_votes'], 1)
+		self.assertEqual(results['choices'][0]['votes'], 1)
+		self.client.get(reverse('polls:process_remove', args=(question.id, self.user.id)))
+		response = self.client.get(reverse('polls:vote_poll', args=(question.id,)))
+		self.assertEqual(response.status_code, 404)
+
+	def test_results_invalidated_while_built_are_not_cached(self):
+		# Check that results rebuilt while a vote invalidates them are returned but not cached, and that results built undisturbed are.
+		question = create_poll_and_return_question(self, sample_question_1)
+		build_poll_results = polls.results.build_poll_results
+		def build_during_a_vote(question_ids):
+			results = build_poll_results(question_ids)
+			invalidate_poll_results(question_ids)
+			return results
+		polls.results.build_poll_results = build_during_a_vote
+		try:
+			self.assertEqual(get_poll_results(question.id)['id'], question.id)
+		finally:
+			polls.results.build_poll_results = build_poll_results
+		self.assertIsNone(results_cache().get(results_key(question.id)))
+		get_poll_results(question.id)
+		self.assertIsNotNone(results_cache().get(results_key(question.id)))
+
+	@override_settings(POLLS_PAGE_SIZE=25)
+	def test_polls_page_keyset_pagination(self):
+		# Check that the polls page walks a user's polls newest first, 25 at a time, without skipping or repeating polls (including polls
+		# published at the same moment), and that every page takes the same number of queries.
+		now = timezone.now()
+		Question.objects.bulk_create([Question(user=self.user, text='Poll %d' % i, date_published=now - timedelta(minutes=i // 2)) \
+			for i in range(60)])
+		url = reverse('polls:polls_page', args=(self.user.id,))
+		get_cached_user(self.user.id) # the first page would otherwise also read the owner into the user cache
+		seen, cursor, query_counts = [], None, set()
+		while True:
+			with CaptureQueriesContext(connection) as queries:
+				response = self.client.get(url, {'cursor': cursor} if cursor else {})
+			query_counts.add(len(queries))
+			page = list(response.context['questions_list'])
+			self.assertLessEqual(len(page), 25)
+			seen.extend(page)
+			cursor = response.context['next_cursor']
+			if cursor is None:
+				break
+		self.assertEqual(len(seen), 60)
+		self.assertEqual(len(set(question.id for question in seen)), 60)
+		self.assertEqual(seen, sorted(seen, key=lambda question: (question.date_published, question.id), reverse=True))
+		self.assertEqual(len(query_counts), 1)
+		self.assertContains(response, 'Newest polls')
+		self.assertNotContains(response, 'Older polls')
+
+	def test_anonymous_polls_page_cache(self):
+		# Check that anonymous viewers get the polls page from the page cache, that logged-in viewers bypass it, and that creating, voting
+		# on and removing a poll of the page owner invalidate it.
+		url = reverse('polls:polls_page', args=(self.user.id,))
+		self.assertContains(self.client.get(url), 'No polls yet!')
+		with self.assertNumQueries(0):
+			self.assertContains(self.client.get(url), 'No polls yet!')
+		question = create_poll_and_return_question(self, sample_question_1)
+		self.assertContains(self.client.get(url), '<td>0</td>', html=True)
+		record_vote(question, make_voters(1)[0], question.choice_set.get(choice_text='Good'))
+		self.assertContains(self.client.get(url), '<td>1</td>', html=True)
+		attempt_login(self, login_creds)
+		self.assertContains(self.client.get(url), 'Remove a poll')
+		self.client.get(reverse('polls:process_remove', args=(question.id, self.user.id)))
+		self.client.get(reverse('users:processing_logout'))
+		self.assertContains(self.client.get(url), 'No polls yet!')
+
+	@override_settings(POLLS_PAGE_SIZE=1)
+	def test_page_cache_only_keeps_pages_of_genuine_cursors(self):
+		# Check that anonymous pages are cached under their decoded cursor, so a malformed cursor gets the cached first page, and that pages
+		# of cursors that decode but do not follow one of the owner's polls are served without being cached.
+		for question in sample_question_1, sample_question_1:
+			create_poll_and_return_question(self, question)
+		url = reverse('polls:polls_page', args=(self.user.id,))
+		next_cursor = self.client.get(url).context['next_cursor']
+		with self.assertNumQueries(0):
+			self.client.get(url, {'cursor': 'junk'})
+		self.client.get(url, {'cursor': next_cursor})
+		with self.assertNumQueries(0):
+			self.client.get(url, {'cursor': next_cursor})
+		for junk in ('1_1', '%s0' % next_cursor, '12345678901234567_%d' % Question.objects.latest('id').id):
+			self.assertEqual(self.client.get(url, {'cursor': junk}).status_code, 200)
+			self.assertIsNone(get_cached_page(self.user.id, decode_cursor(junk)))
+
+	def test_import_polls_command(self):
+		# Check that the import_polls command creates the valid polls of JSONL and CSV files, with their choices, and skips
+		# rows with unknown users or missing fields.
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		jsonl = os.path.join(directory, 'polls.jsonl')
+		with open(jsonl, 'w') as output:
+			output.write(json.dumps({'username': username, 'question': 'Cats or dogs?', 'choices': ['Cats', 'Dogs'], \
+				'date_published': '2014-12-28T11:29:00'}) + '\n')
+			output.write(json.dumps({'username': 'nobody', 'question': 'Tea?', 'choices': ['Yes']}) + '\n')
+			output.write(json.dumps({'username': username, 'question': '', 'choices': ['Yes']}) + '\n')
+		csv_file = os.path.join(directory, 'polls.csv')
+		with open(csv_file, 'w') as output:
+			output.write('username,question,date_published,choice1,choice2,choice3\n%s,Best season?,,Summer,Winter,\n' % username)
+		call_command('import_polls', jsonl, batch_size=2, stdout=StringIO(), stderr=StringIO())
+		call_command('import_polls', csv_file, stdout=StringIO(), stderr=StringIO())
+		questions = self.user.question_set.order_by('date_published')
+		self.assertEqual([question.text for question in questions], ['Cats or dogs?', 'Best season?'])
+		self.assertEqual([choice.choice_text for choice in questions[1].choice_set.order_by('id')], ['Summer', 'Winter'])
+		self.assertEqual(Choice.objects.filter(question__in=questions).count(), 4)
+
+	def test_reconcile_tallies_command(self):
+		# Check that reconcile_tallies reports polls whose counters disagree with their ballots, that --fix corrects them, and that an
+		# --incremental run only checks the polls voted on since the previous run.
+		question = create_poll_and_return_question(self, sample_question_1)
+		other = create_poll_and_return_question(self, sample_question_1)
+		choice1, choice2 = question.choice_set.get(choice_text='Good'), question.choice_set.get(choice_text='Okay')
+		voters = make_voters(3)
+		for user_id in voters:
+			record_vote(question, user_id, choice1)
+		record_vote(question, voters[0], choice2)
+		Question.objects.filter(pk=question.id).update(total_votes=7)
+		Choice.objects.filter(pk=choice1.id).update(votes=0)
+		output = StringIO()
+		call_command('reconcile_tallies', stdout=output)
+		self.assertIn('Poll %d: total_votes 7, expected 3; choice %d: 0, expected 2' % (question.id, choice1.id), output.getvalue())
+		self.assertIn('Checked 2 polls, 1 drifted.', output.getvalue())
+		self.assertEqual(Question.objects.get(pk=question.id).total_votes, 7)
+		call_command('reconcile_tallies', fix=True, stdout=StringIO())
+		self.assertEqual(Question.objects.get(pk=question.id).total_votes, 3)
+		self.assertEqual([choice.votes for choice in question.choice_set.order_by('id')], [2, 1, 0])
+		Question.objects.filter(pk=other.id).update(total_votes=5)
+		record_vote(question, voters[1], choice2)
+		output = StringIO()
+		call_command('reconcile_tallies', incremental=True, stdout=output)
+		self.assertIn('Checked 1 polls, 0 drifted.', output.getvalue())
+		self.assertEqual(ReconciliationRun.objects.count(), 3)
+		output = StringIO()
+		call_command('reconcile_tallies', stdout=output)
+		self.assertIn('Poll %d: total_votes 5, expected 0' % other.id, output.getvalue())
+
+	def test_poll_results_json(self):
+		# Check that the JSON results views return a poll's counts with an ETag, answer a matching If-None-Match with a 304 that reads no
+		# choice rows, and change the ETag after a vote; and that the batch view lists the existing polls of IDS in order.
+		question = create_poll_and_return_question(self, sample_question_1)
+		other = create_poll_and_return_question(self, sample_question_1)
+		url = reverse('polls:poll_results', args=(question.id,))
+		self.assertEqual(self.client.get(url).status_code, 403)
+		attempt_login(self, login_creds)
+		response = self.client.get(url)
+		data = json.loads(response.content.decode('utf-8'))
+		self.assertEqual(data['total_votes'], 0)
+		self.assertEqual([choice['choice_text'] for choice in data['choices']], ['Good', 'Okay', 'Bad'])
+		etag = response['ETag']
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 304)
+		self.assertFalse([query for query in queries if 'polls_' in query['sql']])
+		record_vote(question, make_voters(1)[0], question.choice_set.get(choice_text='Good'))
+		response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertNotEqual(response['ETag'], etag)
+		self.assertEqual(json.loads(response.content.decode('utf-8'))['choices'][0]['votes'], 1)
+		batch_url = reverse('polls:batch_poll_results')
+		response = self.client.get(batch_url, {'ids': '%d,%d,0' % (other.id, question.id)})
+		self.assertEqual([poll['id'] for poll in json.loads(response.content.decode('utf-8'))['polls']], [other.id, question.id])
+		self.assertEqual(self.client.get(batch_url, {'ids': '%d,%d' % (other.id, question.id)}, HTTP_IF_NONE_MATCH=response['ETag']) \
+			.status_code, 304)
+		self.assertEqual(self.client.get(batch_url, {'ids': 'x'}).status_code, 400)
+
+	def test_vote_page_polls_results_unless_live_results_are_on(self):
+		# Check that by default the vote page polls the poll's results and live results streams are not served, and that with
+		# POLLS_LIVE_RESULTS on the page follows the stream.
+		question = create_poll_and_return_question(self, sample_question_1)
+		attempt_login(self, login_creds)
+		vote_url, stream_url = reverse('polls:vote_poll', args=(question.id,)), reverse('polls:poll_results_stream', args=(question.id,))
+		response = self.client.get(vote_url)
+		self.assertContains(response, reverse('polls:poll_results', args=(question.id,)))
+		self.assertNotContains(response, stream_url)
+		self.assertEqual(self.client.get(stream_url).status_code, 404)
+		with self.settings(POLLS_LIVE_RESULTS=True):
+			self.assertContains(self.client.get(vote_url), stream_url)
+
+	@override_settings(POLLS_LIVE_RESULTS=True, POLLS_LIVE_INTERVAL_MS=0)
+	def test_live_results_stream(self):
+		# Check that the live results stream of a poll sends the poll's results when it opens and again after a vote, and ends with a
+		# 'removed' event when the poll is removed.
+		question = create_poll_and_return_question(self, sample_question_1)
+		url = reverse('polls:poll_results_stream', args=(question.id,))
+		self.assertEqual(self.client.get(url).status_code, 403)
+		attempt_login(self, login_creds)
+		response = self.client.get(url)
+		self.assertEqual(response['Content-Type'], 'text/event-stream')
+		events = iter(response.streaming_content)
+		self.assertTrue(next(events).startswith(b'retry:'))
+		event = next(events).decode('utf-8')
+		self.assertIn('event: results', event)
+		self.assertEqual(json.loads(event.split('data: ')[1])['total_votes'], 0)
+		record_vote(question, make_voters(1)[0], question.choice_set.get(choice_text='Good'))
+		event = next(events).decode('utf-8')
+		self.assertEqual(json.loads(event.split('data: ')[1])['choices'][0]['votes'], 1)
+		question.delete()
+		self.assertIn(b'event: removed', next(events))
+		response.close()
+
+	@override_settings(USERS_CACHE='default', SESSION_ENGINE='pollsite.sessions.cached_db')
+	def test_cache_warm_page_views_take_one_query(self):
+		# Check that once the session and users are cached, the owner's polls page and another member's polls page take one query, that a
+		# profile change shows up right away and that logging out ends the cached session.
+		another = User.objects.create_user('another', 'another@gmail.com', 'another')
+		attempt_login(self, login_creds)
+		own_page, other_page = reverse('polls:polls_page', args=(self.user.id,)), reverse('polls:polls_page', args=(another.id,))
+		self.client.get(own_page)
+		self.client.get(other_page)
+		with self.assertNumQueries(1):
+			self.assertContains(self.client.get(own_page), 'Create a new poll')
+		with self.assertNumQueries(1):
+			self.assertContains(self.client.get(other_page), "another's Polls")
+		another.username = 'renamed'
+		another.save()
+		self.assertContains(self.client.get(other_page), "renamed's Polls")
+		self.client.get(reverse('users:processing_logout'))
+		self.assertNotContains(self.client.get(own_page), 'Create a new poll')
+
+	def test_removed_polls_are_hidden_then_purged(self):
+		# Check that members can only remove their own polls, that a removed poll is hidden from the site right away while its rows are kept
+		# (and still dumped), and that purge_removed_polls then deletes its ballots, choices and question in batches without touching other
+		# polls.
+		question = create_poll_and_return_question(self, sample_question_1)
+		other = create_poll_and_return_question(self, sample_question_1)
+		voters = make_voters(5)
+		for user_id in voters:
+			record_vote(question, user_id, question.choice_set.get(choice_text='Good'))
+			record_vote(other, user_id, other.choice_set.get(choice_text='Bad'))
+		attempt_signup(self, another_signup_creds)
+		attempt_login(self, another_login_creds)
+		another = User.objects.get(username=another_signup_creds['username'])
+		self.assertEqual(self.client.get(reverse('polls:process_remove', args=(question.id, another.id))).status_code, 404)
+		self.assertTrue(Question.objects.filter(pk=question.id).exists())
+		attempt_login(self, login_creds)
+		with self.assertNumQueries(2): # hiding the poll and deleting its ranking
+			self.assertTrue(Question.objects.remove_poll(question.id, self.user))
+		self.assertFalse(Question.live.filter(pk=question.id).exists())
+		self.assertTrue(Question.objects.filter(pk=question.id).exists())
+		self.assertFalse(Question.objects.remove_poll(question.id, self.user))
+		output = StringIO()
+		call_command('dumpdata', 'polls.question', stdout=output)
+		self.assertEqual(sorted(poll['pk'] for poll in json.loads(output.getvalue())), [question.id, other.id])
+		self.assertNotIn(question, page_of_polls(self.user, None)[0])
+		self.assertEqual(self.client.get(reverse('polls:vote_poll', args=(question.id,))).status_code, 404)
+		self.assertEqual(Vote.objects.filter(question=question.id).count(), 5)
+		output = StringIO()
+		call_command('purge_removed_polls', batch_size=2, pause=0, stdout=output)
+		self.assertIn('Purged poll %d (10 rows).' % question.id, output.getvalue())
+		self.assertFalse(Question.objects.filter(pk=question.id).exists())
+		self.assertFalse(Vote.objects.filter(question=question.id).exists())
+		self.assertFalse(Choice.objects.filter(question=question.id).exists())
+		self.assertEqual(Vote.objects.filter(question=other.id).count(), 5)
+		self.assertEqual(get_poll_results(other.id)['total_votes'], 5)
+
+	def test_export_poll(self):
+		# Check that only the owner can export a poll, and that the CSV and JSONL exports list every ballot, read in chunks, followed by the
+		# per-choice totals, both from the view and from the export_poll command.
+		question = create_poll_and_return_question(self, sample_question_1)
+		good, bad = question.choice_set.get(choice_text='Good'), question.choice_set.get(choice_text='Bad')
+		voters = make_voters(5)
+		for user_id in voters:
+			record_vote(question, user_id, good if user_id != voters[-1] else bad)
+		url = reverse('polls:export_poll', args=(question.id, self.user.id))
+		check_nonmember_unauthorized(self, url)
+		check_member_unauthorized(self, url)
+		another = User.objects.get(username=another_signup_creds['username'])
+		self.assertEqual(self.client.get(reverse('polls:export_poll', args=(question.id, another.id))).status_code, 404)
+		attempt_login(self, login_creds)
+		response = self.client.get(url)
+		self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+		rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8').splitlines()))
+		self.assertEqual(rows[0], ['record', 'user_id', 'username', 'choice_id', 'choice', 'voted_at', 'votes'])
+		self.assertEqual([row[1] for row in rows[1:6]], [str(user_id) for user_id in voters])
+		self.assertEqual([(row[0], row[4], row[6]) for row in rows[6:]], [('total', 'Good', '4'), ('total', 'Okay', '0'), ('total', 'Bad', '1')])
+		self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 400)
+		output = StringIO()
+		with self.assertNumQueries(5): # the poll, its choices and three chunks of ballots
+			call_command('export_poll', str(question.id), format='jsonl', chunk_size=2, stdout=output)
+		records = [json.loads(line) for line in output.getvalue().splitlines()]
+		self.assertEqual([record['username'] for record in records[:5]], ['voter%d' % i for i in range(5)])
+		self.assertEqual([(record['choice'], record['votes']) for record in records[5:]], [('Good', 4), ('Okay', 0), ('Bad', 1)])
+
+	def test_leaderboard(self):
+		# Check that votes are ranked as they are counted, that the top polls are ordered by voters and the trending polls by time-decayed
+		# votes, that each list is one query, and that removed polls are unranked for good.
+		older = create_poll_and_return_question(self, sample_question_1)
+		newer = create_poll_and_return_question(self, sample_question_1)
+		voters = make_voters(3)
+		for user_id in voters:
+			record_vote(older, user_id, older.choice_set.get(choice_text='Good'))
+		record_vote(older, voters[0], older.choice_set.get(choice_text='Bad'))
+		self.assertEqual(PollRanking.objects.get(pk=older.id).total_votes, 3)
+		PollRanking.objects.filter(pk=older.id).update(trending=math.log(3) + vote_score(timezone.now() - timedelta(days=2)))
+		record_vote(newer, voters[0], newer.choice_set.get(choice_text='Good'))
+		with self.assertNumQueries(1):
+			self.assertEqual([ranking.question_id for ranking in top_polls()], [older.id, newer.id])
+		with self.assertNumQueries(1):
+			trending = trending_polls()
+		self.assertEqual([ranking.question_id for ranking in trending], [newer.id, older.id])
+		self.assertAlmostEqual(trending[0].recent_votes, 1, places=2)
+		self.assertAlmostEqual(trending[1].recent_votes, 3 / 256.0, places=4)
+		Question.objects.remove_poll(newer.id, self.user)
+		self.assertFalse(PollRanking.objects.filter(pk=newer.id).exists())
+		with transaction.atomic():
+			rank_votes({newer.id: 1})
+		self.assertFalse(PollRanking.objects.filter(pk=newer.id).exists())
+		response = self.client.get(reverse('polls:leaderboard'))
+		self.assertEqual([ranking.question_id for ranking in response.context['trending_polls']], [older.id])
+		self.assertContains(response, reverse('users:signup'))
+
+	def test_rankings_are_written_before_they_are_read(self):
+		# Check that adding voters to a ranking, existing or new, starts with a write, since SQLite fails a transaction that reads and then
+		# writes with "database is locked" at once instead of waiting for the lock.
+		question = create_poll_and_return_question(self, sample_question_1)
+		for counts in ({question.id: 1}, {question.id: 2}):
+			with transaction.atomic():
+				with CaptureQueriesContext(connection) as queries:
+					rank_votes(counts)
+			self.assertEqual(first_statement(queries), 'UPDATE')
+		ranking = PollRanking.objects.get(pk=question.id)
+		self.assertEqual(ranking.total_votes, 3)
+		self.assertAlmostEqual(recent_votes(ranking.trending), 3, places=2)
+
+	def test_vote_activity_is_written_before_it_is_read(self):
+		# Check that adding voters to a rollup, existing or new, starts with a write (see test_rankings_are_written_before_they_are_read).
+		question = create_poll_and_return_question(self, sample_question_1)
+		when = timezone.now()
+		for count in (1, 2):
+			with transaction.atomic():
+				with CaptureQueriesContext(connection) as queries:
+					record_activity({question.id: count}, when)
+			self.assertEqual(first_statement(queries), 'UPDATE')
+		self.assertIn((bucket_start(when, VoteActivity.MINUTE), 3),
+			activity_histogram(question.id, VoteActivity.MINUTE, when - timedelta(minutes=1), when + timedelta(minutes=1)))
+
+	def test_vote_activity(self):
+		# Check that new voters are counted into the poll's minute rollup, that old minutes are compacted into hours, and that a poll's
+		# activity histogram is read with one query, also from the activity view.
+		question = create_poll_and_return_question(self, sample_question_1)
+		voters = make_voters(3)
+		for user_id in voters:
+			record_vote(question, user_id, question.choice_set.get(choice_text='Good'))
+		record_vote(question, voters[0], question.choice_set.get(choice_text='Bad'))
+		now = timezone.now()
+		histogram = activity_histogram(question.id, VoteActivity.MINUTE, now - timedelta(minutes=5), now + timedelta(minutes=1))
+		self.assertEqual(sum(votes for start, votes in histogram), 3)
+		days_ago = hour_of(now) - timedelta(days=3)
+		with transaction.atomic():
+			record_activity({question.id: 2}, days_ago + timedelta(minutes=5))
+			record_activity({question.id: 4}, days_ago + timedelta(minutes=50))
+			record_activity({question.id: 1}, days_ago + timedelta(hours=1, minutes=1))
+		output = StringIO()
+		call_command('compact_vote_activity', pause=0, stdout=output)
+		self.assertIn('Compacted 2 minute rollups.', output.getvalue())
+		self.assertEqual(VoteActivity.objects.filter(resolution=VoteActivity.MINUTE).count(), 1)
+		with self.assertNumQueries(1):
+			histogram = activity_histogram(question.id, VoteActivity.HOUR, days_ago, days_ago + timedelta(hours=2))
+		self.assertEqual(histogram, [(days_ago, 6), (days_ago + timedelta(hours=1), 1)])
+		url = reverse('polls:poll_activity', args=(question.id,))
+		self.assertEqual(self.client.get(url).status_code, 403)
+		attempt_login(self, login_creds)
+		data = json.loads(self.client.get(url, {'resolution': 'hour', 'hours': '80'}).content.decode('utf-8'))
+		self.assertEqual((len(data['buckets']), data['total']), (80, 10))
+		self.assertEqual(self.client.get(url, {'resolution': 'second'}).status_code, 400)
+		self.assertEqual(self.client.get(url, {'hours': '100'}).status_code, 400)
+
+class BenchmarkViewsTests(TestCase):
+	# Tests of the benchmark_views command at a tiny scale. The command normally seeds a scratch database of its own; here it seeds this
+	# test's (empty) database instead, which is rolled back afterwards.
+	def setUp(self):
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		self.output = os.path.join(directory, 'results.json')
+		patcher = mock.patch('polls.management.commands.benchmark_views.scratch_database', self.current_database)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	@contextmanager
+	def current_database(self, on_disk=False):
+		yield
+
+	def benchmark(self, **options):
+		# Runs the command with OPTIONS at a tiny scale and returns its printed summary and its results file.
+		output = StringIO()
+		call_command('benchmark_views', stdout=output, users=3, polls_per_user=1, choices=2, ballots=3, requests=2, output=self.output,
+			**options)
+		with open(self.output) as results:
+			return output.getvalue(), json.load(results)
+
+	def test_every_view_is_measured(self):
+		summary, report = self.benchmark()
+		self.assertIn('Seeded 3 users, 3 polls and 3 ballots', summary)
+		self.assertEqual(len(report['views']), 8)
+		self.assertEqual(set(view['requests'] for view in report['views'].values()), set([2]))
+		self.assertEqual(sum(view['errors'] for view in report['views'].values()), 0)
+
+	def test_views_without_requests_are_reported_as_na(self):
+		# Without creating_poll there is no poll to remove, so process_remove is never requested.
+		summary, report = self.benchmark(views='polls_page,process_remove')
+		self.assertRegexpMatches(summary, r'process_remove +n/a')
+		self.assertEqual(list(report['views']), ['polls_page', 'process_remove'])
+		self.assertEqual(report['views']['process_remove']['requests'], 0)
+		self.assertIsNone(report['views']['process_remove']['p50_ms'])
+		with self.assertRaises(CommandError):
+			self.benchmark(views='polls_page,nothing')
+
+class BallotMigrationTests(TransactionTestCase):
+	def test_ballots_are_copied_in_chunks_sqlite_accepts(self):
+		# Check that migration 0008 copies more ballots than fit in one chunk into Votes, with no ID__IN list longer than SQLite's default
+		# limit of 999 variables per query.
+		executor = MigrationExecutor(connection)
+		self.addCleanup(lambda: MigrationExecutor(connection).migrate(executor.loader.graph.leaf_nodes()))
+		executor.migrate([('polls', '0007_vote')])
+		apps = executor.loader.project_state([('polls', '0007_vote')]).apps
+		User, Question, Choice = apps.get_model('auth', 'User'), apps.get_model('polls', 'Question'), apps.get_model('polls', 'Choice')
+		DictforQuestion, Keyvalue = apps.get_model('polls', 'DictforQuestion'), apps.get_model('polls', 'Keyvalue')
+		User.objects.bulk_create([User(username='voter%d' % i, password='') for i in range(1200)])
+		question = Question.objects.create(user=User.objects.get(username='voter0'), text='How are you?', date_published=timezone.now())
+		choice = Choice.objects.create(question=question, choice_text='Good')
+		DictforQuestion.objects.create(question=question)
+		Keyvalue.objects.bulk_create([Keyvalue(dictionary_id=question.id, key=user_id, value=choice.id) \
+			for user_id in User.objects.values_list('id', flat=True)])
+		executor = MigrationExecutor(connection)
+		with CaptureQueriesContext(connection) as queries:
+			executor.migrate([('polls', '0008_copy_keyvalue_ballots')])
+		self.assertEqual(apps.get_model('polls', 'Vote').objects.count(), 1200)
+		in_lists = [match.count(',') + 1 for query in queries for match in re.findall(r' IN \(([^)]*)\)', query['sql'])]
+		self.assertGreater(len(in_lists), 2)
+		self.assertLessEqual(max(in_lists), 999)
+
+class VoteConcurrencyTests(TransactionTestCase):
+	# Stress test for RECORD_VOTE: many threads vote on one Question at once, every voter submits twice at the same moment, and the
+	# counters must still match the ballots exactly.
+	voters = 1000
+	threads = 8
 
+	def test_concurrent_votes_are_not_lost(self):
+		owner = make_user(True)
+		question = create_poll_and_return_question(self, sample_question_1, owner)
+		choices = list(question.choice_set.all())
+		voters = make_voters(self.voters)
+		start = threading.Barrier(self.threads)
+		failures = []
+		def cast_votes(offset):
+			# Each voter is handled by two threads, so every ballot is submitted twice concurrently. SQLite reports write contention as
+			# OperationalError ("database is locked"), which a client would answer by resubmitting, so the vote is retried.
+			try:
+				start.wait()
+				for i in range(offset % (self.threads // 2), self.voters, self.threads // 2):
+					while True:
+						try:
+							record_vote(question, voters[i], choices[i % len(choices)])
+							break
+						except OperationalError:
+							time.sleep(0.001)
+			except Exception as error:
+				failures.append(error)
+			finally:
+				connection.close()
+		workers = [threading.Thread(target=cast_votes, args=(i,)) for i in range(self.threads)]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+		self.assertEqual(failures, [])
+		ballots = Vote.objects.filter(question=question).count()
+		self.assertEqual(ballots, self.voters)
+		self.assertEqual(Question.objects.get(pk=question.id).total_votes, ballots)
+		self.assertEqual(question.choice_set.aggregate(total=Sum('votes'))['total'], ballots)
 
+	@override_settings(POLLSITE_SQLITE_PRODUCTION=True)
+	def test_serialized_writes_see_no_lock_errors(self):
+		# Check that in production SQLite mode concurrent votes go through the single writer thread and never fail with a lock error.
+		owner = make_user(True)
+		question = create_poll_and_return_question(self, sample_question_1, owner)
+		choices = list(question.choice_set.all())
+		voters = make_voters(200)
+		start = threading.Barrier(self.threads)
+		failures, writer_threads = [], set()
+		def vote(user_id, choice):
+			writer_threads.add(threading.current_thread().name)
+			return record_vote(question, user_id, choice)
+		def cast_votes(offset):
+			try:
+				start.wait()
+				for i in range(offset, len(voters), self.threads):
+					serialized_write(vote, voters[i], choices[i % len(choices)])
+			except Exception as error:
+				failures.append(error)
+			finally:
+				connection.close()
+		workers = [threading.Thread(target=cast_votes, args=(i,)) for i in range(self.threads)]
+		try:
+			for worker in workers:
+				worker.start()
+			for worker in workers:
+				worker.join()
+		finally:
+			stop_serialized_writer()
+		self.assertEqual(failures, [])
+		self.assertEqual(writer_threads, set(['pollsite-writer']))
+		self.assertEqual(Question.objects.get(pk=question.id).total_votes, len(voters))
 
+	@override_settings(POLLSITE_SQLITE_PRODUCTION=True, POLLS_VOTE_WRITE_BEHIND=True, POLLS_VOTE_FLUSH_INTERVAL_MS=50)
+	def test_timer_flushes_write_on_the_writer_thread(self):
+		# Check that in production SQLite mode the counter changes of buffered votes are written by the writer thread when the flush timer
+		# fires, rather than by the timer's own thread.
+		owner = make_user(True)
+		question = create_poll_and_return_question(self, sample_question_1, owner)
+		flushed = threading.Event()
+		flush_threads = []
+		def record_flush(sender, question_ids, **kwargs):
+			flush_threads.append(threading.current_thread().name)
+			flushed.set()
+		results_changed.connect(record_flush)
+		self.addCleanup(results_changed.disconnect, record_flush)
+		self.addCleanup(stop_serialized_writer)
+		record_vote(question, make_voters(1)[0], question.choice_set.get(choice_text='Good'))
+		self.assertTrue(flushed.wait(5))
+		self.assertEqual(flush_threads, ['pollsite-writer'])
+		self.assertEqual(Question.objects.get(pk=question.id).total_votes, 1)
@@ -6,6 +6,12 @@ urlpatterns = patterns('',
 	url(r'^(?P<user_id>\d+)/make_poll/$', views.make_poll, name='make_poll'),
 	url(r'^(?P<user_id>\d+)/creating_poll/$', views.creating_poll, name='creating_poll'),
 	url(r'^(?P<question_id>\d+)/(?P<user_id>\d+)/process_remove/$', views.process_remove, name='process_remove'),
+	url(r'^(?P<question_id>\d+)/(?P<user_id>\d+)/export/$', views.export_poll, name='export_poll'),
 	url(r'^(?P<question_id>\d+)/vote_poll/$', views.vote_poll, name='vote_poll'),
 	url(r'^(?P<question_id>\d+)/processing_vote/$', views.processing_vote, name='processing_vote'),
+	url(r'^(?P<question_id>\d+)/results/$', views.poll_results, name='poll_results'),
+	url(r'^(?P<question_id>\d+)/results/stream/$', views.poll_results_stream, name='poll_results_stream'),
+	url(r'^(?P<question_id>\d+)/activity/$', views.poll_activity, name='poll_activity'),
+	url(r'^results/$', views.batch_poll_results, name='batch_poll_results'),
+	url(r'^leaderboard/$', views.leaderboard, name='leaderboard'),
 )
@@ -1,19 +1,36 @@
 from django.shortcuts import get_object_or_404, render
-from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotModified
 from django.core.urlresolvers import reverse
 from django.contrib import messages
-from polls.models import Question, Choice, DictforQuestion, Keyvalue
+from polls.models import Question, Choice, VoteActivity
+from polls.votes import record_vote, ballot_of
+from polls.results import get_poll_results, get_many_poll_results, add_results_totals
+from polls.pagination import page_of_polls, decode_cursor
+from polls.page_cache import page_cache_enabled, get_cached_page, cache_page
+from polls.live import results_events
+from polls.export import FORMATS, CONTENT_TYPES, export_lines
+from polls.ranking import top_polls, trending_polls
+from polls.activity import activity_histogram, bucket_start, STEPS
+from users.user_cache import get_user_or_404
+from pollsite.db import serialized_write
+from pollsite.routers import pin_to_primary
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+from django.conf import settings
+from datetime import timedelta
+import hashlib
+import json
 
 #Views for the POLLS app for Pollsite.
 
 def verify_authenticated(request, user_id):
 	# Helper function for the following views. It makes sure that the current session's user matches the user to which the desired page belongs.
 	# This way, users are unable to make/remove polls for other users. If the users don't match, the view redirects either to Pollsite's front INDEX
-	# page (if the current session viewer is not signed up) or to the current session user's polls page with a warning.
-	desired_user = get_object_or_404(User, pk=user_id)
+	# page (if the current session viewer is not signed up) or to the current session user's polls page with a warning. The page's user is the
+	# session's user or comes from the user cache (see USERS app's user_cache module), so the check costs no query once cached.
+	desired_user = get_user_or_404(request, user_id)
 	if request.user != desired_user:
 		messages.add_message(request, messages.INFO, 'You are not authorized to view this page.')
 		if not request.user.is_authenticated():
@@ -23,15 +40,32 @@ def verify_authenticated(request, user_id):
 
 def polls_page(request, user_id):
 	# View for the polls page of the user with USER_ID(in the URL). It sets the proper permissions (explained in POLLS_PAGE template) for the
-	# session user. It also orders the polls of the polls page owner by publication date.
-	desired_user = get_object_or_404(User, pk=user_id)
+	# session user. It also lists one page of the polls page owner's polls, newest first, starting after the CURSOR given in the query string
+	# (see POLLS app's pagination module), with their vote totals taken from their cached results, which include any sharded vote counters. The
+	# number of queries is the same for every page, however many polls the owner has. Anonymous viewers are served from a page cache (see POLLS
+	# app's page_cache module) that is invalidated whenever the owner's polls change; pages that get cached are read from the primary database
+	# rather than a replica.
+	cursor = request.GET.get('cursor')
+	position = decode_cursor(cursor)
+	use_page_cache = page_cache_enabled(request)
+	if use_page_cache:
+		content = get_cached_page(int(user_id), position)
+		if content is not None:
+			return HttpResponse(content)
+		pin_to_primary()
+	desired_user = get_user_or_404(request, user_id)
 	can_create, can_vote = True, True
 	if request.user != desired_user:
 		can_create = False
 		if not request.user.is_authenticated():
 			can_vote = False
-	questions_list = desired_user.question_set.order_by('-date_published')
-	return render(request, 'polls/polls_page.html', {'can_create': can_create, 'can_vote': can_vote, 'user': desired_user, 'questions_list': questions_list})
+	questions_list, next_cursor, follows_poll = page_of_polls(desired_user, cursor)
+	add_results_totals(questions_list)
+	response = render(request, 'polls/polls_page.html', {'can_create': can_create, 'can_vote': can_vote, 'user': desired_user, 'questions_list': questions_list,
+		'is_first_page': position is None, 'next_cursor': next_cursor})
+	if use_page_cache and follows_poll:
+		cache_page(int(user_id), position, response.content)
+	return response
 
 def make_poll(request, user_id):
 	# View for the poll creation page of Pollsite.
@@ -42,87 +76,181 @@ def make_poll(request, user_id):
 
 def creating_poll(request, user_id):
 	# View that processes user input from the MAKE_POLL page. It first makes sure that all fields have been filled by the user and redirects
-	# the user back to MAKE_POLL with an error message if this is not the case. Otherwise, it creates a Question object with a Choice set of
-	# choices set by the user. It also creates a DictforQuestion object for that question (to eventually store a history of users who have
-	# already voted for the question/poll). Finally, it redirects the user to his/her polls page, which should show the new poll.
+	# the user back to MAKE_POLL with an error message if this is not the case, before anything is written. Otherwise, it creates a Question
+	# object with a Choice set of choices set by the user in one transaction (see the Question model's manager). Finally, it redirects the
+	# user to his/her polls page, which should show the new poll.
 	try:
 		return verify_authenticated(request, user_id)
 	except Exception:
-		question_text = request.POST['question']
-		if not question_text:
+		question_text = request.POST.get('question', '')
+		try:
+			num_choices = int(request.POST['selection'])
+		except (KeyError, ValueError):
+			num_choices = 0
+		choice_texts = [request.POST.get('choice' + str(i+1), '') for i in range(num_choices)]
+		if not Question.objects.is_complete_poll(question_text, choice_texts):
 			error_message = 'You forgot to fill in some fields.'
 			return render(request, 'polls/make_poll.html', {'user': request.user, 'error_message': error_message})
-		num_choices = request.POST['selection']
-		question = request.user.question_set.create(text=question_text, date_published=timezone.now(), total_votes=0)
-		for i in range(int(num_choices)):
-			text = request.POST['choice' + str(i+1)]
-			if not text:
-				question.delete()
-				error_message = 'You forgot to fill in some fields.'
-				return render(request, 'polls/make_poll.html', {'user': request.user, 'error_message': error_message})
-			question.choice_set.create(choice_text=request.POST['choice' + str(i+1)], votes=0)
-		dictionary = DictforQuestion(question=question)
-		dictionary.save()
+		serialized_write(Question.objects.create_poll, request.user, question_text, choice_texts)
 		return HttpResponseRedirect(reverse('polls:polls_page', args=(request.user.id,)))
 
 def process_remove(request, question_id, user_id):
-	# View that processes the user's request to remove a poll corresponding to QUESTION_ID and belonging to USER_ID. It deletes the poll 
-	# or question and then returns to the current session user's polls page AFTER calling VERIFY_AUTHENTICATED.
+	# View that processes the user's request to remove a poll corresponding to QUESTION_ID and belonging to USER_ID. AFTER calling
+	# VERIFY_AUTHENTICATED, it removes the poll if it belongs to the current session user (and 404s otherwise) and then returns to the user's
+	# polls page. Removal hides the poll right away with one UPDATE; its ballots and choices are purged later in batches (see the Question
+	# model's manager).
 	try:
 		return verify_authenticated(request, user_id)
 	except Exception:
-		question = get_object_or_404(Question, pk=question_id)
-		question.delete()
+		if not serialized_write(Question.objects.remove_poll, question_id, request.user):
+			raise Http404
 		return HttpResponseRedirect(reverse('polls:polls_page', args=(request.user.id,)))
 
+def export_poll(request, question_id, user_id):
+	# View that streams the raw results of the poll with QUESTION_ID, belonging to USER_ID, to its owner AFTER calling VERIFY_AUTHENTICATED:
+	# every ballot and the per-choice totals, as CSV or as JSON Lines depending on the FORMAT parameter of the query string (see POLLS app's
+	# export module). The export is written out while the ballots are read, so it takes the same memory for a poll of any size.
+	try:
+		return verify_authenticated(request, user_id)
+	except Exception:
+		question = get_object_or_404(Question.live, pk=question_id, user=request.user)
+		format = request.GET.get('format', 'csv')
+		if format not in FORMATS:
+			return HttpResponseBadRequest('format must be one of %s.' % ', '.join(FORMATS))
+		response = StreamingHttpResponse(export_lines(question, format), content_type=CONTENT_TYPES[format])
+		response['Content-Disposition'] = 'attachment; filename="poll-%d.%s"' % (question.id, format)
+		return response
+
 def vote_poll(request, question_id):
-	# View for the VOTE_POLL page (not for viewers who are not Pollsite users). The view finds the DictforQuestion (see POLLS app's models)
-	# corresponding to the Question with QUESTION_ID(in the URL) and checks to see whether the current session user is in the keys of the
-	# DictforQuestion's Keyvalue set(i.e. whether or not the user has voted on the Question before). If so, it sets SELECTED_CHOICE_ID to
-	# the id of the user's most recent CHOICE in the poll. Otherwise, SELECTED_CHOICE_ID is set to None. Read more about SELECTED_CHOICE_ID's
-	# purpose in the VOTE_POLL template.
+	# View for the VOTE_POLL page (not for viewers who are not Pollsite users). The view looks up the current session user's Vote (see POLLS
+	# app's models) in the Question with QUESTION_ID(in the URL), i.e. whether or not the user has voted on the Question before, which is a
+	# single query answered from an index. If the user has voted, it sets SELECTED_CHOICE_ID to the id of the user's most recent CHOICE in
+	# the poll. Otherwise, SELECTED_CHOICE_ID is set to None. Read more about SELECTED_CHOICE_ID's purpose in the VOTE_POLL template. The
+	# question, choices and vote counts come from the poll's cached results (see POLLS app's results module), which take no queries once cached.
 	if not request.user.is_authenticated():
 		messages.add_message(request, messages.INFO, 'You are not authorized to view this page.')
 		return HttpResponseRedirect(reverse('users:index'))
-	question = get_object_or_404(Question, pk=question_id)
-	try:
-		selected_choice_id = DictforQuestion.objects.get(question=question).keyvalue_set.get(key=request.user.id).value
-	except Keyvalue.DoesNotExist:
-		selected_choice_id = None
-	return render(request, 'polls/vote_poll.html', {'question': question, 'selected_choice_id': selected_choice_id})
+	results = get_poll_results(question_id)
+	return render_vote_poll(request, results, ballot_of(results['id'], request.user.id))
+
+def render_vote_poll(request, results, selected_choice_id, error_message=None):
+	# Helper function that renders the VOTE_POLL template for a poll's RESULTS (see POLLS app's results module). The template reads the
+	# results as QUESTION and their choices, already including any sharded vote counters, as CHOICES. LIVE_RESULTS tells the page whether to
+	# follow the poll's live results stream or to poll its POLL_RESULTS every RESULTS_POLL_INTERVAL_MS milliseconds.
+	context = {'question': results, 'choices': results['choices'], 'selected_choice_id': selected_choice_id,
+		'live_results': getattr(settings, 'POLLS_LIVE_RESULTS', False),
+		'results_poll_interval_ms': max(getattr(settings, 'POLLS_RESULTS_POLL_INTERVAL_MS', 10000), 1000)}
+	if error_message:
+		context['error_message'] = error_message
+	return render(request, 'polls/vote_poll.html', context)
 
 def processing_vote(request, question_id):
 	# View that processes a user's vote input for a poll corresponding to QUESTION_ID(in the URL). This is not available for unregistered
 	# users. The view first checks that a Choice of the poll was selected; it otherwise redirects the user to VOTE_POLL with an error message.
 	# If the user has not previously voted in the poll, the view increments both the poll/question's total votes and the SELECTED_CHOICE's votes 
-	# by 1 and stores the user with his/her inpt as a Keyvalue object in the poll's DictforQuestion. If the user HAS previously voted, the view
-	# decrements the user's previous Choice by 1, increments his/her new Choice by 1, and updates the Keyvalue corresponding to the user with
-	# the id of his/her new choice. Note that in this case, the poll/question's total votes stays the same. The view finally redirects the user
-	# back to his/her own polls page with a success message verifying his/her submission.
+	# by 1 and stores the user with his/her input as a Vote. If the user HAS previously voted, the view decrements the user's previous Choice
+	# by 1, increments his/her new Choice by 1, and points the user's Vote to his/her new choice. Note that in this case, the poll/question's
+	# total votes stays the same. Whether the user has voted is answered by one indexed lookup of the user's Vote rather than by loading every
+	# ballot of the poll, and the ballot and counters are written atomically by RECORD_VOTE (see POLLS app's votes module), through the
+	# site's serialized writer in production SQLite mode (see pollsite/db.py). The view finally redirects the user back to his/her own polls
+	# page with a success message verifying his/her submission.
 	if not request.user.is_authenticated():
 		messages.add_message(request, messages.INFO, 'You are not authorized to view this page.')
 		return HttpResponseRedirect(reverse('users:index'))
-	question = get_object_or_404(Question, pk=question_id)
+	question = get_object_or_404(Question.live, pk=question_id)
 	try:
 		selected_choice = question.choice_set.get(pk=request.POST['choice'])
 	except (KeyError, Choice.DoesNotExist):
-		return render(request, 'polls/vote_poll.html', {'question': question, 'selected_choice_id': None, 'error_message': "You did not select an available choice."})
-	keyvalues = DictforQuestion.objects.get(question=question).keyvalue_set
-	if request.user.id not in [keyvalue.key for keyvalue in keyvalues.all()]:
-		question.total_votes += 1
-		question.save()
-		selected_choice.votes += 1
-		selected_choice.save()
-		keyvalues.create(key=request.user.id, value=selected_choice.id)
-	else:
-		target = keyvalues.get(key=request.user.id)
-		previous_choice = question.choice_set.get(pk=target.value)
-		if previous_choice != selected_choice:
-			previous_choice.votes -= 1
-			previous_choice.save()
-			selected_choice.votes += 1
-			selected_choice.save()
-		target.value = selected_choice.id
-		target.save()
+		return render_vote_poll(request, get_poll_results(question.id), None, "You did not select an available choice.")
+	serialized_write(record_vote, question, request.user.id, selected_choice)
 	messages.add_message(request, messages.SUCCESS, 'Thanks! Your response has been recorded.')
 	return HttpResponseRedirect(reverse('polls:polls_page', args=(request.user.id,)))
+
+def leaderboard(request):
+	# View for the site-wide LEADERBOARD page: the polls with the most voters and the polls trending now (most votes lately), across all
+	# users. Each list is one indexed read of the polls' precomputed rankings (see POLLS app's ranking module).
+	return render(request, 'polls/leaderboard.html', {'top_polls': top_polls(), 'trending_polls': trending_polls(),
+		'can_vote': request.user.is_authenticated()})
+
+def poll_results(request, question_id):
+	# Read-only JSON view of the results of the poll with QUESTION_ID(in the URL) for Pollsite users: the question's id, text, total votes and
+	# choices with their vote counts, as in the poll's cached results (see POLLS app's results module). The response carries a strong ETag
+	# made from the results' VERSION, so clients that poll it can send If-None-Match and get an empty 304 while nobody votes; a 304 for
+	# cached results reads no poll rows at all.
+	if not request.user.is_authenticated():
+		return HttpResponseForbidden()
+	results = get_poll_results(question_id)
+	return json_response(request, results_json(results), results['version'])
+
+def batch_poll_results(request):
+	# Read-only JSON view of the results of many polls at once, for Pollsite users. The comma-separated poll ids come in the IDS parameter of
+	# the query string (at most POLLS_RESULTS_BATCH_LIMIT of them), and the response lists the results of the polls that exist under POLLS, in
+	# the order of IDS. Its ETag combines the VERSIONs of the listed results.
+	if not request.user.is_authenticated():
+		return HttpResponseForbidden()
+	try:
+		question_ids = [int(question_id) for question_id in request.GET.get('ids', '').split(',') if question_id.strip()]
+	except ValueError:
+		return HttpResponseBadRequest('ids must be a comma-separated list of poll ids.')
+	if len(question_ids) > getattr(settings, 'POLLS_RESULTS_BATCH_LIMIT', 100):
+		return HttpResponseBadRequest('Too many poll ids.')
+	results = get_many_poll_results(question_ids)
+	polls = [results[question_id] for question_id in sorted(set(question_ids), key=question_ids.index) if question_id in results]
+	version = hashlib.sha1(' '.join('%d:%s' % (poll['id'], poll['version']) for poll in polls).encode('utf-8')).hexdigest()
+	return json_response(request, {'polls': [results_json(poll) for poll in polls]}, version)
+
+def poll_activity(request, question_id):
+	# Read-only JSON view of the vote activity of the poll with QUESTION_ID(in the URL) for Pollsite users: its new voters per minute or per
+	# hour (the RESOLUTION parameter of the query string) over the last HOURS hours, up to the current minute or hour, read with one query
+	# from the poll's rollups (see POLLS app's activity module). At most POLLS_ACTIVITY_MAX_BUCKETS buckets are returned.
+	if not request.user.is_authenticated():
+		return HttpResponseForbidden()
+	resolution = {'minute': VoteActivity.MINUTE, 'hour': VoteActivity.HOUR}.get(request.GET.get('resolution', 'minute'))
+	try:
+		hours = int(request.GET.get('hours', 1 if resolution == VoteActivity.MINUTE else 24))
+	except ValueError:
+		hours = 0
+	if resolution is None or hours < 1:
+		return HttpResponseBadRequest('resolution must be minute or hour, and hours a positive number.')
+	step = STEPS[resolution]
+	if hours * 3600 // int(step.total_seconds()) > getattr(settings, 'POLLS_ACTIVITY_MAX_BUCKETS', 1440):
+		return HttpResponseBadRequest('Too many buckets.')
+	question_id = get_poll_results(question_id)['id']
+	end = bucket_start(timezone.now(), resolution) + step
+	histogram = activity_histogram(question_id, resolution, end - timedelta(hours=hours), end)
+	return HttpResponse(json.dumps({'id': question_id, 'resolution': request.GET.get('resolution', 'minute'),
+		'buckets': [[start.isoformat(), votes] for start, votes in histogram], 'total': sum(votes for start, votes in histogram)}),
+		content_type='application/json')
+
+def poll_results_stream(request, question_id):
+	# Server-Sent Events view that pushes the results of the poll with QUESTION_ID(in the URL) to the VOTE_POLL page of Pollsite users as they
+	# change, in the same JSON form as POLL_RESULTS (see POLLS app's live module). Each open stream holds one worker thread, so streams are only
+	# served when POLLS_LIVE_RESULTS is on (with workers to spare for them); otherwise the view 404s.
+	if not getattr(settings, 'POLLS_LIVE_RESULTS', False):
+		raise Http404
+	if not request.user.is_authenticated():
+		return HttpResponseForbidden()
+	question_id = get_poll_results(question_id)['id']
+	response = StreamingHttpResponse(results_events(question_id, request.META.get('HTTP_LAST_EVENT_ID'), results_json),
+		content_type='text/event-stream')
+	response['Cache-Control'] = 'no-cache'
+	response['X-Accel-Buffering'] = 'no'
+	return response
+
+def results_json(results):
+	# Helper function that returns the fields of a poll's RESULTS that the JSON views expose.
+	return {'id': results['id'], 'text': results['text'], 'total_votes': results['total_votes'], 'version': results['version'],
+		'choices': results['choices']}
+
+def json_response(request, data, version):
+	# Helper function for the JSON views. It answers with an empty 304 if REQUEST's If-None-Match matches the strong ETag of VERSION, and
+	# with DATA as JSON otherwise. Either way clients are told to revalidate before reusing a response.
+	etag = quote_etag(version)
+	if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+	if if_none_match and (if_none_match.strip() == '*' or version in parse_etags(if_none_match)):
+		response = HttpResponseNotModified()
+	else:
+		response = HttpResponse(json.dumps(data), content_type='application/json')
+	response['ETag'] = etag
+	patch_cache_control(response, private=True, no_cache=True)
+	return response
@@ -0,0 +1,186 @@
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from polls.models import Question, Choice, ChoiceShard, Vote
+from polls.signals import results_changed
+from polls.ranking import rank_votes
+from polls.activity import record_activity
+from pollsite.db import serialized_write
+from collections import defaultdict
+import atexit
+import random
+import threading
+
+# Vote recording for the POLLS app. Every vote goes through RECORD_VOTE so that the ballot (Vote) and the vote counters of a poll
+# (Question.total_votes and Choice.votes) always change together. With POLLS_VOTE_WRITE_BEHIND enabled, ballots are still written right
+# away but the counter changes are collected in a VoteBuffer and written in batches. With POLLS_COUNTER_SHARDS above 1, counter changes go
+# to randomly picked ChoiceShard rows instead of the Choice and Question rows, and the poll results (see POLLS app's results module) fold the
+# shards back into the counts that are read.
+
+def record_vote(question, user_id, choice):
+	# Records the vote of the user with USER_ID for CHOICE in QUESTION and returns the id of the Choice the user voted for before (None for
+	# a new voter). The ballot and the counters are written in one transaction, and the counters are incremented by the database with F()
+	# expressions rather than read into Python, incremented and saved, so concurrent votes cannot overwrite each other's increments. In
+	# write-behind mode the counter changes are handed to the VoteBuffer once the ballot is committed. Receivers of RESULTS_CHANGED (see POLLS
+	# app's signals module) are notified once the new counts are in the database.
+	with transaction.atomic():
+		previous_choice_id, deltas = write_ballot(question, user_id, choice)
+		if deltas and not getattr(settings, 'POLLS_VOTE_WRITE_BEHIND', False):
+			apply_counter_deltas(*deltas)
+	if deltas:
+		if getattr(settings, 'POLLS_VOTE_WRITE_BEHIND', False):
+			get_vote_buffer().add(*deltas)
+		else:
+			results_changed.send(sender=Question, question_ids=[question.id])
+	return previous_choice_id
+
+def write_ballot(question, user_id, choice):
+	# Writes the ballot of the user with USER_ID for CHOICE in QUESTION and returns the id of the Choice the user voted for before together
+	# with the counter changes the vote calls for, as (question deltas, choice deltas) for APPLY_COUNTER_DELTAS, or None if nothing changed.
+	# Must be called inside a transaction. If another request by the same user inserts a ballot first, the unique (question, user) index
+	# rejects this insert and the vote is retried as a change of choice, so a voter is never counted twice. A change of choice only moves a
+	# vote between Choices if the ballot still holds the choice that was read, which keeps two simultaneous changes from decrementing the
+	# same Choice twice. Both a new ballot and a change of choice set VOTED_AT, which marks the poll for incremental reconciliation.
+	while True:
+		try:
+			ballot = Vote.objects.select_for_update().get(question_id=question.id, user_id=user_id)
+		except Vote.DoesNotExist:
+			try:
+				with transaction.atomic():
+					Vote.objects.create(question_id=question.id, user_id=user_id, choice_id=choice.id)
+			except IntegrityError:
+				continue
+			return None, ({question.id: 1}, {choice.id: 1})
+		previous_choice_id = ballot.choice_id
+		if previous_choice_id == choice.id:
+			return previous_choice_id, None
+		if Vote.objects.filter(pk=ballot.pk, choice=previous_choice_id).update(choice=choice.id, voted_at=timezone.now()):
+			return previous_choice_id, ({question.id: 0}, {previous_choice_id: -1, choice.id: 1})
+
+def ballot_of(question_id, user_id):
+	# Returns the id of the Choice the user with USER_ID voted for in the Question with QUESTION_ID, or None if the user has not voted there.
+	# The query is answered from the (question, user, choice) index of Vote.
+	choice_ids = list(Vote.objects.filter(question=question_id, user=user_id).values_list('choice', flat=True)[:1])
+	return choice_ids[0] if choice_ids else None
+
+def apply_counter_deltas(question_deltas, choice_deltas):
+	# Writes summed counter changes with one F() UPDATE per changed row, all in one transaction. Rows are updated in id order so that two
+	# concurrent flushes lock them in the same order. With sharded counters only the choice changes are written, each to a random shard of
+	# its Choice: a Question's total always changes by the sum of its Choices' changes, so the shards of its Choices already carry it, and
+	# Question.total_votes is left behind (only the poll's results, see POLLS app's results module, have the full total). New
+	# voters are also added to the polls' leaderboard rankings and vote activity (see POLLS app's ranking and activity modules).
+	shards = counter_shards()
+	with transaction.atomic():
+		rank_votes(question_deltas)
+		record_activity(question_deltas)
+		if shards == 1:
+			for question_id in sorted(question_deltas):
+				if question_deltas[question_id]:
+					Question.live.filter(pk=question_id).update(total_votes=F('total_votes') + question_deltas[question_id])
+		for choice_id in sorted(choice_deltas):
+			if not choice_deltas[choice_id]:
+				continue
+			if shards == 1:
+				Choice.objects.filter(pk=choice_id).update(votes=F('votes') + choice_deltas[choice_id])
+			else:
+				add_to_shard(choice_id, random.randrange(shards), choice_deltas[choice_id])
+
+def counter_shards():
+	# Returns the number of counter shards per Choice (POLLS_COUNTER_SHARDS); 1 means the counters are kept on the Choice and Question rows.
+	return max(getattr(settings, 'POLLS_COUNTER_SHARDS', 1), 1)
+
+def add_to_shard(choice_id, index, delta):
+	# Adds DELTA to shard INDEX of the Choice with CHOICE_ID. Shard rows are created the first time they are picked; if another vote creates
+	# the same shard concurrently, the unique (choice, index) index rejects the second insert and the update is retried.
+	while not ChoiceShard.objects.filter(choice_id=choice_id, index=index).update(votes=F('votes') + delta):
+		try:
+			with transaction.atomic():
+				ChoiceShard.objects.create(choice_id=choice_id, index=index, votes=delta)
+			return
+		except IntegrityError:
+			continue
+
+class VoteBuffer(object):
+	# In-process write-behind buffer for vote counters. Committed votes add their counter changes to the buffer, and the summed changes are written by
+	# APPLY_COUNTER_DELTAS in a single transaction once MAX_VOTES votes are pending or INTERVAL seconds after the first pending vote,
+	# whichever comes first. A hot poll then costs one UPDATE per changed row per flush instead of two or three UPDATEs per vote.
+	def __init__(self, interval, max_votes):
+		self.interval = interval
+		self.max_votes = max_votes
+		self.lock = threading.Lock()
+		self.flush_lock = threading.Lock()
+		self.question_deltas = defaultdict(int)
+		self.choice_deltas = defaultdict(int)
+		self.pending = 0
+		self.timer = None
+
+	def add(self, question_deltas, choice_deltas):
+		with self.lock:
+			self._merge(question_deltas, choice_deltas, 1)
+			full = self.pending >= self.max_votes
+			if not full and self.timer is None:
+				self.timer = threading.Timer(self.interval, self._flush_on_timer)
+				self.timer.daemon = True
+				self.timer.start()
+		if full:
+			self.flush()
+
+	def flush(self):
+		# Writes all pending counter changes. If the write fails, the changes are put back into the buffer so that they are retried by the
+		# next flush instead of being lost.
+		with self.flush_lock:
+			with self.lock:
+				question_deltas, choice_deltas, pending = self.question_deltas, self.choice_deltas, self.pending
+				self.question_deltas, self.choice_deltas, self.pending = defaultdict(int), defaultdict(int), 0
+				if self.timer is not None:
+					self.timer.cancel()
+					self.timer = None
+			if not pending:
+				return
+			try:
+				apply_counter_deltas(question_deltas, choice_deltas)
+			except Exception:
+				with self.lock:
+					self._merge(question_deltas, choice_deltas, pending)
+				raise
+			results_changed.send(sender=Question, question_ids=sorted(question_deltas))
+
+	def _merge(self, question_deltas, choice_deltas, votes):
+		for question_id, delta in question_deltas.items():
+			self.question_deltas[question_id] += delta
+		for choice_id, delta in choice_deltas.items():
+			self.choice_deltas[choice_id] += delta
+		self.pending += votes
+
+	def _flush_on_timer(self):
+		# The timer runs on its own thread. Its flush is a write like any vote's, so in production SQLite mode it goes to the writer thread
+		# (see pollsite/db.py); otherwise the timer's thread opens its own database connection, which is closed again once the flush is done.
+		try:
+			serialized_write(self.flush)
+		finally:
+			connection.close()
+
+vote_buffer = None
+vote_buffer_lock = threading.Lock()
+
+def get_vote_buffer():
+	# Returns the process's VoteBuffer, creating it from the POLLS_VOTE_FLUSH_INTERVAL_MS and POLLS_VOTE_FLUSH_MAX_VOTES settings on first use.
+	# If those settings have changed since, the old buffer is flushed and replaced.
+	global vote_buffer
+	interval = getattr(settings, 'POLLS_VOTE_FLUSH_INTERVAL_MS', 500) / 1000.0
+	max_votes = getattr(settings, 'POLLS_VOTE_FLUSH_MAX_VOTES', 100)
+	with vote_buffer_lock:
+		if vote_buffer is None or (vote_buffer.interval, vote_buffer.max_votes) != (interval, max_votes):
+			if vote_buffer is not None:
+				vote_buffer.flush()
+			vote_buffer = VoteBuffer(interval, max_votes)
+		return vote_buffer
+
+def flush_vote_buffer():
+	# Writes any counter changes still pending in the process's VoteBuffer. Registered with atexit so that buffered votes are counted when
+	# the process shuts down.
+	if vote_buffer is not None:
+		vote_buffer.flush()
+
+atexit.register(flush_vote_buffer)
@@ -0,0 +1,96 @@
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from collections import OrderedDict
+import pickle
+import threading
+import time
+
+# Bounded, least-recently-used local-memory cache backend for Pollsite. Django's own local-memory backend culls a fraction of arbitrary
+# entries when it fills up; this one evicts the entries that were used least recently, one at a time, so hot entries (like the results
+# of a popular poll) stay cached. Entries are kept per process and pickled like in Django's local-memory backend, so callers can never
+# change a cached value by mutating what they got back.
+
+# Stores and locks shared by all instances with the same name (Django creates one cache instance per thread).
+stores = {}
+locks = {}
+stores_lock = threading.Lock()
+
+class LRUMemoryCache(BaseCache):
+	def __init__(self, name, params):
+		BaseCache.__init__(self, params)
+		with stores_lock:
+			self.store = stores.setdefault(name, OrderedDict())
+			self.lock = locks.setdefault(name, threading.Lock())
+
+	def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+		key = self.make_key(key, version=version)
+		self.validate_key(key)
+		pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+		with self.lock:
+			if self._lookup(key) is not None:
+				return False
+			self._set(key, pickled, timeout)
+			return True
+
+	def get(self, key, default=None, version=None):
+		key = self.make_key(key, version=version)
+		self.validate_key(key)
+		with self.lock:
+			pickled = self._lookup(key)
+		if pickled is None:
+			return default
+		return pickle.loads(pickled)
+
+	def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+		key = self.make_key(key, version=version)
+		self.validate_key(key)
+		pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+		with self.lock:
+			self._set(key, pickled, timeout)
+
+	def incr(self, key, delta=1, version=None):
+		key = self.make_key(key, version=version)
+		self.validate_key(key)
+		with self.lock:
+			pickled = self._lookup(key)
+			if pickled is None:
+				raise ValueError("Key '%s' not found" % key)
+			value = pickle.loads(pickled) + delta
+			self.store[key] = (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.store[key][1])
+		return value
+
+	def has_key(self, key, version=None):
+		key = self.make_key(key, version=version)
+		self.validate_key(key)
+		with self.lock:
+			return self._lookup(key) is not None
+
+	def delete(self, key, version=None):
+		key = self.make_key(key, version=version)
+		self.validate_key(key)
+		with self.lock:
+			self.store.pop(key, None)
+
+	def clear(self):
+		with self.lock:
+			self.store.clear()
+
+	def _lookup(self, key):
+		# Returns the pickled value of KEY and marks it as the most recently used entry, or returns None (dropping the entry) if KEY is
+		# missing or expired. Must be called with the lock held.
+		try:
+			pickled, expires = self.store[key]
+		except KeyError:
+			return None
+		if expires is not None and expires <= time.time():
+			del self.store[key]
+			return None
+		self.store.move_to_end(key)
+		return pickled
+
+	def _set(self, key, pickled, timeout):
+		# Stores PICKLED under KEY as the most recently used entry, evicting the least recently used entries beyond MAX_ENTRIES. Must be
+		# called with the lock held.
+		self.store[key] = (pickled, self.get_backend_timeout(timeout))
+		self.store.move_to_end(key)
+		while len(self.store) > self._max_entries:
+			self.store.popitem(last=False)
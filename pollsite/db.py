@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from pollsite.routers import record_write
+from concurrent.futures import Future
+import threading
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+# Production SQLite mode for Pollsite (POLLSITE_SQLITE_PRODUCTION). Every new SQLite connection is switched to write-ahead logging, so that
+# readers never block the writer or each other, with SYNCHRONOUS=NORMAL (durable at checkpoints, safe with WAL) and a busy timeout of
+# POLLSITE_SQLITE_BUSY_TIMEOUT_MS. Connections are kept open across requests by CONN_MAX_AGE (see settings).
+#
+# SQLite allows one writer at a time, and a transaction that reads before it writes (like RECORD_VOTE) fails with "database is locked"
+# right away, without waiting for the busy timeout, if another connection started writing after its read. So the vote, create and remove
+# writes of the POLLS views go through SERIALIZED_WRITE, which hands them to a single writer thread per process; reads stay concurrent.
+# Writes of separate processes still meet in SQLite and rely on the busy timeout.
+
+def sqlite_production_mode():
+	return getattr(settings, 'POLLSITE_SQLITE_PRODUCTION', False)
+
+def configure_sqlite(sender, connection, **kwargs):
+	# Applies the production PRAGMAs to a new SQLite CONNECTION.
+	if connection.vendor != 'sqlite' or not sqlite_production_mode():
+		return
+	cursor = connection.connection.cursor()
+	try:
+		cursor.execute('PRAGMA journal_mode=WAL')
+		cursor.execute('PRAGMA synchronous=NORMAL')
+		cursor.execute('PRAGMA busy_timeout=%d' % getattr(settings, 'POLLSITE_SQLITE_BUSY_TIMEOUT_MS', 5000))
+	finally:
+		cursor.close()
+
+connection_created.connect(configure_sqlite)
+
+class SerializedWriter(object):
+	# A daemon thread running submitted write functions one at a time on its own database connection.
+	def __init__(self):
+		self.jobs = queue.Queue()
+		self.thread = threading.Thread(target=self.work, name='pollsite-writer')
+		self.thread.daemon = True
+		self.thread.start()
+
+	def submit(self, function, args, kwargs):
+		# Queues FUNCTION(*ARGS, **KWARGS) and returns a Future of its result.
+		future = Future()
+		self.jobs.put((future, function, args, kwargs))
+		return future
+
+	def stop(self):
+		# Lets the thread finish the queued writes, close its connection and exit.
+		self.jobs.put(None)
+		self.thread.join()
+
+	def work(self):
+		try:
+			while True:
+				job = self.jobs.get()
+				if job is None:
+					return
+				future, function, args, kwargs = job
+				if not future.set_running_or_notify_cancel():
+					continue
+				try:
+					future.set_result(function(*args, **kwargs))
+				except BaseException as error:
+					future.set_exception(error)
+				connection.close_if_unusable_or_obsolete()
+		finally:
+			connection.close()
+
+writer = None
+writer_lock = threading.Lock()
+
+def serialized_write(function, *args, **kwargs):
+	# Runs the write FUNCTION(*ARGS, **KWARGS) on the process's writer thread and returns its result (or raises its exception) in production
+	# SQLite mode, and directly otherwise.
+	global writer
+	if not sqlite_production_mode() or connection.vendor != 'sqlite':
+		return function(*args, **kwargs)
+	with writer_lock:
+		if writer is None:
+			writer = SerializedWriter()
+	if threading.current_thread() is writer.thread:
+		return function(*args, **kwargs)
+	# The writer thread's writes are not seen by the replica router of this (the request's) thread, so they are recorded here.
+	record_write()
+	return writer.submit(function, args, kwargs).result()
+
+def stop_serialized_writer():
+	# Stops the process's writer thread, if there is one; the next serialized write starts a new one.
+	global writer
+	with writer_lock:
+		if writer is not None:
+			writer.stop()
+			writer = None
@@ -0,0 +1,201 @@
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from timeit import default_timer
+import logging
+import threading
+
+# Request instrumentation for Pollsite. MetricsMiddleware times every request and counts the SQL queries it issues (and the time they take)
+# on every database connection, and records them per URL name ('polls:vote_poll', 'users:processing_login', ...) in METRICS. The
+# METRICS_VIEW serves them in the Prometheus text format to staff users, or to scrapers presenting POLLSITE_METRICS_TOKEN as a bearer token.
+# Requests with more than POLLSITE_SLOW_REQUEST_QUERIES queries or slower than POLLSITE_SLOW_REQUEST_MS milliseconds are logged to the
+# 'pollsite.metrics' logger together with their queries (the first MAX_LOGGED_QUERIES of them). Metrics are kept per process, so each worker
+# process is scraped on its own.
+#
+# Queries are counted by a thin wrapper around the cursors of every database connection, installed when the connection opens, which adds to
+# the running request of the connection's thread: Django's debug cursor and its queries log are left alone, so nothing is logged or
+# disconnected outside the request being measured, requests on other threads are measured on their own, and starting to measure a request
+# only takes a timer.
+
+logger = logging.getLogger('pollsite.metrics')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+MAX_LOGGED_QUERIES = 200
+
+class Histogram(object):
+	# Observations counted into BUCKETS (upper bounds), with their sum and count.
+	def __init__(self, buckets):
+		self.buckets = buckets
+		self.counts = [0] * len(buckets)
+		self.sum = 0
+		self.count = 0
+
+	def observe(self, value):
+		for i, bound in enumerate(self.buckets):
+			if value <= bound:
+				self.counts[i] += 1
+				break
+		self.sum += value
+		self.count += 1
+
+	def cumulative_counts(self):
+		# Returns (upper bound, number of observations at or below it) for every bucket, as Prometheus expects.
+		total, result = 0, []
+		for bound, count in zip(self.buckets, self.counts):
+			total += count
+			result.append((bound, total))
+		return result
+
+class ViewMetrics(object):
+	def __init__(self):
+		self.latency = Histogram(LATENCY_BUCKETS)
+		self.queries = Histogram(QUERY_BUCKETS)
+		self.sql_seconds = 0.0
+
+class MetricsRegistry(object):
+	# The request metrics of this process, per view name.
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.views = {}
+
+	def record(self, view, seconds, queries, sql_seconds):
+		with self.lock:
+			metrics = self.views.get(view)
+			if metrics is None:
+				metrics = self.views[view] = ViewMetrics()
+			metrics.latency.observe(seconds)
+			metrics.queries.observe(queries)
+			metrics.sql_seconds += sql_seconds
+
+	def reset(self):
+		with self.lock:
+			self.views = {}
+
+	def render(self):
+		# Returns the metrics in the Prometheus text exposition format.
+		lines = []
+		with self.lock:
+			views = sorted(self.views.items())
+			for name, help_text, histogram in (
+					('pollsite_request_duration_seconds', 'Request latency in seconds, by view.', lambda metrics: metrics.latency),
+					('pollsite_request_queries', 'SQL queries per request, by view.', lambda metrics: metrics.queries)):
+				lines.append('# HELP %s %s' % (name, help_text))
+				lines.append('# TYPE %s histogram' % name)
+				for view, metrics in views:
+					label = 'view="%s"' % escape_label(view)
+					for bound, count in histogram(metrics).cumulative_counts():
+						lines.append('%s_bucket{%s,le="%s"} %d' % (name, label, bound, count))
+					lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, label, histogram(metrics).count))
+					lines.append('%s_sum{%s} %s' % (name, label, repr(float(histogram(metrics).sum))))
+					lines.append('%s_count{%s} %d' % (name, label, histogram(metrics).count))
+			lines.append('# HELP pollsite_request_sql_seconds_total Time spent in SQL queries in seconds, by view.')
+			lines.append('# TYPE pollsite_request_sql_seconds_total counter')
+			for view, metrics in views:
+				lines.append('pollsite_request_sql_seconds_total{view="%s"} %s' % (escape_label(view), repr(metrics.sql_seconds)))
+		return '\n'.join(lines) + '\n'
+
+def escape_label(value):
+	return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+metrics = MetricsRegistry()
+
+class RequestQueries(object):
+	# The queries of one request: their number, their total time in seconds and the first MAX_LOGGED_QUERIES of them as (seconds, SQL).
+	def __init__(self):
+		self.count = 0
+		self.seconds = 0.0
+		self.logged = []
+
+	def record(self, connection, cursor, sql, params, seconds):
+		self.count += 1
+		self.seconds += seconds
+		if len(self.logged) < MAX_LOGGED_QUERIES:
+			self.logged.append((seconds, connection.ops.last_executed_query(cursor, sql, params)))
+
+current = threading.local()
+
+class CountingCursor(object):
+	# Wraps a CURSOR of CONNECTION, adding the queries it executes to the running request of the current thread (if any).
+	def __init__(self, cursor, connection):
+		self.cursor = cursor
+		self.connection = connection
+
+	def __getattr__(self, attr):
+		return getattr(self.cursor, attr)
+
+	def __iter__(self):
+		return iter(self.cursor)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		return self.cursor.__exit__(type, value, traceback)
+
+	def execute(self, sql, params=None):
+		return self.measure(self.cursor.execute, sql, params)
+
+	def executemany(self, sql, param_list):
+		return self.measure(self.cursor.executemany, sql, param_list)
+
+	def measure(self, method, sql, params):
+		start = default_timer()
+		try:
+			return method(sql, params)
+		finally:
+			queries = getattr(current, 'queries', None)
+			if queries is not None:
+				queries.record(self.connection, self.cursor, sql, params, default_timer() - start)
+
+def count_queries(sender, connection, **kwargs):
+	# Makes the cursors of CONNECTION counting cursors, once, as soon as it connects, so that measuring a request costs no per-connection
+	# setup.
+	if getattr(connection, '_metrics_counting', False):
+		return
+	make_cursor, make_debug_cursor = connection.make_cursor, connection.make_debug_cursor
+	connection.make_cursor = lambda cursor: CountingCursor(make_cursor(cursor), connection)
+	connection.make_debug_cursor = lambda cursor: CountingCursor(make_debug_cursor(cursor), connection)
+	connection._metrics_counting = True
+
+connection_created.connect(count_queries)
+
+class MetricsMiddleware(object):
+	# Measures every request from the first to the last middleware; it belongs at the top of MIDDLEWARE_CLASSES.
+	def __init__(self):
+		# Connections opened before the middleware was loaded count their queries from now on.
+		for connection in connections.all():
+			if connection.connection is not None:
+				count_queries(None, connection)
+
+	def process_request(self, request):
+		current.queries = request._metrics_queries = RequestQueries()
+		request._metrics_start = default_timer()
+
+	def process_response(self, request, response):
+		queries = getattr(request, '_metrics_queries', None)
+		if queries is None:
+			return response
+		seconds = default_timer() - request._metrics_start
+		current.queries = None
+		del request._metrics_queries
+		resolver_match = getattr(request, 'resolver_match', None)
+		view = resolver_match.view_name if resolver_match is not None else 'unresolved'
+		metrics.record(view, seconds, queries.count, queries.seconds)
+		if queries.count > getattr(settings, 'POLLSITE_SLOW_REQUEST_QUERIES', 50) or \
+				seconds * 1000 > getattr(settings, 'POLLSITE_SLOW_REQUEST_MS', 500):
+			logger.warning('Slow request %s %s (%s): %.1f ms, %d queries, %.1f ms in SQL:\n%s', request.method, request.path, view,
+				seconds * 1000, queries.count, queries.seconds * 1000,
+				'\n'.join('[%.3f] %s' % (query_seconds, sql) for query_seconds, sql in queries.logged))
+		return response
+
+def metrics_view(request):
+	# Serves the request metrics of this process in the Prometheus text format, to staff users and to requests carrying the bearer token
+	# POLLSITE_METRICS_TOKEN (if set).
+	token = getattr(settings, 'POLLSITE_METRICS_TOKEN', None)
+	authorization = request.META.get('HTTP_AUTHORIZATION', '')
+	if not (request.user.is_staff or (token and constant_time_compare(authorization, 'Bearer %s' % token))):
+		return HttpResponseForbidden()
+	return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,116 @@
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import caches
+from django.http import HttpResponse
+from collections import OrderedDict
+import math
+import threading
+import time
+
+# Rate limiting for Pollsite. POLLSITE_RATE_LIMITS maps URL names ('polls:processing_vote', ...) to (requests, seconds): each client may
+# make REQUESTS requests to that view in a burst, refilled at REQUESTS per SECONDS (a token bucket). Clients are counted by IP address and,
+# when logged in, also by user id, so neither rotating accounts from one address nor one account from many addresses gets around a limit.
+# RateLimitMiddleware checks the limits as soon as the view is known, before the view reads the database or hashes a password, and turns
+# away requests over a limit with a plain 429 carrying Retry-After. The address is checked first, so a flood from one address is turned away
+# without even loading its session.
+#
+# Buckets are kept per process in a bounded least-recently-used table (POLLSITE_RATE_LIMIT_MAX_KEYS entries), whose entries expire once
+# their bucket would be full again. With several worker processes, POLLSITE_RATE_LIMIT_CACHE can name a shared cache (e.g. memcached) to
+# keep the buckets in instead; its reads and writes are not atomic, so concurrent requests of one client may slip a few extra requests
+# through, which rate limiting can tolerate.
+
+def rate_limits():
+	return getattr(settings, 'POLLSITE_RATE_LIMITS', {})
+
+def refill(bucket, capacity, rate, now):
+	# Returns the tokens at NOW of BUCKET, a (tokens, time) pair, or of a new (full) bucket if BUCKET is None.
+	if bucket is None:
+		return capacity
+	tokens, updated = bucket[:2]
+	return min(capacity, tokens + (now - updated) * rate)
+
+class LocalBuckets(object):
+	# Token buckets of this process as (tokens, time, expiry time) entries, least recently used first.
+	def __init__(self, alias, max_keys):
+		self.alias = alias
+		self.max_keys = max_keys
+		self.buckets = OrderedDict()
+		self.lock = threading.Lock()
+
+	def take(self, key, capacity, rate, now):
+		# Takes a token from the bucket of KEY and returns 0, or returns the seconds until the bucket has a token again if it is empty.
+		# Expired entries are dropped from the least recently used end, and the table never grows beyond MAX_KEYS entries.
+		with self.lock:
+			tokens = refill(self.buckets.pop(key, None), capacity, rate, now)
+			wait = 0 if tokens >= 1 else (1 - tokens) / rate
+			if not wait:
+				tokens -= 1
+			self.buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+			while self.buckets and (len(self.buckets) > self.max_keys or next(iter(self.buckets.values()))[2] <= now):
+				self.buckets.popitem(last=False)
+			return wait
+
+class CacheBuckets(object):
+	# Token buckets kept in the Django cache ALIAS, shared by every process using it. Entries expire once their bucket would be full again.
+	def __init__(self, alias, max_keys):
+		self.alias = alias
+		self.max_keys = max_keys
+		self.cache = caches[alias]
+
+	def take(self, key, capacity, rate, now):
+		cache_key = 'ratelimit:%s' % key
+		tokens = refill(self.cache.get(cache_key), capacity, rate, now)
+		if tokens < 1:
+			return (1 - tokens) / rate
+		tokens -= 1
+		self.cache.set(cache_key, (tokens, now), int(math.ceil((capacity - tokens) / rate)) + 1)
+		return 0
+
+buckets = None
+buckets_lock = threading.Lock()
+
+def get_buckets():
+	# Returns the buckets of this process, created from the POLLSITE_RATE_LIMIT_CACHE and POLLSITE_RATE_LIMIT_MAX_KEYS settings on first use.
+	# If those settings have changed since, the buckets are replaced by empty ones.
+	global buckets
+	alias = getattr(settings, 'POLLSITE_RATE_LIMIT_CACHE', None)
+	max_keys = getattr(settings, 'POLLSITE_RATE_LIMIT_MAX_KEYS', 10000)
+	with buckets_lock:
+		if buckets is None or (buckets.alias, buckets.max_keys) != (alias, max_keys):
+			buckets = CacheBuckets(alias, max_keys) if alias else LocalBuckets(alias, max_keys)
+		return buckets
+
+def reset_rate_limits():
+	# Forgets every bucket of this process (the shared cache is left alone).
+	global buckets
+	with buckets_lock:
+		buckets = None
+
+def client_ip(request):
+	# Returns the address of REQUEST's client: the REMOTE_ADDR, or the request header named by POLLSITE_CLIENT_IP_HEADER (such as
+	# 'HTTP_X_REAL_IP') behind a reverse proxy that sets it.
+	header = getattr(settings, 'POLLSITE_CLIENT_IP_HEADER', None)
+	return (header and request.META.get(header, '').split(',')[0].strip()) or request.META.get('REMOTE_ADDR', '')
+
+class RateLimitMiddleware(object):
+	# Enforces POLLSITE_RATE_LIMITS. It belongs after SessionMiddleware, whose session gives the user id (read from the session itself, so
+	# no user is loaded) once the client's address is within its limit, and before any middleware with a PROCESS_VIEW that does work.
+	def process_view(self, request, view_func, view_args, view_kwargs):
+		resolver_match = getattr(request, 'resolver_match', None)
+		limit = rate_limits().get(resolver_match.view_name) if resolver_match is not None else None
+		if limit is None:
+			return None
+		requests, seconds = limit
+		capacity, rate, now = float(requests), requests / float(seconds), time.time()
+		buckets = get_buckets()
+		wait = buckets.take('%s:ip:%s' % (resolver_match.view_name, client_ip(request)), capacity, rate, now)
+		if not wait:
+			session = getattr(request, 'session', None)
+			user_id = session.get(SESSION_KEY) if session is not None else None
+			if user_id is not None:
+				wait = buckets.take('%s:user:%s' % (resolver_match.view_name, user_id), capacity, rate, now)
+		if not wait:
+			return None
+		response = HttpResponse('Too many requests, try again later.', status=429, content_type='text/plain')
+		response['Retry-After'] = str(int(math.ceil(wait)))
+		return response
@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+import random
+import threading
+import time
+
+# Read-replica routing for Pollsite. Databases in settings.DATABASES with a REPLICA_OF key naming the primary (the default database) are
+# replicas: ReplicaRouter sends reads to a random replica and all writes to the primary. Replicas lag behind the primary, so a client that
+# has just written is pinned to the primary for POLLSITE_REPLICA_PIN_SECONDS, so that they see their own vote, poll or removal:
+# ReplicaPinningMiddleware marks requests that write and gives their clients a cookie that keeps their reads on the primary until it
+# expires. Reads made inside a transaction on the primary, or after the current request has written, also stay on the primary, and so do
+# session reads, whose results are cached (cached_db sessions) and which must see a session as soon as it is written. Code that fills other
+# caches reads from the primary explicitly.
+
+PIN_COOKIE = 'pin_primary'
+
+state = threading.local()
+
+def replica_aliases():
+	return sorted(alias for alias, database in settings.DATABASES.items() if database.get('REPLICA_OF') == DEFAULT_DB_ALIAS)
+
+def pin_to_primary():
+	# Keeps the rest of the current thread's reads on the primary (until UNPIN).
+	state.pinned = True
+
+def record_write():
+	# Marks the current thread's request as having written, which pins its client to the primary (see REPLICAPINNINGMIDDLEWARE). Writes made
+	# on another thread on the request's behalf (see SERIALIZED_WRITE in pollsite/db.py) must be recorded by the request's thread.
+	state.wrote = True
+	pin_to_primary()
+
+def unpin():
+	state.pinned = False
+	state.wrote = False
+
+class ReplicaRouter(object):
+	def db_for_read(self, model, **hints):
+		replicas = replica_aliases()
+		if not replicas or getattr(state, 'pinned', False) or connections[DEFAULT_DB_ALIAS].in_atomic_block or \
+				model._meta.app_label == 'sessions':
+			return DEFAULT_DB_ALIAS
+		return random.choice(replicas)
+
+	def db_for_write(self, model, **hints):
+		record_write()
+		return DEFAULT_DB_ALIAS
+
+	def allow_relation(self, obj1, obj2, **hints):
+		databases = set([DEFAULT_DB_ALIAS] + replica_aliases())
+		return obj1._state.db in databases and obj2._state.db in databases
+
+	def allow_migrate(self, db, *args, **hints):
+		# Replicas get their schema from the primary.
+		return db not in replica_aliases()
+
+class ReplicaPinningMiddleware(object):
+	# Pins requests to the primary while their client's pin cookie is valid, and renews the cookie when a request writes. It belongs near the
+	# top of MIDDLEWARE_CLASSES, before anything that reads the database (such as sessions).
+	def process_request(self, request):
+		unpin()
+		try:
+			pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+		except ValueError:
+			pinned_until = 0
+		if pinned_until > time.time():
+			pin_to_primary()
+
+	def process_response(self, request, response):
+		if getattr(state, 'wrote', False) and replica_aliases():
+			seconds = getattr(settings, 'POLLSITE_REPLICA_PIN_SECONDS', 5)
+			response.set_cookie(PIN_COOKIE, '%.3f' % (time.time() + seconds), max_age=seconds, httponly=True)
+		unpin()
+		return response
@@ -0,0 +1,12 @@
+from pollsite.db import serialized_write
+
+# Session engines for Pollsite: Django's database-backed engines ('pollsite.sessions.db' and 'pollsite.sessions.cached_db') with their
+# writes made through SERIALIZED_WRITE (see pollsite/db.py), so that session saves and deletions go through the writer thread in
+# production SQLite mode like the other writes of a request. Sessions are still read on the request thread.
+
+class SerializedWritesMixin(object):
+	def save(self, must_create=False):
+		return serialized_write(super(SerializedWritesMixin, self).save, must_create)
+
+	def delete(self, session_key=None):
+		return serialized_write(super(SerializedWritesMixin, self).delete, session_key)
@@ -0,0 +1,5 @@
+from django.contrib.sessions.backends import cached_db
+from pollsite.sessions import SerializedWritesMixin
+
+class SessionStore(SerializedWritesMixin, cached_db.SessionStore):
+	pass
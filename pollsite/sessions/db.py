@@ -0,0 +1,5 @@
+from django.contrib.sessions.backends import db
+from pollsite.sessions import SerializedWritesMixin
+
+class SessionStore(SerializedWritesMixin, db.SessionStore):
+	pass
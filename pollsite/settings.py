@@ -41,10 +41,13 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'pollsite.metrics.MetricsMiddleware',
+    'pollsite.routers.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'pollsite.ratelimit.RateLimitMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.middleware.CachedAuthenticationMiddleware',
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -65,6 +68,75 @@ DATABASES = {
     }
 }
 
+# Production SQLite mode (see pollsite/db.py): WAL journaling, SYNCHRONOUS=NORMAL, a busy timeout of POLLSITE_SQLITE_BUSY_TIMEOUT_MS, database
+# connections kept open for POLLSITE_SQLITE_CONN_MAX_AGE seconds, and the writes of the site written by one writer thread per process: poll
+# votes, creations and removals, signups (with their search terms), logins (LAST_LOGIN and the new session), session saves and deletions, the
+# timed counter flushes of POLLS_VOTE_WRITE_BEHIND, and the corrections of reconcile_tallies --fix. Three kinds of writes are not serialized:
+# the rehash of an outdated password at login, which Django's authentication backend saves while checking the password, the writes of
+# management commands, which run in a process of their own and rely on the busy timeout like any other process, and the last counter flush at
+# shutdown, which runs once no more requests are served. Turn it on for deployments; the development server and tests use stock SQLite.
+
+POLLSITE_SQLITE_PRODUCTION = False
+
+POLLSITE_SQLITE_BUSY_TIMEOUT_MS = 5000
+
+POLLSITE_SQLITE_CONN_MAX_AGE = 600
+
+if POLLSITE_SQLITE_PRODUCTION:
+    DATABASES['default']['CONN_MAX_AGE'] = POLLSITE_SQLITE_CONN_MAX_AGE
+
+# Read replicas (see pollsite/routers.py): every database with 'REPLICA_OF': 'default' serves reads, and writes go to the default database.
+# Clients that have written read from the primary for POLLSITE_REPLICA_PIN_SECONDS, so they see their own writes despite replication lag.
+# Without replicas every query goes to the default database. To try it locally with a second SQLite file that is copied from db.sqlite3
+# (and in tests mirrors the default database), add:
+#
+# DATABASES['replica'] = {
+#     'ENGINE': 'django.db.backends.sqlite3',
+#     'NAME': os.path.join(BASE_DIR, 'db-replica.sqlite3'),
+#     'REPLICA_OF': 'default',
+#     'TEST': {'MIRROR': 'default'},
+# }
+
+DATABASE_ROUTERS = ['pollsite.routers.ReplicaRouter']
+
+POLLSITE_REPLICA_PIN_SECONDS = 5
+
+# Cache
+# Poll results are cached per poll in the POLLS_CACHE cache. The default is a bounded, least-recently-used local-memory cache (one per
+# process); deployments with several worker processes should point POLLS_CACHE at a shared backend such as memcached so that votes
+# invalidate the results every worker sees. Cached results expire after POLLS_RESULTS_TIMEOUT seconds.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'pollsite.cache.LRUMemoryCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+POLLS_CACHE = 'default'
+
+POLLS_RESULTS_TIMEOUT = 300
+
+# Sessions are stored in the database and users are read from it on every request, unless USERS_CACHE names a cache shared by every process
+# serving the site (e.g. memcached). Then sessions are kept in that cache and written through to the database, so reading a session costs no
+# query while it is cached, and users are cached there for USERS_USER_CACHE_TIMEOUT seconds (see USERS app's user_cache module). A
+# local-memory cache only suits a single process: logouts, flushed sessions and password changes would only reach the cache of the process
+# that handled them, so the USERS app's system checks warn about one. Either way, session writes go through the writer thread of production
+# SQLite mode (see pollsite/sessions).
+
+USERS_CACHE = None
+
+USERS_USER_CACHE_TIMEOUT = 300
+
+SESSION_ENGINE = 'pollsite.sessions.db'
+
+if USERS_CACHE:
+    SESSION_ENGINE = 'pollsite.sessions.cached_db'
+    SESSION_CACHE_ALIAS = USERS_CACHE
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.7/topics/i18n/
 
@@ -85,3 +157,132 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 STATIC_ROOT = '/home/jumichael/Pollsite/static'
+
+
+# Vote counters
+# With POLLS_VOTE_WRITE_BEHIND on, ballots are written immediately but Choice.votes/Question.total_votes changes are buffered in-process
+# and written in one transaction every POLLS_VOTE_FLUSH_INTERVAL_MS milliseconds or every POLLS_VOTE_FLUSH_MAX_VOTES votes.
+
+POLLS_VOTE_WRITE_BEHIND = False
+
+POLLS_VOTE_FLUSH_INTERVAL_MS = 500
+
+POLLS_VOTE_FLUSH_MAX_VOTES = 100
+
+# Number of counter rows (ChoiceShard) each Choice's votes are spread over. 1 keeps the counters on the Choice and Question rows; shard
+# rows are only read while this is above 1.
+
+POLLS_COUNTER_SHARDS = 1
+
+# Number of polls listed per page of a user's polls page.
+
+POLLS_PAGE_SIZE = 25
+
+# Rendered polls pages of logged-out viewers are cached (in the POLLS_CACHE cache) for up to POLLS_PAGE_CACHE_TIMEOUT seconds, and
+# invalidated as soon as one of the page owner's polls is created, removed or voted on.
+
+POLLS_ANONYMOUS_PAGE_CACHE = True
+
+POLLS_PAGE_CACHE_TIMEOUT = 300
+
+# Maximum number of poll ids accepted by one request to the batch poll results view.
+
+POLLS_RESULTS_BATCH_LIMIT = 100
+
+# The vote page refreshes its vote counts by polling the poll's results (an empty 304 while nobody votes) every
+# POLLS_RESULTS_POLL_INTERVAL_MS milliseconds (at least 1000). With POLLS_LIVE_RESULTS on, it follows a live results stream instead, which
+# holds a worker thread for as long as the page is open: only turn it on with an asynchronous server or workers to spare. Live results
+# streams send at most one update per POLLS_LIVE_INTERVAL_MS milliseconds and are closed (and reopened by the browser) after
+# POLLS_LIVE_STREAM_SECONDS seconds.
+
+POLLS_LIVE_RESULTS = False
+
+POLLS_RESULTS_POLL_INTERVAL_MS = 10000
+
+POLLS_LIVE_INTERVAL_MS = 1000
+
+POLLS_LIVE_STREAM_SECONDS = 300
+
+# The leaderboard lists the POLLS_LEADERBOARD_SIZE polls with the most voters and as many polls trending now. In the trending list, a
+# vote counts half as much every POLLS_TRENDING_HALF_LIFE_HOURS hours.
+
+POLLS_LEADERBOARD_SIZE = 20
+
+POLLS_TRENDING_HALF_LIFE_HOURS = 6
+
+# Per-minute vote activity of polls is kept for POLLS_ACTIVITY_MINUTE_RETENTION_HOURS hours, after which the compact_vote_activity command
+# folds it into per-hour activity. The activity view returns at most POLLS_ACTIVITY_MAX_BUCKETS minutes or hours at once.
+
+POLLS_ACTIVITY_MINUTE_RETENTION_HOURS = 48
+
+POLLS_ACTIVITY_MAX_BUCKETS = 1440
+
+# The in-memory filter of taken usernames and emails behind the signup form's availability checks is rebuilt from the database, on a
+# background thread, once it is USERS_AVAILABILITY_FILTER_MAX_AGE seconds old.
+
+USERS_AVAILABILITY_FILTER_MAX_AGE = 3600
+
+# Password hashing. New passwords are hashed with PBKDF2-SHA256 at USERS_PBKDF2_ITERATIONS iterations, and stored passwords with a lower
+# cost or another hasher are rehashed at login. Login and signup hash on a pool of USERS_HASHING_WORKERS threads (None: one per CPU) with up to
+# USERS_HASHING_QUEUE_DEPTH more hashes waiting; when the pool is full they answer 503 at once. USERS_HASHING_POOL = False hashes inline.
+
+PASSWORD_HASHERS = (
+    'users.hashing.TunablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.BCryptPasswordHasher',
+    'django.contrib.auth.hashers.SHA1PasswordHasher',
+    'django.contrib.auth.hashers.MD5PasswordHasher',
+    'django.contrib.auth.hashers.CryptPasswordHasher',
+)
+
+USERS_PBKDF2_ITERATIONS = 20000
+
+USERS_HASHING_POOL = True
+
+USERS_HASHING_WORKERS = None
+
+USERS_HASHING_QUEUE_DEPTH = 32
+
+# Request metrics (see pollsite/metrics.py), served at /metrics to staff users and to scrapers sending "Authorization: Bearer
+# <POLLSITE_METRICS_TOKEN>" if a token is set. Requests with more than POLLSITE_SLOW_REQUEST_QUERIES SQL queries or slower than
+# POLLSITE_SLOW_REQUEST_MS milliseconds are logged with their queries to the 'pollsite.metrics' logger.
+
+POLLSITE_METRICS_TOKEN = None
+
+POLLSITE_SLOW_REQUEST_QUERIES = 50
+
+POLLSITE_SLOW_REQUEST_MS = 500
+
+# Rate limits (see pollsite/ratelimit.py): URL name -> (requests, seconds) allowed per client IP address and per logged-in user. Buckets are
+# kept in a table of at most POLLSITE_RATE_LIMIT_MAX_KEYS clients per process, or in the cache POLLSITE_RATE_LIMIT_CACHE (shared by worker
+# processes) if set. Behind a reverse proxy, POLLSITE_CLIENT_IP_HEADER names the request header carrying the client's address.
+
+POLLSITE_RATE_LIMITS = {
+    'polls:processing_vote': (30, 60),
+    'polls:creating_poll': (30, 60),
+    'users:processing_login': (10, 60),
+    'users:processing_signup': (10, 60),
+}
+
+POLLSITE_RATE_LIMIT_MAX_KEYS = 10000
+
+POLLSITE_RATE_LIMIT_CACHE = None
+
+POLLSITE_CLIENT_IP_HEADER = None
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'pollsite': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
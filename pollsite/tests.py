@@ -0,0 +1,188 @@
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection, reset_queries, transaction
+from django.core.signals import request_started
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from django.contrib.sessions.models import Session
+from django.utils import timezone
+from polls.results import get_poll_results, results_cache
+from users.user_cache import get_cached_user, users_cache
+from pollsite.cache import LRUMemoryCache
+from pollsite.metrics import metrics
+from pollsite.routers import ReplicaRouter, ReplicaPinningMiddleware, PIN_COOKIE, unpin
+from pollsite.db import serialized_write, stop_serialized_writer
+from pollsite.ratelimit import LocalBuckets, reset_rate_limits
+
+# Tests for the site-wide pieces of Pollsite that do not belong to the users or polls applications.
+
+class LRUMemoryCacheTests(SimpleTestCase):
+	def test_least_recently_used_entry_is_evicted(self):
+		# Check that a full cache evicts the entry that was used least recently, not the one that was stored first.
+		cache = LRUMemoryCache('lru-test', {'OPTIONS': {'MAX_ENTRIES': 2}})
+		cache.clear()
+		cache.set('a', 1)
+		cache.set('b', 2)
+		cache.get('a')
+		cache.set('c', 3)
+		self.assertEqual(cache.get('a'), 1)
+		self.assertIsNone(cache.get('b'))
+		self.assertEqual(cache.get('c'), 3)
+		self.assertEqual(cache.incr('c'), 4)
+
+REPLICA_DATABASES = {
+	'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'primary.sqlite3'},
+	'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'replica.sqlite3', 'REPLICA_OF': 'default'},
+}
+
+@override_settings(DATABASES=REPLICA_DATABASES, POLLSITE_REPLICA_PIN_SECONDS=5)
+class ReplicaRouterTests(SimpleTestCase):
+	def setUp(self):
+		unpin()
+		self.addCleanup(unpin)
+		self.router = ReplicaRouter()
+		self.middleware = ReplicaPinningMiddleware()
+
+	def test_reads_go_to_replicas_and_writes_to_the_primary(self):
+		# Check that reads go to the replica until the thread writes, and that the replica never gets migrated.
+		self.assertEqual(self.router.db_for_read(User), 'replica')
+		self.assertEqual(self.router.db_for_write(User), 'default')
+		self.assertEqual(self.router.db_for_read(User), 'default')
+		self.assertTrue(self.router.allow_migrate('default', 'polls'))
+		self.assertFalse(self.router.allow_migrate('replica', 'polls'))
+		with override_settings(DATABASES={'default': REPLICA_DATABASES['default']}):
+			unpin()
+			self.assertEqual(self.router.db_for_read(User), 'default')
+
+	def test_writing_pins_the_client_to_the_primary(self):
+		# Check that a request that writes sets the pin cookie, and that requests carrying an unexpired pin cookie read from the primary.
+		request = RequestFactory().post('/')
+		self.middleware.process_request(request)
+		self.router.db_for_write(User)
+		response = self.middleware.process_response(request, HttpResponse())
+		self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 5)
+		self.assertEqual(self.router.db_for_read(User), 'replica')
+		request = RequestFactory().get('/')
+		request.COOKIES[PIN_COOKIE] = response.cookies[PIN_COOKIE].value
+		self.middleware.process_request(request)
+		self.assertEqual(self.router.db_for_read(User), 'default')
+		response = self.middleware.process_response(request, HttpResponse())
+		self.assertNotIn(PIN_COOKIE, response.cookies)
+		request = RequestFactory().get('/')
+		request.COOKIES[PIN_COOKIE] = '0'
+		self.middleware.process_request(request)
+		self.assertEqual(self.router.db_for_read(User), 'replica')
+
+	@override_settings(POLLSITE_SQLITE_PRODUCTION=True)
+	def test_serialized_writes_pin_the_client_to_the_primary(self):
+		# Check that a write handed to the writer thread of production SQLite mode still pins the request's client to the primary.
+		self.addCleanup(stop_serialized_writer)
+		request = RequestFactory().post('/')
+		self.middleware.process_request(request)
+		serialized_write(lambda: None)
+		self.assertEqual(self.router.db_for_read(User), 'default')
+		self.assertIn(PIN_COOKIE, self.middleware.process_response(request, HttpResponse()).cookies)
+
+@override_settings(DATABASES=REPLICA_DATABASES)
+class ReplicaRouterTransactionTests(TestCase):
+	def test_reads_in_transactions_go_to_the_primary(self):
+		# Check that reads inside a transaction on the primary (as every TestCase test runs in) stay on the primary.
+		unpin()
+		with transaction.atomic():
+			self.assertEqual(ReplicaRouter().db_for_read(User), 'default')
+
+@override_settings(DATABASES=REPLICA_DATABASES, USERS_CACHE='default')
+class ReplicaCacheFillTests(TransactionTestCase):
+	def test_cached_reads_come_from_the_primary(self):
+		# Check that results and users that get cached, and sessions, are read from the primary: the replica configured here has no
+		# connection, so any read routed to it would fail.
+		unpin()
+		self.addCleanup(unpin)
+		results_cache().clear()
+		users_cache().clear()
+		owner = User.objects.create_user('owner', 'owner@example.com', 'owner')
+		question = owner.question_set.create(text='Replica?', date_published=timezone.now(), total_votes=0)
+		unpin()
+		self.assertEqual(get_poll_results(question.id)['text'], 'Replica?')
+		self.assertEqual(get_cached_user(owner.id).username, 'owner')
+		self.assertEqual(ReplicaRouter().db_for_read(Session), 'default')
+		self.assertEqual(ReplicaRouter().db_for_read(User), 'replica')
+
+class MetricsTests(TestCase):
+	def setUp(self):
+		metrics.reset()
+
+	def test_metrics_per_view(self):
+		# Check that requests are recorded per URL name with their query counts, and that only staff users can read the metrics.
+		self.client.get(reverse('users:index'))
+		self.client.get(reverse('users:signup'))
+		self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+		User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+		self.client.login(username='admin', password='admin')
+		response = self.client.get(reverse('metrics'))
+		self.assertEqual(response.status_code, 200)
+		self.assertContains(response, 'pollsite_request_duration_seconds_count{view="users:index"} 1')
+		self.assertContains(response, 'pollsite_request_queries_bucket{view="users:signup",le="0"} 1')
+		self.assertContains(response, 'pollsite_request_sql_seconds_total{view="users:index"}')
+
+	@override_settings(POLLSITE_SLOW_REQUEST_QUERIES=0)
+	def test_slow_requests_are_logged_with_their_queries(self):
+		# Check that a request over the query threshold is logged together with its SQL.
+		User.objects.create_user('member', 'member@example.com', 'member')
+		self.client.login(username='member', password='member')
+		with self.assertLogs('pollsite.metrics', 'WARNING') as logs:
+			self.client.get(reverse('users:index'))
+		self.assertIn('(users:index)', logs.output[0])
+		self.assertIn('SELECT', logs.output[0])
+
+	def test_queries_are_counted_without_the_debug_cursor(self):
+		# Check that requests count their queries without logging them in the connection's queries log, and that Django's receiver that
+		# clears that log when a request starts stays connected.
+		User.objects.create_user('member', 'member@example.com', 'member')
+		self.client.login(username='member', password='member')
+		connection.queries_log.clear()
+		self.client.get(reverse('users:index'))
+		self.client.get(reverse('users:index'))
+		self.assertEqual(len(connection.queries_log), 0)
+		self.assertIn(reset_queries, [receiver() for key, receiver in request_started.receivers])
+		self.assertEqual(metrics.views['users:index'].queries.count, 2)
+		self.assertGreater(metrics.views['users:index'].queries.sum, 0)
+
+@override_settings(POLLSITE_RATE_LIMITS={'users:processing_login': (2, 60), 'polls:processing_vote': (1, 60)})
+class RateLimitTests(TestCase):
+	def setUp(self):
+		reset_rate_limits()
+		self.addCleanup(reset_rate_limits)
+
+	def test_requests_over_the_limit_get_429(self):
+		# Check that a client IP address gets its burst of logins and then a 429 with Retry-After without any query, that other addresses
+		# are not affected, that logged-in users are also limited across addresses, and that an address over its limit is turned away
+		# before its session is read.
+		url, credentials = reverse('users:processing_login'), {'username': 'member', 'password': 'wrong'}
+		self.assertEqual(self.client.get(url, credentials).status_code, 302)
+		self.assertEqual(self.client.get(url, credentials).status_code, 302)
+		with self.assertNumQueries(0):
+			response = self.client.get(url, credentials)
+		self.assertEqual(response.status_code, 429)
+		self.assertEqual(response['Retry-After'], '30')
+		self.assertEqual(self.client.get(url, credentials, REMOTE_ADDR='10.0.0.2').status_code, 302)
+		User.objects.create_user('member', 'member@example.com', 'member')
+		self.client.login(username='member', password='member')
+		url = reverse('polls:processing_vote', args=(1,))
+		self.assertEqual(self.client.post(url, REMOTE_ADDR='10.0.0.3').status_code, 404)
+		self.assertEqual(self.client.post(url, REMOTE_ADDR='10.0.0.4').status_code, 429)
+		with self.assertNumQueries(0):
+			self.assertEqual(self.client.post(url, REMOTE_ADDR='10.0.0.3').status_code, 429)
+
+	def test_local_buckets_are_bounded_and_expire(self):
+		# Check that the bucket table keeps at most MAX_KEYS clients and drops buckets that have refilled.
+		buckets = LocalBuckets(None, 2)
+		for key in ('a', 'b', 'c'):
+			self.assertEqual(buckets.take(key, 1.0, 0.5, 100.0), 0)
+		self.assertEqual(list(buckets.buckets), ['b', 'c'])
+		self.assertEqual(buckets.take('c', 1.0, 0.5, 101.0), 1.0)
+		buckets.take('d', 1.0, 0.5, 101.5)
+		self.assertEqual(list(buckets.buckets), ['c', 'd'])
+		self.assertEqual(buckets.take('c', 1.0, 0.5, 104.0), 0)
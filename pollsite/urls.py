@@ -1,5 +1,6 @@
 from django.conf.urls import patterns, include, url
 from django.contrib import admin
+from pollsite.metrics import metrics_view
 
 #The pollsite consists of two apps: a user authentication/authorization (USER) system and a voting system (POLLS).
 urlpatterns = patterns('',
@@ -9,4 +10,5 @@ urlpatterns = patterns('',
     url(r'^', include('users.urls', namespace='users')),
     url(r'^polls/', include('polls.urls', namespace='polls')),
     url(r'^admin/', include(admin.site.urls)),
+    url(r'^metrics$', metrics_view, name='metrics'),
 )
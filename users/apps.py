@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+# Application configuration for the USERS app.
+
+class UsersConfig(AppConfig):
+	name = 'users'
+	verbose_name = 'Users'
+
+	def ready(self):
+		# Connects the app's signal receivers and registers its system checks once all apps are loaded.
+		from users import receivers, checks
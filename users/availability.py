@@ -0,0 +1,126 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connection
+import hashlib
+import math
+import struct
+import threading
+import time
+
+# Username and email availability checks for the USERS app. Both are answered by indexed EXISTS queries (auth_user's unique username index
+# and the email index added by the app's migrations), never by hashing a password. The checks behind the AVAILABILITY view first ask
+# TAKEN_FILTER, an in-process Bloom filter of every username and email, which answers "certainly free" for most names being typed without a
+# query; only names the filter may have seen are looked up. Signups add their names to the filter, and it is rebuilt from the database once
+# it is USERS_AVAILABILITY_FILTER_MAX_AGE seconds old, which also picks up signups handled by other processes. The filter is built on a
+# background thread, never on a request thread; until it is built, and while it is rebuilt, every check is the exact EXISTS query.
+
+class BloomFilter(object):
+	# A Bloom filter of strings with CAPACITY expected members and a false positive rate of about ERROR_RATE once full. Membership tests
+	# never miss a member that was added; they may claim a non-member is present at about ERROR_RATE.
+	def __init__(self, capacity, error_rate=0.01):
+		self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+		self.hashes = max(int(round(self.size / float(capacity) * math.log(2))), 1)
+		self.bits = bytearray((self.size + 7) // 8)
+
+	def positions(self, value):
+		# Returns the bit positions of VALUE, derived from one SHA-1 digest by double hashing.
+		digest = hashlib.sha1(value.encode('utf-8')).digest()
+		first, second = struct.unpack('>QQ', digest[:16])
+		second |= 1
+		return [(first + i * second) % self.size for i in range(self.hashes)]
+
+	def add(self, value):
+		for position in self.positions(value):
+			self.bits[position // 8] |= 1 << (position % 8)
+
+	def __contains__(self, value):
+		return all(self.bits[position // 8] & (1 << (position % 8)) for position in self.positions(value))
+
+class TakenFilter(object):
+	# The Bloom filter of taken usernames and emails, built from the database on a background thread on first use and again once it is too
+	# old. Usernames and emails are kept apart by a prefix.
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		# Forgets the filter (a build under way still finishes), so that the next use builds a new one.
+		with self.lock:
+			self.bloom, self.built_at, self.builder, self.pending = None, 0, None, []
+
+	def current(self):
+		# Returns the filter, or None if it is not built or too old, starting a build if none is under way.
+		with self.lock:
+			if self.bloom is not None and time.time() - self.built_at <= getattr(settings, 'USERS_AVAILABILITY_FILTER_MAX_AGE', 3600):
+				return self.bloom
+			if self.builder is None:
+				self.builder = threading.Thread(target=self.rebuild, name='users-availability-filter')
+				self.builder.daemon = True
+				self.builder.start()
+			return None
+
+	def rebuild(self):
+		# Builds a new filter and puts it in use, with the names added while it was being built, unless the filter has been reset meanwhile.
+		# Runs on the builder thread, which closes its database connection when done.
+		started_at, bloom = time.time(), None
+		try:
+			bloom = self.build()
+		finally:
+			connection.close()
+			with self.lock:
+				if self.builder is threading.current_thread():
+					if bloom is not None:
+						for name in self.pending:
+							bloom.add(name)
+						self.bloom, self.built_at = bloom, started_at
+					self.builder, self.pending = None, []
+
+	def build(self):
+		# Returns a filter of all usernames and emails (two entries per user), sized for twice as many users as there are now so that
+		# signups fit before the next rebuild. The users are streamed in pages of primary keys rather than loaded at once, from the primary
+		# database, so that no recent signup is missing as it could be on a replica (see pollsite/routers.py).
+		users = User.objects.using(DEFAULT_DB_ALIAS)
+		bloom = BloomFilter(max(users.count() * 4, 1024))
+		last_id = 0
+		while True:
+			chunk = list(users.filter(id__gt=last_id).order_by('id').values_list('id', 'username', 'email')[:5000])
+			if not chunk:
+				return bloom
+			last_id = chunk[-1][0]
+			for user_id, username, email in chunk:
+				bloom.add('username:' + username)
+				if email:
+					bloom.add('email:' + email)
+
+	def add(self, username, email):
+		# Adds the USERNAME and EMAIL of a new or changed user to the filter, and to the one being built, if any.
+		names = ['username:' + username] + (['email:' + email] if email else [])
+		with self.lock:
+			for name in names:
+				if self.bloom is not None:
+					self.bloom.add(name)
+				if self.builder is not None:
+					self.pending.append(name)
+
+	def may_contain(self, kind, value):
+		# Returns whether VALUE of KIND ('username' or 'email') may be taken: False only if the filter is built and has never seen it.
+		bloom = self.current()
+		return bloom is None or '%s:%s' % (kind, value) in bloom
+
+taken_filter = TakenFilter()
+
+def username_taken(username):
+	# Returns whether USERNAME belongs to an existing user, with one indexed EXISTS query.
+	return User.objects.filter(username=username).exists()
+
+def email_taken(email):
+	# Returns whether EMAIL belongs to an existing user, with one indexed EXISTS query.
+	return User.objects.filter(email=email).exists()
+
+def username_available(username):
+	# Returns whether USERNAME is free, asking the database only if TAKEN_FILTER may have seen it.
+	return not taken_filter.may_contain('username', username) or not username_taken(username)
+
+def email_available(email):
+	# Returns whether EMAIL is free, asking the database only if TAKEN_FILTER may have seen it.
+	return not taken_filter.may_contain('email', email) or not email_taken(email)
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core import checks
+
+# System checks of the USERS app.
+
+# Cache backends whose entries live in the memory of one process.
+LOCAL_MEMORY_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache', 'pollsite.cache.LRUMemoryCache')
+
+@checks.register()
+def check_users_cache(app_configs, **kwargs):
+	# Warns when cached sessions or cached users (see USERS app's user_cache module) are kept in a local-memory cache, where a logout,
+	# flushed session or password change only reaches the process that handled it and other processes keep accepting the old session.
+	aliases = set()
+	if getattr(settings, 'USERS_CACHE', None):
+		aliases.add(settings.USERS_CACHE)
+	if settings.SESSION_ENGINE in ('django.contrib.sessions.backends.cache', 'django.contrib.sessions.backends.cached_db',
+			'pollsite.sessions.cached_db'):
+		aliases.add(settings.SESSION_CACHE_ALIAS)
+	return [checks.Warning(
+		"Sessions or users are cached in the local-memory cache '%s'." % alias,
+		hint='Point USERS_CACHE at a cache shared by every process serving the site (e.g. memcached), or leave it unset when running '
+			'more than one process.',
+		id='users.W001',
+	) for alias in sorted(aliases) if settings.CACHES.get(alias, {}).get('BACKEND') in LOCAL_MEMORY_BACKENDS]
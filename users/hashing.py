@@ -0,0 +1,94 @@
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+import threading
+
+# Password hashing for the USERS app's login and signup views. Hashing is CPU-bound, so instead of letting every request thread hash at
+# once, hashes run on a bounded pool of USERS_HASHING_WORKERS threads (PBKDF2 releases the GIL while it works) with at most
+# USERS_HASHING_QUEUE_DEPTH more waiting. When both are full, a hash is refused at once with HashingPoolBusy and the view answers 503,
+# rather than piling up requests whose clients will have given up by the time they are served. Database work stays on the request thread;
+# only the PBKDF2 computations of TunablePBKDF2PasswordHasher (the preferred hasher) are handed to the pool, so logins go through Django's
+# AUTHENTICATE as usual, with every authentication backend and the USER_LOGIN_FAILED signal. With USERS_HASHING_POOL off, hashes run inline
+# as before.
+#
+# The cost of new hashes is USERS_PBKDF2_ITERATIONS (see TunablePBKDF2PasswordHasher); passwords stored with a lower cost are rehashed at
+# the next successful login.
+
+class HashingPoolBusy(Exception):
+	# Raised when the hashing pool and its queue are full.
+	pass
+
+on_pool = threading.local()
+
+class HashingPool(object):
+	def __init__(self, workers, queue_depth):
+		self.workers = workers
+		self.queue_depth = queue_depth
+		self.executor = ThreadPoolExecutor(max_workers=workers)
+		self.slots = threading.BoundedSemaphore(workers + queue_depth)
+
+	def run(self, function, *args):
+		# Runs FUNCTION(*ARGS) on the pool and returns its result, or raises HashingPoolBusy without waiting if no slot is free.
+		if not self.slots.acquire(False):
+			raise HashingPoolBusy()
+		try:
+			future = self.executor.submit(run_on_pool, function, *args)
+		except Exception:
+			self.slots.release()
+			raise
+		future.add_done_callback(lambda future: self.slots.release())
+		return future.result()
+
+def run_on_pool(function, *args):
+	on_pool.active = True
+	return function(*args)
+
+hashing_pool = None
+hashing_pool_lock = threading.Lock()
+
+def get_hashing_pool():
+	# Returns the process's HashingPool, creating it from the USERS_HASHING_WORKERS (default: one per CPU) and USERS_HASHING_QUEUE_DEPTH
+	# settings on first use. If those settings have changed since, the pool is replaced; the old one finishes its hashes on its own.
+	global hashing_pool
+	workers = getattr(settings, 'USERS_HASHING_WORKERS', None) or multiprocessing.cpu_count()
+	queue_depth = getattr(settings, 'USERS_HASHING_QUEUE_DEPTH', 32)
+	with hashing_pool_lock:
+		if hashing_pool is None or (hashing_pool.workers, hashing_pool.queue_depth) != (workers, queue_depth):
+			if hashing_pool is not None:
+				hashing_pool.executor.shutdown(wait=False)
+			hashing_pool = HashingPool(workers, queue_depth)
+		return hashing_pool
+
+def hash_call(function, *args):
+	# Runs the hashing FUNCTION(*ARGS) on the hashing pool, or inline if USERS_HASHING_POOL is off or this is a pool thread already.
+	if getattr(settings, 'USERS_HASHING_POOL', True) and not getattr(on_pool, 'active', False):
+		return get_hashing_pool().run(function, *args)
+	return function(*args)
+
+def authenticate_user(username, password):
+	# Returns the User that AUTHENTICATE accepts USERNAME and PASSWORD for, or None; raises HashingPoolBusy if the hashing pool is full.
+	# Unknown usernames are hashed once too (by the ModelBackend), so that they take as long as known ones, and a correct password stored
+	# with an outdated hasher or a lower cost is rehashed.
+	return authenticate(username=username, password=password)
+
+def hash_password(password):
+	# Returns PASSWORD hashed for storing, hashed on the hashing pool; raises HashingPoolBusy if it is full.
+	return make_password(password)
+
+class TunablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+	# Django's PBKDF2-SHA256 hasher with the number of iterations taken from USERS_PBKDF2_ITERATIONS, so each deployment can set the cost
+	# of a login, and with every hash computed on the hashing pool (see HASH_CALL). Its hashes use the same algorithm name, so passwords
+	# stored by the stock hasher keep working and are rehashed with the configured cost when their owner next logs in, if it is higher:
+	# lowering USERS_PBKDF2_ITERATIONS never weakens stored hashes.
+	@property
+	def iterations(self):
+		return getattr(settings, 'USERS_PBKDF2_ITERATIONS', PBKDF2PasswordHasher.iterations)
+
+	def encode(self, password, salt, iterations=None):
+		return hash_call(super(TunablePBKDF2PasswordHasher, self).encode, password, salt, iterations)
+
+	def must_update(self, encoded):
+		algorithm, iterations, salt, hash = encoded.split('$', 3)
+		return int(iterations) < self.iterations
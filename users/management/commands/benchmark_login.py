@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import override_settings
+from polls.benchmarking import scratch_database, Stopwatch, percentile
+from users.hashing import HashingPoolBusy, authenticate_user
+from optparse import make_option
+import threading
+
+# Benchmark of concurrent logins with password hashing inline on the request threads and on the bounded hashing pool (USERS_HASHING_POOL).
+
+class Command(BaseCommand):
+	help = 'Measures logins/sec and p50/p99 login latency of concurrent logins with inline hashing and with the hashing pool.'
+	option_list = BaseCommand.option_list + (
+		make_option('--threads', type='int', default=32, help='Number of concurrently logging-in threads (request workers).'),
+		make_option('--logins', type='int', default=20, help='Logins per thread.'),
+		make_option('--workers', type='int', default=None, help='USERS_HASHING_WORKERS for the pooled run (default: the setting).'),
+		make_option('--queue-depth', type='int', default=None, help='USERS_HASHING_QUEUE_DEPTH for the pooled run (default: the setting).'),
+	)
+
+	def handle(self, *args, **options):
+		pool_settings = {'USERS_HASHING_POOL': True}
+		if options['workers']:
+			pool_settings['USERS_HASHING_WORKERS'] = options['workers']
+		if options['queue_depth'] is not None:
+			pool_settings['USERS_HASHING_QUEUE_DEPTH'] = options['queue_depth']
+		with scratch_database(on_disk=True):
+			encoded = make_password('benchmark')
+			User.objects.bulk_create([User(username='login%d' % i, password=encoded) for i in range(options['threads'])])
+			for label, overrides in (('inline', {'USERS_HASHING_POOL': False}), ('pool', pool_settings)):
+				with override_settings(**overrides):
+					rate, latencies, rejected = self.run(options)
+				self.stdout.write('%-6s %6.1f logins/sec, p50 %6.1f ms, p99 %6.1f ms, %d rejected' % (label, rate,
+					percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000, rejected))
+
+	def run(self, options):
+		# Has every thread log in LOGINS times, and returns the rate of successful logins, the latency of every login attempt (rejected ones
+		# included) and the number of attempts rejected because the hashing pool was full.
+		start = threading.Barrier(options['threads'])
+		latencies, rejected, lock = [], [0], threading.Lock()
+		def log_in(index):
+			try:
+				start.wait()
+				for i in range(options['logins']):
+					with Stopwatch() as stopwatch:
+						try:
+							authenticate_user('login%d' % index, 'benchmark')
+							busy = False
+						except HashingPoolBusy:
+							busy = True
+					with lock:
+						latencies.append(stopwatch.elapsed)
+						rejected[0] += busy
+			finally:
+				connection.close()
+		threads = [threading.Thread(target=log_in, args=(i,)) for i in range(options['threads'])]
+		with Stopwatch() as stopwatch:
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+		return (len(latencies) - rejected[0]) / stopwatch.elapsed, latencies, rejected[0]
@@ -0,0 +1,10 @@
+from django.utils.functional import SimpleLazyObject
+from users.user_cache import get_session_user
+
+# Middleware of the USERS app.
+
+class CachedAuthenticationMiddleware(object):
+	# Replacement for django.contrib.auth's AuthenticationMiddleware that reads REQUEST.USER through the user cache (see USERS app's
+	# user_cache module). The user is looked up once per request, when first used.
+	def process_request(self, request):
+		request.user = SimpleLazyObject(lambda: get_session_user(request))
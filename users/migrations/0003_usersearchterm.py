@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+
+# Users are indexed in chunks of this many, walking the user table by primary key.
+CHUNK_SIZE = 5000
+USERNAME, NAME = 0, 1
+
+
+def normalize(text):
+    return ' '.join(text.lower().split())[:100]
+
+
+def index_existing_users(apps, schema_editor):
+    # Creates the search terms of every existing user, as USERS app's search module does for new ones: the lowercased username (USERNAME)
+    # and first, last and full name (NAME).
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    UserSearchTerm = apps.get_model('users', 'UserSearchTerm')
+    last_id = 0
+    while True:
+        chunk = list(User.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'username', 'first_name', 'last_name')[:CHUNK_SIZE])
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+        terms = []
+        for user_id, username, first_name, last_name in chunk:
+            names = set(normalize(name) for name in (first_name, last_name, '%s %s' % (first_name, last_name)))
+            terms.append(UserSearchTerm(user_id=user_id, term=normalize(username), kind=USERNAME))
+            terms.extend(UserSearchTerm(user_id=user_id, term=name, kind=NAME) for name in sorted(names) if name)
+        UserSearchTerm.objects.bulk_create(terms)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('users', '0002_auto_20141228_1129'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchTerm',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('term', models.CharField(max_length=100, db_index=True)),
+                ('kind', models.SmallIntegerField(choices=[(0, 'username'), (1, 'name')])),
+                ('user', models.ForeignKey(to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.RunPython(index_existing_users, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.conf import settings
+
+
+# auth_user has no index on EMAIL, which signup checks for every new account. auth_user belongs to django.contrib.auth, so the index is
+# created with SQL rather than through a model change. The statements are given as lists, which RunSQL runs as they are (a plain string
+# would need sqlparse to be split).
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('users', '0003_usersearchterm'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            ['CREATE INDEX users_auth_user_email ON auth_user (email)'],
+            ['DROP INDEX users_auth_user_email'],
+        ),
+    ]
@@ -1,4 +1,14 @@
 from django.db import models
+from django.contrib.auth.models import User
 
 
 # Create your models here.
+class UserSearchTerm(models.Model):
+	# A lowercased TERM under which USER is found by user search (see USERS app's search module): the user's username, first name, last name
+	# or full name, as told by KIND. Prefix searches are range scans of the TERM index.
+	USERNAME = 0
+	NAME = 1
+	KIND_CHOICES = ((USERNAME, 'username'), (NAME, 'name'))
+	user = models.ForeignKey(User)
+	term = models.CharField(max_length=100, db_index=True)
+	kind = models.SmallIntegerField(choices=KIND_CHOICES)
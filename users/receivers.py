@@ -0,0 +1,35 @@
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from users.search import index_user
+from users.availability import taken_filter
+from users.user_cache import invalidate_user
+
+# Signal receivers of the USERS app, connected by UsersConfig.ready (see USERS app's apps module).
+
+@receiver(post_save, sender=User)
+def reindex_user(sender, instance, raw, update_fields, **kwargs):
+	# Keeps the search terms of a user in sync with the user's username and names. Saves that only touch other fields (such as LAST_LOGIN on
+	# every login) leave the terms alone.
+	if raw or (update_fields and not set(update_fields) & set(['username', 'first_name', 'last_name'])):
+		return
+	index_user(instance)
+
+@receiver(post_save, sender=User)
+def remember_taken_names(sender, instance, **kwargs):
+	# Adds the username and email of a new or changed user to the availability filter (see USERS app's availability module). Names a user
+	# gives up stay in the filter until its next rebuild, which only costs a query when they are checked.
+	taken_filter.add(instance.username, instance.email)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+	# Drops the cached copy of a changed or deleted user (see USERS app's user_cache module).
+	invalidate_user(instance.id)
+
+@receiver(user_logged_out)
+def forget_logged_out_user(sender, request, user, **kwargs):
+	# Drops the cached copy of a user who logs out.
+	if user is not None:
+		invalidate_user(user.id)
@@ -0,0 +1,46 @@
+from django.contrib.auth.models import User
+from django.utils import six
+from users.models import UserSearchTerm
+
+# User search for the USERS app. Every user is indexed under a few lowercased terms (see the UserSearchTerm model): their username, first
+# name, last name and full name. A query matches the users with a term that starts with it, found by a range scan of the term index
+# (TERM >= query AND TERM < the next prefix) rather than a LIKE scan of the user table, and the matches are ranked with exact matches
+# first, usernames before names and shorter terms before longer ones.
+
+def search_terms(username, first_name, last_name):
+	# Returns the (term, kind) pairs a user with USERNAME, FIRST_NAME and LAST_NAME is indexed under.
+	terms = set([(normalize(username), UserSearchTerm.USERNAME)])
+	for name in (first_name, last_name, '%s %s' % (first_name, last_name)):
+		if normalize(name):
+			terms.add((normalize(name), UserSearchTerm.NAME))
+	return sorted(terms)
+
+def normalize(text):
+	# Returns TEXT lowercased with runs of whitespace collapsed, cut to the length of UserSearchTerm.term.
+	return ' '.join(text.lower().split())[:100]
+
+def index_user(user):
+	# Replaces the search terms of USER with ones for the user's current username and names.
+	UserSearchTerm.objects.filter(user=user).delete()
+	UserSearchTerm.objects.bulk_create([UserSearchTerm(user=user, term=term, kind=kind) \
+		for term, kind in search_terms(user.username, user.first_name, user.last_name)])
+
+def prefix_range(prefix):
+	# Returns the bounds (low, high) of the strings that start with PREFIX: every such string is >= PREFIX and < HIGH.
+	return prefix, prefix[:-1] + six.unichr(ord(prefix[-1]) + 1)
+
+def search_users(query, limit=20):
+	# Returns up to LIMIT users matching QUERY, best match first. At most a few times LIMIT terms are read, in term order, which puts exact
+	# and short matches first.
+	query = normalize(query)
+	if not query:
+		return []
+	low, high = prefix_range(query)
+	ranks = {}
+	for user_id, term, kind in UserSearchTerm.objects.filter(term__gte=low, term__lt=high).order_by('term') \
+			.values_list('user', 'term', 'kind')[:limit * 5]:
+		rank = (term != query, kind, len(term))
+		if user_id not in ranks or rank < ranks[user_id]:
+			ranks[user_id] = rank
+	users = User.objects.in_bulk(list(ranks))
+	return sorted(users.values(), key=lambda user: (ranks[user.id], user.username))[:limit]
@@ -1,8 +1,18 @@
-from django.test import TestCase, RequestFactory
+from django.test import TestCase, TransactionTestCase, RequestFactory
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout
-from users import views
+from django.contrib.auth.signals import user_login_failed
+from django.core.cache import cache
+from django.contrib.sessions.models import Session
+from django.db.models.signals import pre_save
+from users import views, availability, hashing
+from users.checks import check_users_cache
+from pollsite.ratelimit import reset_rate_limits
+from pollsite.db import stop_serialized_writer
+from django.test.utils import override_settings
+import threading
+import json
 
 # Create your tests here.
 # Tests for the user authentication/authorization application.
@@ -41,6 +51,8 @@ class UserTests(TestCase):
 		# Set up a request factory for the following tests. Note that setUp is called before EVERY test.
 		self.factory = RequestFactory()
 		self.user = make_user(True)
+		cache.clear()
+		reset_rate_limits()
 	def test_index_view(self):
 		# Check that the index view works.
 		response = self.client.get(reverse('users:index'))
@@ -138,3 +150,138 @@ class UserTests(TestCase):
 		self.assertContains(response, "notherQb's Polls", status_code=200)
 
 
+
+	def test_prefix_and_name_search(self):
+		# Check that searching by a prefix of a username or of a first, last or full name lists the matching users best match first, that a
+		# renamed user is found under the new name only, and that the autocomplete view suggests from the same index.
+		User.objects.create_user('montanafan', 'fan@gmail.com', password, first_name='Jerry', last_name='Rice')
+		User.objects.create_user('joey', 'joey@gmail.com', password, first_name='Joseph', last_name='Smith')
+		url = reverse('users:process_search', args=(self.user.id,))
+		response = self.client.get(url, {'search': 'Jo'})
+		self.assertEqual([user.username for user in response.context['users']], ['joey', username])
+		response = self.client.get(url, {'search': 'montana'})
+		self.assertEqual([user.username for user in response.context['users']], [username, 'montanafan'])
+		response = self.client.get(url, {'search': 'joe  MON'})
+		self.assertEqual([user.username for user in response.context['users']], [username])
+		self.user.last_name = 'Young'
+		self.user.save()
+		response = self.client.get(url, {'search': 'montana'})
+		self.assertEqual([user.username for user in response.context['users']], ['montanafan'])
+		response = self.client.get(url, {'search': 'nobody'}, follow=True)
+		self.assertContains(response, 'could not be found.')
+		response = self.client.get(reverse('users:autocomplete'), {'q': 'jerry r'})
+		self.assertEqual(json.loads(response.content.decode('utf-8')), {'users': [{'id': User.objects.get(username='montanafan').id, \
+			'username': 'montanafan', 'full_name': 'Jerry Rice'}]})
+
+	def test_failed_signup_with_taken_username_and_other_password(self):
+		# Check that a taken username is detected even if the new password differs from its owner's.
+		taken_username = dict(signup_creds)
+		taken_username['password'] = 'somethingelse'
+		taken_username['emailaddress'] = 'other@gmail.com'
+		response = attempt_signup(self, taken_username)
+		self.assertContains(response, 'This username is taken.', status_code=200)
+
+	def test_login_rehashes_password_with_new_cost(self):
+		# Check that a password stored with fewer PBKDF2 iterations than configured still logs in and is rehashed with the configured number,
+		# and that one stored with more is left alone.
+		with self.settings(USERS_PBKDF2_ITERATIONS=1000):
+			self.user.set_password(password)
+			self.user.save()
+		self.assertTrue(User.objects.get(pk=self.user.id).password.startswith('pbkdf2_sha256$1000$'))
+		with self.settings(USERS_PBKDF2_ITERATIONS=1500):
+			response = attempt_login(self, login_creds)
+		self.assertContains(response, 'Welcome, QB!', status_code=200)
+		self.assertTrue(User.objects.get(pk=self.user.id).password.startswith('pbkdf2_sha256$1500$'))
+		self.client.logout()
+		with self.settings(USERS_PBKDF2_ITERATIONS=1000):
+			response = attempt_login(self, login_creds)
+		self.assertContains(response, 'Welcome, QB!', status_code=200)
+		self.assertTrue(User.objects.get(pk=self.user.id).password.startswith('pbkdf2_sha256$1500$'))
+
+	def test_failed_login_sends_user_login_failed(self):
+		# Check that logins go through Django's authenticate, which signals failed attempts.
+		failures = []
+		def record_failure(sender, credentials, **kwargs):
+			failures.append(credentials['username'])
+		user_login_failed.connect(record_failure)
+		try:
+			self.client.get(reverse('users:processing_login'), {'username': username, 'password': 'wrong'})
+			self.client.get(reverse('users:processing_login'), {'username': 'nobody', 'password': 'wrong'})
+		finally:
+			user_login_failed.disconnect(record_failure)
+		self.assertEqual(failures, [username, 'nobody'])
+
+	@override_settings(USERS_HASHING_WORKERS=1, USERS_HASHING_QUEUE_DEPTH=0)
+	def test_login_when_hashing_pool_is_full(self):
+		# Check that a login is refused with a 503 while the hashing pool is full, and goes through once it has room again.
+		release = threading.Event()
+		blocker = threading.Thread(target=hashing.get_hashing_pool().run, args=(release.wait,))
+		blocker.start()
+		try:
+			while hashing.get_hashing_pool().slots.acquire(False):
+				hashing.get_hashing_pool().slots.release()
+			response = self.client.get(reverse('users:processing_login'), login_creds)
+			self.assertEqual(response.status_code, 503)
+			self.assertContains(response, 'Pollsite is busy right now.', status_code=503)
+		finally:
+			release.set()
+			blocker.join()
+		response = attempt_login(self, login_creds)
+		self.assertContains(response, 'Welcome, QB!', status_code=200)
+
+	def test_local_memory_users_cache_is_warned_about(self):
+		# Check that the system checks warn when sessions or users would be cached per process, and not when they are not cached.
+		self.assertEqual(check_users_cache(None), [])
+		with override_settings(USERS_CACHE='default', SESSION_ENGINE='pollsite.sessions.cached_db'):
+			self.assertEqual([warning.id for warning in check_users_cache(None)], ['users.W001'])
+
+# The availability filter is built on a background thread, which only sees committed users.
+
+class AvailabilityFilterTests(TransactionTestCase):
+	def setUp(self):
+		self.user = make_user(True)
+		reset_rate_limits()
+		availability.taken_filter.reset()
+		self.addCleanup(availability.taken_filter.reset)
+
+	def test_availability_check(self):
+		# Check that the availability view tells taken usernames and emails from free ones, with exact queries while the filter is built on
+		# a background thread, that free names are mostly answered without queries once it is built, and that a signup makes its names taken.
+		url = reverse('users:availability')
+		with self.assertNumQueries(1):
+			self.assertTrue(availability.username_available('free'))
+		builder = availability.taken_filter.builder
+		self.assertIsNotNone(builder)
+		response = self.client.get(url, {'username': username, 'email': email})
+		self.assertEqual(json.loads(response.content.decode('utf-8')), {'username': False, 'email': False})
+		builder.join()
+		free = [name for name in ('free%d' % i for i in range(50)) if not availability.taken_filter.may_contain('username', name)]
+		self.assertGreater(len(free), 40)
+		with self.assertNumQueries(0):
+			self.assertTrue(availability.username_available(free[0]))
+		another_user = dict(signup_creds)
+		another_user['username'] = free[0]
+		another_user['emailaddress'] = 'free@gmail.com'
+		attempt_signup(self, another_user)
+		response = self.client.get(url, {'username': free[0], 'email': 'free@gmail.com'})
+		self.assertEqual(json.loads(response.content.decode('utf-8')), {'username': False, 'email': False})
+		self.assertEqual(json.loads(self.client.get(url, {'username': 'free'}).content.decode('utf-8')), {'username': True})
+
+class SerializedWriteTests(TransactionTestCase):
+	@override_settings(POLLSITE_SQLITE_PRODUCTION=True)
+	def test_signup_login_and_sessions_write_on_the_writer_thread(self):
+		# Check that in production SQLite mode the user, LAST_LOGIN and session writes of signing up, logging out and logging in are all
+		# made by the writer thread.
+		writes = []
+		def record_write(sender, **kwargs):
+			writes.append((sender.__name__, threading.current_thread().name))
+		for model in (User, Session):
+			pre_save.connect(record_write, sender=model)
+			self.addCleanup(pre_save.disconnect, record_write, sender=model)
+		self.addCleanup(stop_serialized_writer)
+		reset_rate_limits()
+		self.assertContains(attempt_signup(self, signup_creds), 'Welcome, %s!' % username)
+		self.client.get(reverse('users:processing_logout'))
+		self.assertContains(attempt_login(self, login_creds), 'Welcome, %s!' % username)
+		self.assertEqual(set(model for model, thread in writes), set(['User', 'Session']))
+		self.assertEqual(set(thread for model, thread in writes), set(['pollsite-writer']))
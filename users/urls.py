@@ -5,8 +5,10 @@ urlpatterns = patterns('',
 	url(r'^$', views.index, name='index'),
 	url(r'^signup/$', views.signup, name='signup'),
 	url(r'^processingsignup/$', views.processing_signup, name='processing_signup'),
+	url(r'^availability/$', views.availability, name='availability'),
 	url(r'^processinglogin/$', views.processing_login, name='processing_login'),
 	url(r'^welcome/(?P<user_id>\d+)/$', views.welcome, name='welcome'),
 	url(r'^processinglogout/$', views.processing_logout, name='processing_logout'),
 	url(r'^process_search/from/(?P<user_id>\d+)/$', views.process_search, name='process_search'),
+	url(r'^autocomplete/$', views.autocomplete, name='autocomplete'),
 )
\ No newline at end of file
@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY
+from django.contrib.auth.models import User, AnonymousUser
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.http import Http404
+from django.utils.crypto import constant_time_compare
+
+# Cached users for the USERS and POLLS apps. Users are kept in the USERS_CACHE cache under their id for USERS_USER_CACHE_TIMEOUT seconds, so
+# that neither the session's user (see CachedAuthenticationMiddleware) nor the owners of the pages being viewed are read from the database on
+# every request. A user's entry is dropped whenever the user is saved or deleted and when the user logs out (see USERS app's receivers
+# module). The cache must be shared by all processes serving the site for those invalidations to reach every process, so without a
+# USERS_CACHE users are read from the database every time (see the USERS app's checks module).
+
+def users_cache():
+	# Returns the cache holding users (and cached sessions), or None if there is none.
+	alias = getattr(settings, 'USERS_CACHE', None)
+	return caches[alias] if alias else None
+
+def user_key(user_id):
+	return 'users:user:%s' % user_id
+
+def get_cached_user(user_id):
+	# Returns the User with USER_ID from the cache, reading and caching it on a miss (or reading it if there is no USERS_CACHE), or None if
+	# there is no such user. Users that get cached are read from the primary database, never from a lagging replica (see
+	# pollsite/routers.py).
+	cache = users_cache()
+	user = cache.get(user_key(user_id)) if cache is not None else None
+	if user is None:
+		users = User.objects.using(DEFAULT_DB_ALIAS) if cache is not None else User.objects
+		try:
+			user = users.get(pk=user_id)
+		except User.DoesNotExist:
+			return None
+		if cache is not None:
+			cache.set(user_key(user_id), user, getattr(settings, 'USERS_USER_CACHE_TIMEOUT', 300))
+	return user
+
+def get_user_or_404(request, user_id):
+	# Returns the User with USER_ID for a view of REQUEST: the session's user if it is that user, which costs nothing, and the cached user
+	# otherwise. Raises Http404 if there is no such user.
+	user_id = int(user_id)
+	if request.user.is_authenticated() and request.user.id == user_id:
+		return request.user
+	user = get_cached_user(user_id)
+	if user is None:
+		raise Http404('No User matches the given query.')
+	return user
+
+def invalidate_user(user_id):
+	cache = users_cache()
+	if cache is not None:
+		cache.delete(user_key(user_id))
+
+def get_session_user(request):
+	# Returns the user logged in to REQUEST's session, or an AnonymousUser, as django.contrib.auth.get_user does but with the user read
+	# through the cache. A session whose password hash no longer matches its user's (the password was changed) is flushed.
+	try:
+		user_id = User._meta.pk.to_python(request.session[SESSION_KEY])
+		backend_path = request.session[BACKEND_SESSION_KEY]
+	except KeyError:
+		return AnonymousUser()
+	user = get_cached_user(user_id) if backend_path in settings.AUTHENTICATION_BACKENDS else None
+	if user is None:
+		return AnonymousUser()
+	session_hash = request.session.get(HASH_SESSION_KEY)
+	if not (session_hash and constant_time_compare(session_hash, user.get_session_auth_hash())):
+		request.session.flush()
+		return AnonymousUser()
+	return user
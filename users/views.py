@@ -1,9 +1,17 @@
-from django.shortcuts import get_object_or_404, render
+from django.shortcuts import render
 from django.contrib.auth.models import User
-from django.contrib.auth import authenticate, login, logout
-from django.http import HttpResponseRedirect
+from django.contrib.auth import login, logout
+from django.http import HttpResponse, HttpResponseRedirect
 from django.core.urlresolvers import reverse
 from django.contrib import messages
+from users.search import search_users
+from users.user_cache import get_user_or_404
+from users.availability import username_taken, email_taken, username_available, email_available
+from users.hashing import HashingPoolBusy, authenticate_user, hash_password
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from pollsite.db import serialized_write
+import json
 
 #Views for the USERS app.
 
@@ -20,7 +28,10 @@ def signup(request):
 
 def processing_signup(request):
 # View for creating a new user who has just signed up; first checks that all fields are filled and that the desired username and email are free,
-# then creates a new User object and logs it in. Finally redirects to the user's WELCOME page.
+# then creates a new User object and logs it in. Finally redirects to the user's WELCOME page. Whether the username and email are free is
+# answered by indexed existence checks (see USERS app's availability module), so the password is only hashed once, to store it. The hash is
+# made on the hashing pool (see USERS app's hashing module); if the pool is full, the signup page is shown again with a 503. Saving the user and
+# logging them in are writes, made through SERIALIZED_WRITE (see pollsite/db.py).
 	firstname = request.POST['firstname']
 	lastname = request.POST['lastname']
 	emailaddress = request.POST['emailaddress']
@@ -32,29 +43,58 @@ def processing_signup(request):
 			creds.append(cred)
 	if len(creds) != 5:
 		error_message = 'You forgot to fill in some fields.'
-	elif authenticate(username=username, password=password) is not None:
+	elif username_taken(username):
 		error_message = 'This username is taken.'
-	elif User.objects.filter(email=emailaddress):
+	elif email_taken(emailaddress):
 		error_message = 'There is already an account associated with this email.'
 	else:
 		error_message = False
+	if not error_message:
+		try:
+			user = User(username=username, email=User.objects.normalize_email(emailaddress), first_name=firstname, last_name=lastname,
+				password=hash_password(password))
+		except HashingPoolBusy:
+			return busy(render(request, 'users/signup.html', {'error_message': 'Pollsite is busy right now. Please try again in a moment.'}))
+		try:
+			serialized_write(create_user, user)
+		except IntegrityError:
+			error_message = 'This username is taken.'
 	if error_message:
 		return render(request, 'users/signup.html', {'error_message': error_message})
-	user = User.objects.create_user(username, emailaddress, password, first_name=firstname, last_name=lastname)
-	user.save()
-	user = authenticate(username=username, password=password)
-	login(request, user)
+	user.backend = settings.AUTHENTICATION_BACKENDS[0]
+	serialized_write(login, request, user)
 	return HttpResponseRedirect(reverse('users:welcome', args=(user.id,)))
 
+def create_user(user):
+# Helper function for PROCESSING_SIGNUP that saves a new USER, and its search terms (see USERS app's receivers module), in one transaction.
+	with transaction.atomic():
+		user.save()
+
+def availability(request):
+# JSON view the signup form calls as the user types, telling whether the USERNAME and/or EMAIL in the query string are free. Most free names
+# are answered from an in-memory filter without a query (see USERS app's availability module).
+	result = {}
+	if request.GET.get('username'):
+		result['username'] = username_available(request.GET['username'])
+	if request.GET.get('email'):
+		result['email'] = email_available(request.GET['email'])
+	return HttpResponse(json.dumps(result), content_type='application/json')
+
 def processing_login(request):
 # View that authenticates an attempted login. It returns the user back to the INDEX (front) page if credentials are invalid or inactive.
-# Otherwise, the user is redirected to his/her WELCOME page.
+# Otherwise, the user is redirected to his/her WELCOME page. The password is checked on the hashing pool (see USERS app's hashing module); if the
+# pool is full, the INDEX page is shown with a warning and a 503 instead. Logging in writes the user's LAST_LOGIN and a new session, through
+# SERIALIZED_WRITE (see pollsite/db.py).
 	username = request.GET['username']
 	password = request.GET['password']
-	user = authenticate(username=username, password=password)
+	try:
+		user = authenticate_user(username, password)
+	except HashingPoolBusy:
+		messages.add_message(request, messages.INFO, 'Pollsite is busy right now. Please try again in a moment.')
+		return busy(render(request, 'users/index.html'))
 	if user is not None:
 		if user.is_active:
-			login(request, user)
+			serialized_write(login, request, user)
 			return HttpResponseRedirect(reverse('users:welcome', args=(user.id,)))
 		else:
 			messages.add_message(request, messages.INFO, 'This account is inactive.')
@@ -62,10 +102,16 @@ def processing_login(request):
 	messages.add_message(request, messages.INFO, 'The username or password you entered is incorrect.')
 	return HttpResponseRedirect(reverse('users:index'))
 
+def busy(response):
+# Helper function for the views above that turns RESPONSE into a 503 asking the client to retry in a second.
+	response.status_code = 503
+	response['Retry-After'] = '1'
+	return response
+
 def welcome(request, user_id):
 # View for a user's WELCOME page (the user's user_id is in the url pointing to this view). The view first checks that the user who is logged in
 # matches the user for which the WELCOME page is intended (so users cannot simply type in the right URL).
-	desired_user = get_object_or_404(User, pk=user_id)
+	desired_user = get_user_or_404(request, user_id)
 	if request.user != desired_user:
 		messages.add_message(request, messages.INFO, 'You are not authorized to view this page.')
 		if not request.user.is_authenticated():
@@ -79,12 +125,23 @@ def processing_logout(request):
 	return HttpResponseRedirect(reverse('users:index'))
 
 def process_search(request, user_id):
-	# View for processing a search query (search bar in a user's polls page). If the query matches an existing user's username,
-	# the view redirects to THAT user's polls page. Otherwise, it redirects to the current session user's polls page with an error message.
+	# View for processing a search query (search bar in a user's polls page). If the query is an existing user's username, the view redirects
+	# to THAT user's polls page. Otherwise, it lists the users whose username, first name, last name or full name starts with the query, best
+	# match first (see USERS app's search module), or redirects to the current session user's polls page with an error message if there are none.
 	search_query = request.GET['search']
 	try:
 		user = User.objects.get(username=search_query)
 	except User.DoesNotExist:
-		messages.add_message(request, messages.INFO, "The user you're looking for could not be found.")
-		return HttpResponseRedirect(reverse('polls:polls_page', args=(user_id,)))
+		users = search_users(search_query)
+		if not users:
+			messages.add_message(request, messages.INFO, "The user you're looking for could not be found.")
+			return HttpResponseRedirect(reverse('polls:polls_page', args=(user_id,)))
+		return render(request, 'users/search_results.html', {'search_query': search_query, 'users': users, 'user_id': user_id})
 	return HttpResponseRedirect(reverse('polls:polls_page', args=(user.id,)))
+
+def autocomplete(request):
+	# JSON view suggesting users for the search bar as the query in Q is typed: up to 10 users found by the same index as PROCESS_SEARCH, each
+	# with their id, username and full name.
+	users = search_users(request.GET.get('q', ''), limit=10)
+	return HttpResponse(json.dumps({'users': [{'id': user.id, 'username': user.username, 'full_name': user.get_full_name()} for user in users]}),
+		content_type='application/json')